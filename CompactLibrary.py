@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+
+import math
+import logging
+from array import array
+
+log = logging.getLogger(__name__)
+
+NAN = float('nan')
+
+class CompactStore():
+    '''
+    Array backed storage for a very large PicLibrary.
+    All file names are UTF-8 encoded into one string table. Files are rows in parallel arrays: the index of
+    their directory, the offset of their name in the string table, and their EXIF date and orientation. A file's name runs to the start of the next name.
+    Rows are never removed. A directory that changes is added again as a new CompactPicDir, and its old rows are left
+    unused until the next full scan.
+    There is one small CompactPicDir object per directory, but no per file objects. CompactPicFile views are created
+    when a file is looked at and thrown away again, so the garbage collector has almost nothing to track.
+    '''
+    def __init__(self):
+        self.names = bytearray()
+        self.name_offs = array('I', [0])
+        self.file_dirs = array('I')
+        self.file_dts = array('d') # NaN when not known
+        self.file_orientations = array('B') # 0 when not known
+        self.pic_dirs = []
+
+    def add_dir(self, rel_dir_name):
+        pic_dir = CompactPicDir(self, len(self.pic_dirs), rel_dir_name)
+        self.pic_dirs.append(pic_dir)
+        return pic_dir
+
+    def add_file(self, dir_idx, fname):
+        '''
+        Append a file row and return its file index
+        '''
+        self.names += fname.encode('utf-8', 'surrogateescape')
+        self.name_offs.append(len(self.names))
+        self.file_dirs.append(dir_idx)
+        self.file_dts.append(NAN)
+        self.file_orientations.append(0)
+        return len(self.file_dirs) - 1
+
+    def file_name(self, file_idx):
+        return self.names[self.name_offs[file_idx]:self.name_offs[file_idx + 1]].decode('utf-8', 'surrogateescape')
+
+    def size(self):
+        '''
+        Bytes held by the string table and arrays
+        '''
+        return (len(self.names) + self.name_offs.itemsize * len(self.name_offs)
+            + self.file_dirs.itemsize * len(self.file_dirs) + self.file_dts.itemsize * len(self.file_dts)
+            + self.file_orientations.itemsize * len(self.file_orientations))
+
+class CompactPicDir():
+    '''
+    A relative directory name and the range of file rows in the directory.
+    A directory's files must all be added before the next directory's, so they are contiguous.
+    '''
+    __slots__ = ('store', 'dir_idx', 'rel_dir_name', 'first_file_idx', 'file_cnt')
+
+    def __init__(self, store, dir_idx, rel_dir_name):
+        self.store = store
+        self.dir_idx = dir_idx
+        self.rel_dir_name = rel_dir_name
+        self.first_file_idx = len(store.file_dirs)
+        self.file_cnt = 0
+
+    def add_file(self, fname):
+        file_idx = self.store.add_file(self.dir_idx, fname)
+        self.file_cnt += 1
+        return CompactPicFile(self.store, file_idx)
+
+    @property
+    def pic_files(self):
+        return CompactFileList(self.store, range(self.first_file_idx, self.first_file_idx + self.file_cnt))
+
+class CompactPicFile():
+    '''
+    Lightweight view of one file row. Looks like a PicFile
+    '''
+    __slots__ = ('store', 'file_idx')
+
+    def __init__(self, store, file_idx):
+        self.store = store
+        self.file_idx = file_idx
+
+    @property
+    def file_name(self):
+        return self.store.file_name(self.file_idx)
+
+    @property
+    def pic_dir(self):
+        return self.store.pic_dirs[self.store.file_dirs[self.file_idx]]
+
+    @property
+    def dt(self):
+        dt = self.store.file_dts[self.file_idx]
+        return None if math.isnan(dt) else dt
+
+    @dt.setter
+    def dt(self, dt):
+        self.store.file_dts[self.file_idx] = NAN if dt is None else dt
+
+    @property
+    def orientation(self):
+        return self.store.file_orientations[self.file_idx] or None
+
+    @orientation.setter
+    def orientation(self, orientation):
+        self.store.file_orientations[self.file_idx] = orientation or 0
+
+    def __eq__(self, other):
+        return isinstance(other, CompactPicFile) and self.store is other.store and self.file_idx == other.file_idx
+
+    def __hash__(self):
+        return hash((id(self.store), self.file_idx))
+
+class CompactFileList():
+    '''
+    A list of CompactPicFile, held as an array of file indexes.
+    Supports what PicLibrary and random.shuffle need: len, indexing, item assignment, iteration, append, extend and copy.
+    '''
+    def __init__(self, store, file_idxs=()):
+        self.store = store
+        self.file_idxs = array('I', file_idxs)
+
+    def __len__(self):
+        return len(self.file_idxs)
+
+    def __getitem__(self, pos):
+        return CompactPicFile(self.store, self.file_idxs[pos])
+
+    def __setitem__(self, pos, pic_file):
+        self.file_idxs[pos] = pic_file.file_idx
+
+    def __iter__(self):
+        store = self.store
+        for file_idx in self.file_idxs:
+            yield CompactPicFile(store, file_idx)
+
+    def append(self, pic_file):
+        self.file_idxs.append(pic_file.file_idx)
+
+    def extend(self, pic_files):
+        if isinstance(pic_files, CompactFileList):
+            self.file_idxs.extend(pic_files.file_idxs)
+        else:
+            self.file_idxs.extend(pic_file.file_idx for pic_file in pic_files)
+
+    def copy(self):
+        return CompactFileList(self.store, self.file_idxs)
+
+    def remove_range(self, first_file_idx, end_file_idx):
+        '''
+        Remove the files with indexes first_file_idx up to end_file_idx, ie all the files of one CompactPicDir
+        '''
+        self.file_idxs = array('I', (file_idx for file_idx in self.file_idxs
+            if file_idx < first_file_idx or file_idx >= end_file_idx))
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+'''
+Render loop pacing for the picture frame. Kept free of pi3d, with the clock passed in, so the pacing can be run and
+benchmarked without a display.
+'''
+import time
+import logging
+from threading import Lock
+
+log = logging.getLogger(__name__)
+
+FPS = 20
+IDLE_FPS = 2 # Redraws while a picture is just being held, so a stuck frame is still noticed
+DIRTY_FRAMES = 2 # Frames drawn at full rate after a change. The display is double buffered
+STATS_SECS = 60.0
+LATE_FACTOR = 1.5 # A frame starting this many frame periods after the last one counts as dropped
+
+class FrameStats():
+    '''
+    Per period render loop timings: frames drawn, frames dropped, draw time and how long the show waited on the loader
+    '''
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self.start_tm = self.clock()
+        self.frame_cnt = 0
+        self.dropped_cnt = 0
+        self.draw_secs = []
+        self.loader_waits = []
+
+    def summary(self):
+        '''
+        The stats since the last reset as a dict
+        '''
+        def percentile(values, fraction):
+            if not values:
+                return 0.0
+            values = sorted(values)
+            return values[min(len(values) - 1, int(len(values) * fraction))]
+        elapsed = self.clock() - self.start_tm
+        return {
+            'secs': round(elapsed, 3),
+            'frames': self.frame_cnt,
+            'fps': round(self.frame_cnt / elapsed, 2) if elapsed > 0 else 0.0,
+            'dropped': self.dropped_cnt,
+            'draw_ms_p50': round(percentile(self.draw_secs, 0.5) * 1000, 2),
+            'draw_ms_p95': round(percentile(self.draw_secs, 0.95) * 1000, 2),
+            'draw_ms_max': round(max(self.draw_secs, default=0.0) * 1000, 2),
+            'loader_waits': len(self.loader_waits),
+            'loader_wait_ms_max': round(max(self.loader_waits, default=0.0) * 1000, 2),
+        }
+
+class FrameScheduler():
+    '''
+    Decides when the render loop draws. At fps while a fade is running or something on screen has changed
+    (mark_dirty()), at idle_fps while a picture is just held.
+    Fades are timed from the clock, so the fade alpha is smooth at whatever rate frames are actually drawn.
+    The process thread starts fades and marks changes, the render loop calls wait_frame() and frame_drawn().
+    '''
+    def __init__(self, fps=FPS, idle_fps=IDLE_FPS, clock=time.monotonic, sleep=time.sleep, stats_secs=STATS_SECS):
+        self.period = 1.0 / fps
+        self.idle_period = 1.0 / idle_fps
+        self.clock = clock
+        self.sleep = sleep
+        self.stats_secs = stats_secs
+        self.lock = Lock()
+        self.fade_start = None
+        self.fade_secs = 0.0
+        self.dirty_frames = DIRTY_FRAMES
+        self.last_frame_tm = None
+        self.last_busy = False
+        self.stats = FrameStats(clock)
+        self.stats_listeners = []
+
+    def start_fade(self, secs):
+        with self.lock:
+            self.fade_start = self.clock()
+            self.fade_secs = secs
+            self.dirty_frames = DIRTY_FRAMES
+
+    def fade_alpha(self):
+        '''
+        Alpha of the picture fading in. 1.0 when there's no fade running
+        '''
+        with self.lock:
+            if self.fade_start is None or self.fade_secs <= 0.0:
+                return 1.0
+            return min(1.0, (self.clock() - self.fade_start) / self.fade_secs)
+
+    def fading(self):
+        with self.lock:
+            if self.fade_start is None:
+                return False
+            if self.clock() - self.fade_start >= self.fade_secs:
+                # The frame with alpha 1.0 still has to reach the screen
+                self.fade_start = None
+                self.dirty_frames = max(self.dirty_frames, DIRTY_FRAMES)
+                return False
+            return True
+
+    def wait_fade(self):
+        '''
+        Block the calling thread until the running fade is complete
+        '''
+        with self.lock:
+            if self.fade_start is None:
+                return
+            remaining = self.fade_start + self.fade_secs - self.clock()
+        if remaining > 0.0:
+            self.sleep(remaining)
+
+    def mark_dirty(self):
+        with self.lock:
+            self.dirty_frames = DIRTY_FRAMES
+
+    def busy(self):
+        if self.fading():
+            return True
+        with self.lock:
+            return self.dirty_frames > 0
+
+    def wait_frame(self):
+        '''
+        Sleep until the next frame is due. Idle frames come at idle_fps, so may be cut short by a change.
+        Returns the time the frame was due
+        '''
+        while True:
+            now = self.clock()
+            if self.last_frame_tm is None:
+                return now
+            period = self.period if self.busy() else self.idle_period
+            due_tm = self.last_frame_tm + period
+            if now >= due_tm:
+                return now
+            # Wake at the full frame rate, to notice a change during an idle period
+            self.sleep(min(due_tm - now, self.period))
+
+    def frame_drawn(self, frame_tm, draw_secs):
+        '''
+        Record a frame drawn at frame_tm (from wait_frame()) that took draw_secs
+        '''
+        busy = self.busy()
+        # Only full rate frames can be late. An idle frame is meant to be a while after the last
+        if self.last_busy and busy and frame_tm - self.last_frame_tm > self.period * LATE_FACTOR:
+            self.stats.dropped_cnt += round((frame_tm - self.last_frame_tm) / self.period) - 1
+        self.last_frame_tm = frame_tm
+        self.last_busy = busy
+        with self.lock:
+            if self.dirty_frames > 0:
+                self.dirty_frames -= 1
+        self.stats.frame_cnt += 1
+        self.stats.draw_secs.append(draw_secs)
+        if self.clock() - self.stats.start_tm >= self.stats_secs:
+            self.report()
+
+    def loader_wait(self, secs):
+        '''
+        Record the show waiting secs for the next picture to load
+        '''
+        self.stats.loader_waits.append(secs)
+
+    def report(self):
+        summary = self.stats.summary()
+        log.info('Frames: %s' % ' '.join('%s=%s' % item for item in summary.items()))
+        for listener in self.stats_listeners:
+            listener(summary)
+        self.stats.reset()
+        return summary
+
+class FakeClock():
+    '''
+    A clock for running the scheduler without waiting. sleep() just moves the time on
+    '''
+    def __init__(self, start_tm=0.0):
+        self.now = start_tm
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += max(0.0, secs)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+'''
+Disk cache of display sized, upright pictures.
+Run as a script to pre-render a picture library into the cache while the frame is idle:
+    PicCache.py [--src DIR] [--cache DIR] [--display WxH] [--fill] [--max-mb N]
+'''
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import argparse
+from pathlib import Path
+from PIL import Image
+import PicImage
+
+log = logging.getLogger(__name__)
+
+CACHE_DIR = '/home/pi/.cache/pi_picframe'
+MAX_BYTES = 1024 * 1024 * 1024
+EVICT_TO = 0.9 # When over budget, evict down to this fraction of it, so it isn't needed on every add
+JPEG_QUALITY = 90
+
+class PicCache():
+    '''
+    Display sized, orientation corrected copies of pictures, saved as JPEGs under cache_dir.
+    Entries are keyed by source path + mtime + display size + fit mode, so a changed picture or display gets a new entry.
+    An SQLite table records each entry's size, last use, EXIF date and orientation. When the cache grows past
+    max_bytes the least recently used entries are deleted.
+    Safe to share between the frame and a warm-up process. Each call uses its own database connection.
+    '''
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.db_file = os.path.join(cache_dir, 'cache.db')
+        self.hit_cnt = 0
+        self.miss_cnt = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        con = self.connect()
+        try:
+            with con:
+                con.execute('''CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    bytes INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    dt REAL,
+                    orientation INTEGER NOT NULL
+                )''')
+                con.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+        finally:
+            con.close()
+
+    def connect(self):
+        return sqlite3.connect(self.db_file, timeout=30.0)
+
+    def key(self, path, display_size, fit):
+        mtime_ns = os.stat(path).st_mtime_ns
+        key_str = '%s|%s|%sx%s|%s' % (path, mtime_ns, display_size[0], display_size[1], 'fit' if fit else 'fill')
+        return hashlib.sha1(key_str.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.jpg')
+
+    def get(self, key):
+        '''
+        Return (im, dt, orientation) for a cached entry, None on a miss
+        '''
+        con = self.connect()
+        try:
+            row = con.execute('SELECT dt, orientation FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            try:
+                im = Image.open(self.entry_path(key))
+                im.load()
+            except OSError as e:
+                log.warning('Dropping unreadable cache entry %s: %s' % (key, e))
+                with con:
+                    con.execute('DELETE FROM entries WHERE key = ?', (key,))
+                return None
+            with con:
+                con.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+        finally:
+            con.close()
+        return im, row[0], row[1]
+
+    def put(self, key, im, dt, orientation):
+        '''
+        Save a display sized upright image, then evict if over budget
+        '''
+        entry_path = self.entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        tmp_path = entry_path + '.tmp'
+        im.convert('RGB').save(tmp_path, 'JPEG', quality=JPEG_QUALITY)
+        os.replace(tmp_path, entry_path)
+        con = self.connect()
+        try:
+            with con:
+                con.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                    (key, os.path.getsize(entry_path), time.time(), dt, orientation))
+        finally:
+            con.close()
+        self.evict()
+
+    def total_bytes(self):
+        con = self.connect()
+        try:
+            return con.execute('SELECT COALESCE(SUM(bytes), 0) FROM entries').fetchone()[0]
+        finally:
+            con.close()
+
+    def evict(self, max_bytes=None):
+        '''
+        Delete least recently used entries until under EVICT_TO of the budget
+        '''
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        con = self.connect()
+        try:
+            total_bytes = con.execute('SELECT COALESCE(SUM(bytes), 0) FROM entries').fetchone()[0]
+            if total_bytes <= max_bytes:
+                return
+            evict_bytes = total_bytes - int(max_bytes * EVICT_TO)
+            evicted = []
+            for key, entry_bytes in con.execute('SELECT key, bytes FROM entries ORDER BY last_used'):
+                if evict_bytes <= 0:
+                    break
+                evicted.append(key)
+                evict_bytes -= entry_bytes
+            with con:
+                con.executemany('DELETE FROM entries WHERE key = ?', ((key,) for key in evicted))
+        finally:
+            con.close()
+        for key in evicted:
+            try:
+                os.remove(self.entry_path(key))
+            except OSError:
+                pass
+        log.info('Cache evicted %s entries' % len(evicted))
+
+    def load_image(self, path, display_size, fit=True):
+        '''
+        Same as PicImage.load_image, but from the cache when possible. Misses are decoded and added to the cache
+        '''
+        key = self.key(path, display_size, fit)
+        entry = self.get(key)
+        if entry is not None:
+            self.hit_cnt += 1
+            im, dt, orientation = entry
+            im.putalpha(255)
+            return im, dt, orientation
+        self.miss_cnt += 1
+        im, dt, orientation = PicImage.load_image(path, display_size, fit)
+        try:
+            self.put(key, im, dt, orientation)
+        except (OSError, sqlite3.Error) as e:
+            log.warning('Could not cache %s: %s' % (path, e))
+        return im, dt, orientation
+
+    def warm(self, pic_lib, display_size, fit=True):
+        '''
+        Render every picture in a scanned PicLibrary that isn't already cached. Stops when the cache is full,
+        rather than evicting what it has just rendered.
+        '''
+        con = self.connect()
+        try:
+            cached = set(key for (key,) in con.execute('SELECT key FROM entries'))
+        finally:
+            con.close()
+        total_bytes = self.total_bytes()
+        done_cnt = 0
+        for pic_file in pic_lib.pic_files:
+            path = os.path.join(pic_lib.src_dir, pic_file.pic_dir.rel_dir_name, pic_file.file_name)
+            try:
+                key = self.key(path, display_size, fit)
+                if key in cached:
+                    continue
+                im, dt, orientation = PicImage.load_image(path, display_size, fit)
+                self.put(key, im, dt, orientation)
+                total_bytes += os.path.getsize(self.entry_path(key))
+            except Exception as e:
+                log.warning('Could not render %s: %s' % (path, e))
+                continue
+            done_cnt += 1
+            if done_cnt % 100 == 0:
+                log.info('Rendered %s   %.0f MB' % (done_cnt, total_bytes / 1e6))
+            if total_bytes >= self.max_bytes * EVICT_TO:
+                log.info('Cache full')
+                break
+        return done_cnt
+
+def main():
+    import PicLibrary as PLib
+    parser = argparse.ArgumentParser(description='Pre-render a picture library into the display size cache')
+    parser.add_argument('--src', default='/home/pi/Pictures', help='Picture directory')
+    parser.add_argument('--cache', default=CACHE_DIR, help='Cache directory')
+    parser.add_argument('--display', default='1920x1080', help='Display size WxH')
+    parser.add_argument('--fill', action='store_true', help='Pictures fill the display rather than fit it')
+    parser.add_argument('--max-mb', type=int, default=MAX_BYTES // (1024 * 1024), help='Cache size budget')
+    parser.add_argument('--nice', type=int, default=19, help='Run at this nice level, so the frame comes first')
+    args = parser.parse_args()
+    os.nice(args.nice)
+    log.info('Start')
+    pic_cache = PicCache(args.cache, args.max_mb * 1024 * 1024)
+    pic_lib = PLib.PicLibrary(args.src)
+    pic_lib.get_file_list(shuffle=True)
+    display_size = tuple(int(d) for d in args.display.split('x'))
+    done_cnt = pic_cache.warm(pic_lib, display_size, not args.fill)
+    log.info('Rendered %s of %s files. Cache %.0f MB' % (done_cnt, pic_lib.file_cnt, pic_cache.total_bytes() / 1e6))
+    log.info('End')
+
+if __name__ == "__main__":
+    # setup logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
+        level=logging.INFO
+        )
+    prog_name = Path(__file__).stem
+    log = logging.getLogger(name=prog_name)
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+
+import os
+import re
+import time
+import hashlib
+import logging
+import sqlite3
+from collections import defaultdict
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from PicSync import file_hash
+
+log = logging.getLogger(__name__)
+
+PARTIAL_BYTES = 64 * 1024 # Hashed from each end of a file. Different pictures of the same size nearly always differ here
+COPY_NAME_REGX = re.compile(r'.*(- ?Copy|\(\d+\)|-\d+)\.', re.IGNORECASE) # Names copies are often given
+
+def partial_hash(path, size):
+    '''
+    Hash of the first and last PARTIAL_BYTES of a file. Covers the whole file when it's no more than twice that
+    '''
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        h.update(f.read(PARTIAL_BYTES))
+        if size > PARTIAL_BYTES * 2:
+            f.seek(-PARTIAL_BYTES, os.SEEK_END)
+        h.update(f.read(PARTIAL_BYTES))
+    return h.hexdigest()
+
+def keep_order(rel_path):
+    '''
+    Sort key for the copies of a picture. The first is kept: one not named like a copy, else the first by path
+    '''
+    return (COPY_NAME_REGX.match(os.path.basename(rel_path)) is not None, rel_path)
+
+class PicDedup():
+    '''
+    Finds library files with the same content, whatever they are called.
+    Files are grouped by size, then files of the same size by a hash of their ends, and only files that still
+    match are fully hashed. Most files have a size no other file has, so are never read at all.
+    Hashes are cached in an SQLite table keyed by relative path, size and mtime, so a rescan only hashes changed files.
+    The table can live in the PicLibrary index file.
+    '''
+    def __init__(self, src_dir, cache_file=None, threads=4):
+        self.src_dir = src_dir
+        self.cache_file = cache_file
+        self.threads = threads
+        self.cache = {}
+        self.hash_cnt = 0
+        self.full_hash_cnt = 0
+
+    def connect(self):
+        con = sqlite3.connect(self.cache_file)
+        con.execute('''CREATE TABLE IF NOT EXISTS hashes (
+            rel_path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            partial_hash TEXT,
+            full_hash TEXT
+        )''')
+        return con
+
+    def load(self):
+        self.cache = {}
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return
+        try:
+            con = self.connect()
+            try:
+                for rel_path, size, mtime_ns, partial, full in con.execute('SELECT * FROM hashes'):
+                    self.cache[rel_path] = [size, mtime_ns, partial, full]
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            log.warning('Ignoring unreadable hash cache %s: %s' % (self.cache_file, e))
+            self.cache = {}
+
+    def save(self, entries):
+        if self.cache_file is None:
+            return
+        con = self.connect()
+        try:
+            with con:
+                con.execute('DELETE FROM hashes')
+                con.executemany('INSERT INTO hashes VALUES (?, ?, ?, ?, ?)',
+                    ((rel_path,) + tuple(entry) for rel_path, entry in entries.items()))
+        finally:
+            con.close()
+
+    def stat(self, rel_path):
+        try:
+            st = os.stat(os.path.join(self.src_dir, rel_path))
+        except OSError as e:
+            log.warning('Skipping %s: %s' % (rel_path, e))
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def hashes(self, entries, rel_paths, pool, full):
+        '''
+        Fill in the partial or full hash of each rel_path's entry, from the cache when its size and mtime match
+        '''
+        col = 3 if full else 2
+        todo = []
+        for rel_path in rel_paths:
+            entry = entries[rel_path]
+            cached = self.cache.get(rel_path)
+            if cached is not None and cached[:2] == entry[:2] and cached[col] is not None:
+                entry[col] = cached[col]
+            else:
+                todo.append(rel_path)
+        def hash_file(rel_path):
+            path = os.path.join(self.src_dir, rel_path)
+            try:
+                return file_hash(path) if full else partial_hash(path, entries[rel_path][0])
+            except OSError as e:
+                log.warning('Could not hash %s: %s' % (rel_path, e))
+                return None
+        for rel_path, hash_hex in zip(todo, pool.map(hash_file, todo)):
+            entries[rel_path][col] = hash_hex
+        if full:
+            self.full_hash_cnt += len(todo)
+        else:
+            self.hash_cnt += len(todo)
+
+    def find_groups(self, pic_files):
+        '''
+        Return a list of groups of PicFiles with the same content, each with the copy to keep first
+        '''
+        start_tm = time.time()
+        self.load()
+        self.hash_cnt = 0
+        self.full_hash_cnt = 0
+        files = dict((os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name), pic_file) for pic_file in pic_files)
+        entries = {}
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='PicDedup') as pool:
+            by_size = defaultdict(list)
+            for rel_path, size_mtime in zip(files, pool.map(self.stat, files)):
+                if size_mtime is not None:
+                    entries[rel_path] = [size_mtime[0], size_mtime[1], None, None]
+                    by_size[size_mtime[0]].append(rel_path)
+            candidates = [rel_path for same_size in by_size.values() if len(same_size) > 1 for rel_path in same_size]
+            self.hashes(entries, candidates, pool, full=False)
+            by_partial = defaultdict(list)
+            for rel_path in candidates:
+                entry = entries[rel_path]
+                if entry[2] is not None:
+                    by_partial[(entry[0], entry[2])].append(rel_path)
+            candidates = [rel_path for (size, __partial), same_partial in by_partial.items() if len(same_partial) > 1
+                for rel_path in same_partial if size > PARTIAL_BYTES * 2]
+            self.hashes(entries, candidates, pool, full=True)
+        by_content = defaultdict(list)
+        for (size, partial), same_partial in by_partial.items():
+            if len(same_partial) < 2:
+                continue
+            for rel_path in same_partial:
+                full = entries[rel_path][3] if size > PARTIAL_BYTES * 2 else partial
+                if full is not None:
+                    by_content[(size, full)].append(rel_path)
+        groups = [[files[rel_path] for rel_path in sorted(same, key=keep_order)] for same in by_content.values() if len(same) > 1]
+        groups.sort(key=lambda group: (group[0].pic_dir.rel_dir_name, group[0].file_name))
+        self.save(entries)
+        log.info('Dedup: %s files %s partial hashes %s full hashes. %s duplicated, %s copies in %.2fs' % (len(files),
+            self.hash_cnt, self.full_hash_cnt, len(groups), sum(len(group) - 1 for group in groups), time.time() - start_tm))
+        return groups
+
+def main():
+    import sys
+    import PicLibrary as PLib
+    pic_lib = PLib.PicLibrary(sys.argv[1])
+    pic_lib.get_file_list(shuffle=False)
+    for group in PicDedup(sys.argv[1]).find_groups(pic_lib.pic_files):
+        for pos, pic_file in enumerate(group):
+            log.info('%s %s' % ('KEEP' if pos == 0 else '    ', os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name)))
+
+if __name__ == "__main__":
+    # setup logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
+        level=logging.INFO
+        )
+    prog_name = Path(__file__).stem
+    log = logging.getLogger(name=prog_name)
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+'''
+Read the EXIF date and orientation from a JPEG header, without decoding the picture or needing PIL.
+Only the APP1 segment at the start of the file is read.
+'''
+import time
+import struct
+import logging
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+TAG_ORIENTATION = 0x0112
+TAG_EXIF_IFD = 0x8769
+TAG_DATE_TIME_ORIGINAL = 0x9003
+TYPE_ASCII = 2
+TYPE_SHORT = 3
+TYPE_LONG = 4
+SOI = b'\xff\xd8'
+APP1 = 0xE1
+SOS = 0xDA # Start of the compressed data. There are no headers after it
+EOI = 0xD9
+EXIF_HDR = b'Exif\x00\x00'
+
+def read_ifd(tiff, offset, endian):
+    '''
+    Return {tag: (type, count, value bytes)} for one TIFF IFD. Values over 4 bytes are given as their offset bytes
+    '''
+    entries = {}
+    entry_cnt = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    for pos in range(offset + 2, offset + 2 + entry_cnt * 12, 12):
+        tag, tag_type, count = struct.unpack_from(endian + 'HHI', tiff, pos)
+        entries[tag] = (tag_type, count, tiff[pos + 8:pos + 12])
+    return entries
+
+def parse_tiff(tiff):
+    '''
+    Return (date time original string or None, orientation) from the TIFF structure in an EXIF segment
+    '''
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None, 1
+    ifd0 = read_ifd(tiff, struct.unpack_from(endian + 'I', tiff, 4)[0], endian)
+    orientation = 1
+    if TAG_ORIENTATION in ifd0:
+        tag_type, __count, value = ifd0[TAG_ORIENTATION]
+        if tag_type == TYPE_SHORT:
+            orientation = struct.unpack(endian + 'H', value[:2])[0]
+    date_str = None
+    if TAG_EXIF_IFD in ifd0:
+        exif_ifd = read_ifd(tiff, struct.unpack(endian + 'I', ifd0[TAG_EXIF_IFD][2])[0], endian)
+        if TAG_DATE_TIME_ORIGINAL in exif_ifd:
+            tag_type, count, value = exif_ifd[TAG_DATE_TIME_ORIGINAL]
+            if tag_type == TYPE_ASCII:
+                if count > 4:
+                    offset = struct.unpack(endian + 'I', value)[0]
+                    value = tiff[offset:offset + count]
+                date_str = value[:count].rstrip(b'\x00 ').decode('ascii', 'replace')
+    return date_str, orientation
+
+def read_exif(path):
+    '''
+    Return (dt, orientation) for a picture. dt is seconds since the epoch from DateTimeOriginal, None if there
+    isn't one. orientation is the EXIF orientation, 1 if there isn't one. Files that aren't JPEGs get (None, 1).
+    '''
+    with open(path, 'rb') as f:
+        if f.read(2) != SOI:
+            return None, 1
+        while True:
+            marker = f.read(4)
+            if len(marker) < 4 or marker[0] != 0xFF or marker[1] in (SOS, EOI):
+                return None, 1
+            seg_len = struct.unpack('>H', marker[2:])[0]
+            if marker[1] == APP1:
+                segment = f.read(seg_len - 2)
+                if segment.startswith(EXIF_HDR):
+                    break
+            else:
+                f.seek(seg_len - 2, 1)
+    try:
+        date_str, orientation = parse_tiff(segment[len(EXIF_HDR):])
+    except struct.error as e:
+        log.debug('Bad EXIF in %s: %s' % (path, e))
+        return None, 1
+    dt = None
+    if date_str:
+        try:
+            dt = time.mktime(time.strptime(date_str, '%Y:%m:%d %H:%M:%S'))
+        except (ValueError, OverflowError):
+            log.debug('Bad EXIF date in %s: %s' % (path, date_str))
+    return dt, orientation
+
+def main():
+    import sys
+    for path in sys.argv[1:]:
+        dt, orientation = read_exif(path)
+        log.info('%-100s %s %s' % (path, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(dt)) if dt else '-', orientation))
+
+if __name__ == "__main__":
+    # setup logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
+        level=logging.DEBUG
+        )
+    prog_name = Path(__file__).stem
+    log = logging.getLogger(name=prog_name)
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+'''
+Picture decoding for Slide textures. Kept free of pi3d so it can be run and benchmarked without a display.
+'''
+import os
+import math
+import time
+import logging
+from threading import Lock
+from collections import OrderedDict
+from PIL import Image, ExifTags, ImageFilter
+from Telemetry import telemetry
+
+log = logging.getLogger(__name__)
+
+EXIF_DATID = None  # this needs to be set before get_files() above can extract exif date info
+EXIF_ORIENTATION = None
+for k in ExifTags.TAGS:
+    if ExifTags.TAGS[k] == 'DateTimeOriginal':
+        EXIF_DATID = k
+    if ExifTags.TAGS[k] == 'Orientation':
+        EXIF_ORIENTATION = k
+
+# Transposes to turn an image stored with each EXIF orientation upright. Rotations are anti-clockwise
+TRANSPOSES = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.FLIP_LEFT_RIGHT, Image.ROTATE_270),
+    6: (Image.ROTATE_270,),
+    7: (Image.FLIP_LEFT_RIGHT, Image.ROTATE_90),
+    8: (Image.ROTATE_90,),
+}
+SIDEWAYS = (5, 6, 7, 8) # Orientations where the stored width is the displayed height
+
+BLUR_AMOUNT = 12
+BLUR_ZOOM = 1.0
+EDGE_ALPHA = 0.5
+BLUR_BASE_WIDTH = 512 # BLUR_AMOUNT is a Gaussian radius in pixels of the background scaled to this width
+BLUR_RADIUS = 2.0 # The radius the blur is actually done at, on a background scaled down to suit
+BLUR_CACHE_SIZE = 256 # Blurred backgrounds kept. Each is only a few KB
+PLAIN_MODES = ('RGB', 'RGBA', 'L', 'LA', 'CMYK') # Modes reduce, resize and putalpha all handle as they are
+DEEP_MODES = ('I', 'I;16', 'I;16L', 'I;16B', 'I;16N') # 16 bit or more grey. Scaled down to 8 bit grey
+
+def read_exif(im, path):
+    '''
+    Return the (dt, orientation) of an opened image. Only reads the EXIF header, not the pixel data.
+    dt falls back to the file last modified time
+    '''
+    dt = None
+    orientation = 1
+    if EXIF_DATID is not None and EXIF_ORIENTATION is not None:
+        try:
+            exif_data = im._getexif() or {}
+            # Orientation first, so a picture with no date is still turned the right way up
+            orientation = int(exif_data.get(EXIF_ORIENTATION, 1))
+            dt = time.mktime(
+                time.strptime(exif_data[EXIF_DATID], '%Y:%m:%d %H:%M:%S'))
+        except Exception as e: # NB should really check error here but it's almost certainly due to lack of exif data
+            log.debug('trying to read exif %s %s' % (path, e))
+            dt = os.path.getmtime(path) # so use file last modified date
+    return dt, orientation
+
+def display_scale_size(im_size, display_size, orientation=1, fit=True):
+    '''
+    The size, in stored (not yet rotated) pixels, the picture is shown at. Fitted inside display_size, or
+    filling it when not fit. None if that is no smaller than im_size
+    '''
+    disp_w, disp_h = display_size
+    if orientation in SIDEWAYS:
+        disp_w, disp_h = disp_h, disp_w
+    im_w, im_h = im_size
+    scale = min(disp_w / im_w, disp_h / im_h) if fit else max(disp_w / im_w, disp_h / im_h)
+    if scale >= 1.0:
+        return None
+    return (max(1, math.ceil(im_w * scale)), max(1, math.ceil(im_h * scale)))
+
+def plain_mode(im):
+    '''
+    im converted, if it needs to be, to a mode with 8 bits a channel. Palette, 1 bit and 16 bit pictures can't be
+    reduced or given an alpha channel as they are
+    '''
+    if im.mode in PLAIN_MODES:
+        return im
+    if im.mode in DEEP_MODES:
+        return im.convert('I').point(lambda v: v * (1 / 256)).convert('L')
+    if im.mode in ('P', 'PA') and ('transparency' in im.info or im.mode == 'PA'):
+        return im.convert('RGBA')
+    return im.convert('RGB')
+
+def reduce_to(im, size):
+    '''
+    Scale an opened image down to size. For a JPEG, draft() makes the decoder itself produce 1/2, 1/4 or 1/8 scale
+    pixels, so the full resolution image is never decoded. Other formats are reduced by whole pixel blocks.
+    Either way only a small resize is left to do.
+    '''
+    if im.format == 'JPEG':
+        im.draft(im.mode, size)
+    else:
+        im = plain_mode(im)
+        factor = min(im.width // size[0], im.height // size[1])
+        if factor > 1:
+            im = im.reduce(factor)
+    if im.size != size:
+        im = im.resize(size, Image.BILINEAR)
+    return im
+
+def load_image(path, display_size=None, fit=True):
+    '''
+    Open a picture, upright and (with a display_size) scaled down to the size it will be shown at.
+    Returns (im, dt, orientation). im is RGBA, or LA for a grey picture, with an opaque alpha channel
+    '''
+    with telemetry.timer('load.open.secs'):
+        im = Image.open(path)
+    if telemetry.enabled:
+        telemetry.record('load.bytes', os.path.getsize(path))
+    with telemetry.timer('load.exif.secs'):
+        dt, orientation = read_exif(im, path)
+    with telemetry.timer('load.decode.secs'):
+        if display_size is not None:
+            size = display_scale_size(im.size, display_size, orientation, fit)
+            if size is not None:
+                im = reduce_to(im, size)
+        im.load()
+        im = plain_mode(im)
+    with telemetry.timer('load.transpose.secs'):
+        for method in TRANSPOSES.get(orientation, ()):
+            im = im.transpose(method)
+        im.putalpha(255) # this will convert to RGBA and set alpha to opaque
+    return im, dt, orientation
+
+class BlurEdges():
+    '''
+    Fills the display around a fitted picture with a blurred, zoomed in copy of it, rather than the background colour.
+    The middle of the picture is scaled right down, blurred there, then scaled back up to the display size, so the
+    blur costs about the same at any amount, rather than more the bigger the amount is as a full size blur would.
+    The small blurred backgrounds are cached by path, mtime and display size, so a picture shown again only needs
+    the scale up.
+    Runs in the slide loader thread or prefetch worker, not the render loop.
+    '''
+    def __init__(self, amount=BLUR_AMOUNT, zoom=BLUR_ZOOM, edge_alpha=EDGE_ALPHA, cache_size=BLUR_CACHE_SIZE):
+        self.amount = amount
+        self.zoom = max(1.0, zoom)
+        self.edge_alpha = edge_alpha
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        self.hit_cnt = 0
+        self.miss_cnt = 0
+
+    def settings(self):
+        '''
+        Arguments for a BlurEdges in another process
+        '''
+        return self.amount, self.zoom, self.edge_alpha, self.cache_size
+
+    def background(self, im, display_size):
+        '''
+        The middle of im, in the display's shape and zoomed in by zoom, scaled down and blurred
+        '''
+        disp_w, disp_h = display_size
+        scale = max(disp_w / im.width, disp_h / im.height) * self.zoom
+        w, h = disp_w / scale, disp_h / scale
+        box = ((im.width - w) / 2, (im.height - h) / 2, (im.width + w) / 2, (im.height + h) / 2)
+        small_w = BLUR_BASE_WIDTH
+        if self.amount > BLUR_RADIUS:
+            small_w = max(8, round(BLUR_BASE_WIDTH * BLUR_RADIUS / self.amount))
+        small_size = (small_w, max(1, round(small_w * disp_h / disp_w)))
+        small = im.resize(small_size, Image.BILINEAR, box=box, reducing_gap=2.0).convert('RGB')
+        return small.filter(ImageFilter.GaussianBlur(self.amount * small_w / BLUR_BASE_WIDTH))
+
+    def apply(self, im, display_size, path=None):
+        '''
+        im, an upright RGBA picture, fitted and centred on its blurred background. Returns a display_size RGBA image,
+        or im as it was if it already has the display's shape
+        '''
+        disp_w, disp_h = display_size
+        if abs(im.width * disp_h - im.height * disp_w) <= 0.01 * im.height * disp_w:
+            return im
+        with telemetry.timer('load.blur.secs'):
+            key = None
+            background = None
+            if path is not None and self.cache_size > 0:
+                key = (path, os.stat(path).st_mtime_ns, display_size)
+                with self.lock:
+                    background = self.cache.get(key)
+                    if background is not None:
+                        self.cache.move_to_end(key)
+            if background is None:
+                self.miss_cnt += 1
+                background = self.background(im, display_size)
+                if key is not None:
+                    with self.lock:
+                        self.cache[key] = background
+                        while len(self.cache) > self.cache_size:
+                            self.cache.popitem(last=False)
+            else:
+                self.hit_cnt += 1
+            scale = min(disp_w / im.width, disp_h / im.height)
+            if scale > 1.0:
+                # Smaller than the display. Scaled up, as the picture on its own would be by the shader
+                im = im.resize((min(disp_w, round(im.width * scale)), min(disp_h, round(im.height * scale))), Image.BICUBIC)
+            filled = background.resize(display_size, Image.BILINEAR)
+            filled.putalpha(round(255 * self.edge_alpha))
+            filled.paste(im, ((disp_w - im.width) // 2, (disp_h - im.height) // 2))
+        return filled
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+
+import os
+import logging
+import sqlite3
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+class PicIndex():
+    '''
+    Persistent on-disk directory listing cache for a PicLibrary.
+    One entry per directory, keyed by relative directory name, holding the directory mtime and the sub directory
+    and file names found the last time it was listed.
+    A directory only needs to be listed again if its mtime has changed.
+    Optionally also caches the EXIF date and orientation of each file, keyed by relative path, file mtime and size.
+    The whole index is loaded into memory at the start of a scan and the entries that changed are written back in one
+    transaction at the end, so the scan threads never touch the database, and a watcher refresh of a few directories
+    only writes those.
+    '''
+    NAME_SEP = '/' # Can't appear in a file or directory name
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.dirs = {}
+        self.seen_dirs = {}
+        self.files = {}
+        self.seen_files = {}
+        self.hit_cnt = 0
+        self.miss_cnt = 0
+
+    def connect(self):
+        con = sqlite3.connect(self.index_file)
+        columns = [row[1] for row in con.execute('PRAGMA table_info(files)')]
+        if columns and 'size' not in columns:
+            # From before file sizes were kept. It's only a cache, so start it again
+            log.info('Library index file cache is out of date, starting it again: %s' % self.index_file)
+            with con:
+                con.execute('DROP TABLE files')
+        con.execute('''CREATE TABLE IF NOT EXISTS dirs (
+            rel_dir_name TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            dir_names TEXT NOT NULL,
+            file_names TEXT NOT NULL
+        )''')
+        con.execute('''CREATE TABLE IF NOT EXISTS files (
+            rel_path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            dt REAL,
+            orientation INTEGER NOT NULL
+        )''')
+        return con
+
+    def __split(self, names):
+        return names.split(self.NAME_SEP) if names else []
+
+    def load(self):
+        '''
+        Load the directory entries saved by the last scan
+        '''
+        self.dirs = {}
+        self.seen_dirs = {}
+        self.files = {}
+        self.seen_files = {}
+        self.hit_cnt = 0
+        self.miss_cnt = 0
+        if not os.path.exists(self.index_file):
+            log.info('No library index: %s' % self.index_file)
+            return
+        try:
+            con = self.connect()
+            try:
+                for rel_dir_name, mtime_ns, dir_names, file_names in con.execute('SELECT * FROM dirs'):
+                    self.dirs[rel_dir_name] = (mtime_ns, dir_names, file_names)
+                for rel_path, mtime_ns, size, dt, orientation in con.execute('SELECT * FROM files'):
+                    self.files[rel_path] = (mtime_ns, size, dt, orientation)
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            log.warning('Ignoring unreadable library index %s: %s' % (self.index_file, e))
+            self.dirs = {}
+            self.files = {}
+        log.info('Library index loaded: %s dirs from %s' % (len(self.dirs), self.index_file))
+
+    def lookup(self, rel_dir_name, mtime_ns):
+        '''
+        Return the cached (dir_names, file_names) for a directory, or None if it isn't cached or has changed
+        '''
+        entry = self.dirs.get(rel_dir_name)
+        if entry is None or entry[0] != mtime_ns:
+            self.miss_cnt += 1
+            return None
+        self.hit_cnt += 1
+        self.seen_dirs[rel_dir_name] = entry
+        return self.__split(entry[1]), self.__split(entry[2])
+
+    def store(self, rel_dir_name, mtime_ns, dir_names, file_names):
+        '''
+        Record a freshly listed directory
+        '''
+        self.seen_dirs[rel_dir_name] = (mtime_ns, self.NAME_SEP.join(dir_names), self.NAME_SEP.join(file_names))
+
+    def lookup_file(self, rel_path, mtime_ns, size):
+        '''
+        Return the cached (mtime_ns, size, dt, orientation) of a file. None if it isn't cached or the file has changed
+        '''
+        entry = self.files.get(rel_path)
+        if entry is None or entry[0] != mtime_ns or entry[1] != size:
+            return None
+        self.seen_files[rel_path] = entry
+        return entry
+
+    def store_file(self, rel_path, mtime_ns, size, dt, orientation):
+        self.seen_files[rel_path] = (mtime_ns, size, dt, orientation)
+
+    def drop(self, rel_dir_name):
+        '''
+        Forget a directory that has gone, and its files
+        '''
+        self.seen_dirs.pop(rel_dir_name, None)
+        for rel_path in [rel_path for rel_path in self.seen_files if os.path.dirname(rel_path) == rel_dir_name]:
+            del self.seen_files[rel_path]
+
+    def save(self):
+        '''
+        Bring the saved index up to date with the directories and files seen since the scan started, in one transaction.
+        Only entries that have changed since the last save are written. Directories and files that have gone are deleted
+        '''
+        seen_dirs = dict(self.seen_dirs)
+        seen_files = dict(self.seen_files)
+        dir_rows = [(rel_dir_name,) + entry for rel_dir_name, entry in seen_dirs.items() if self.dirs.get(rel_dir_name) != entry]
+        gone_dirs = [(rel_dir_name,) for rel_dir_name in self.dirs if rel_dir_name not in seen_dirs]
+        file_rows = [(rel_path,) + entry for rel_path, entry in seen_files.items() if self.files.get(rel_path) != entry]
+        gone_files = [(rel_path,) for rel_path in self.files if rel_path not in seen_files]
+        if dir_rows or gone_dirs or file_rows or gone_files:
+            con = self.connect()
+            try:
+                with con:
+                    con.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)', dir_rows)
+                    con.executemany('DELETE FROM dirs WHERE rel_dir_name = ?', gone_dirs)
+                    con.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)', file_rows)
+                    con.executemany('DELETE FROM files WHERE rel_path = ?', gone_files)
+            finally:
+                con.close()
+        # Copies, so what changes from here on shows up as different at the next save
+        self.dirs = seen_dirs
+        self.files = seen_files
+        log.info('Library index saved: %s dirs (%s unchanged, %s listed), %s dirs and %s files written, %s and %s deleted, to %s' %
+            (len(seen_dirs), self.hit_cnt, self.miss_cnt, len(dir_rows), len(file_rows), len(gone_dirs), len(gone_files),
+             self.index_file))
+
+def main():
+    import sys
+    log.info('Start')
+    pic_index = PicIndex(sys.argv[1])
+    pic_index.load()
+    for rel_dir_name in sorted(pic_index.dirs):
+        mtime_ns, __dir_names, file_names = pic_index.dirs[rel_dir_name]
+        log.info('   %-120s %s' % (rel_dir_name, len(file_names.split(PicIndex.NAME_SEP)) if file_names else 0))
+    log.info('End')
+
+if __name__ == "__main__":
+    # setup logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
+        level=logging.DEBUG
+        )
+    prog_name = Path(__file__).stem
+    log = logging.getLogger(name=prog_name)
+    main()
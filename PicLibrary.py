@@ -5,9 +5,21 @@ import logging
 from pathlib import Path
 from enum import Enum
 import re
-from threading import Thread
+from threading import Thread, Lock
+from collections import deque
+import bisect
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import time
 import random
+from PicIndex import PicIndex
+from CompactLibrary import CompactStore, CompactFileList
+from PicExif import read_exif
+from Playlist import DateIndex, Playlist, DirShuffle, to_timestamp, recent_first
+from PicDedup import PicDedup
+from PicSimilar import PicSimilar
+from PicQuarantine import PicQuarantine, SLOW_SECS
+from Telemetry import telemetry
 
 log = logging.getLogger(__name__)
 
@@ -35,6 +47,87 @@ class PathStatus(Enum):
     EXCLUDE = 2
     SKIP = 3
 
+class PathMatcher():
+    '''
+    Include/exclude regx rules for one kind of path (directories or files), compiled once.
+    All the include regxs are merged into one alternation, as are the exclude regxs, so a path is classified with
+    at most two regx matches. Paths must start with prefix, which is stripped before matching.
+    '''
+    def __init__(self, inc_regx_list, exc_regx_list, prefix=''):
+        self.inc_regx_list = list(inc_regx_list)
+        self.exc_regx_list = list(exc_regx_list)
+        self.prefix = prefix
+        self.prefix_len = len(prefix)
+        self.inc_regx = self.__compile(self.inc_regx_list)
+        self.exc_regx = self.__compile(self.exc_regx_list)
+        # Exclude regxs that, once matched, also match anything longer. A directory excluded by one of these
+        # can't contain an included directory, so there's no need to descend into it.
+        self.prune_regx = self.__compile([regx for regx in self.exc_regx_list if self.__prefix_closed(regx)])
+        self.debug = log.isEnabledFor(logging.DEBUG)
+
+    @staticmethod
+    def __compile(regx_list):
+        if not regx_list:
+            return None
+        return re.compile('|'.join('(?:%s)' % regx for regx in regx_list), re.IGNORECASE)
+
+    @staticmethod
+    def __prefix_closed(regx):
+        '''
+        True if the regx has no assertions that look past the end of the text it consumes (end anchors, word
+        boundaries or lookaheads). Conservative, an escaped $ also counts.
+        '''
+        return not any(token in regx for token in ('$', r'\Z', r'\b', r'\B', '(?=', '(?!'))
+
+    @staticmethod
+    def __which(regx_list, path):
+        '''
+        The first individual regx that matches path. Only used for debug logging
+        '''
+        for regx in regx_list:
+            if re.match(regx, path, re.IGNORECASE):
+                return regx
+        return None
+
+    def status(self, path, file_cnt=1):
+        '''
+        Determine include/Exclude status of path
+        '''
+        if self.prefix_len:
+            if not path.startswith(self.prefix):
+                path_status = PathStatus.SKIP
+                if self.debug:
+                    log.debug('%-7s %-120s %s' %(path_status.name, path, file_cnt))
+                return path_status
+            rel_path = path[self.prefix_len:]
+        else:
+            rel_path = path
+        if self.inc_regx is None or self.inc_regx.match(rel_path) is None:
+            path_status = PathStatus.SKIP
+            if self.debug:
+                log.debug('%-7s %-120s %s' %(path_status.name, path, file_cnt))
+        elif self.exc_regx is not None and self.exc_regx.match(rel_path) is not None:
+            path_status = PathStatus.EXCLUDE
+            if self.debug:
+                log.debug('%-7s %-120s %s %s' %(path_status.name, path, self.__which(self.exc_regx_list, rel_path), file_cnt))
+        else:
+            path_status = PathStatus.INCLUDE
+            if self.debug:
+                log.debug('%-7s %-120s %s %s' %(path_status.name, path, self.__which(self.inc_regx_list, rel_path), file_cnt))
+        return path_status
+
+    def prunes(self, path):
+        '''
+        True if neither path nor anything below it can be included
+        '''
+        if self.prune_regx is None or not path.startswith(self.prefix):
+            return False
+        if self.prune_regx.match(path[self.prefix_len:]) is None:
+            return False
+        if self.debug:
+            log.debug('%-7s %-120s %s' %('PRUNE', path, self.__which(self.exc_regx_list, path[self.prefix_len:])))
+        return True
+
 class PicDir():
     '''
     A relative directory name and an array of PicFile objects in the directory
@@ -57,6 +150,8 @@ class PicFile():
     def __init__(self, pic_dir, fname):
         self.file_name = fname
         self.pic_dir = pic_dir
+        self.dt = None # EXIF DateTimeOriginal, or file mtime. Only set if the library reads EXIF
+        self.orientation = None # EXIF orientation
         #time.sleep(0.0001)
 
 class PicLibrary ():
@@ -67,64 +162,545 @@ class PicLibrary ():
     This allows navigating the library via directories or by individual files.
     '''
 
-    def __status(self, path, regx_prefix, inc_regx_list, exc_regx_list, file_cnt=1):
+    def _list_dir(self, dirpath, rel_dir_name):
         '''
-        Determine include/Exclude status of path
+        Return the (dir_names, file_names) in a directory. Taken from the library index if the directory hasn't changed.
+        Like os.walk, symlinked directories are not descended into and unreadable directories are treated as empty.
         '''
-        for inc_regx in inc_regx_list:
-            if re.match(regx_prefix+inc_regx, path, re.IGNORECASE):
-                for exc_regx in exc_regx_list:
-                    if re.match(regx_prefix+exc_regx, path, re.IGNORECASE):
-                        path_status = PathStatus.EXCLUDE
-                        log.debug('%-7s %-120s %s %s' %(path_status.name, path, exc_regx, file_cnt))
-                        return path_status
-                path_status = PathStatus.INCLUDE
-                log.debug('%-7s %-120s %s %s' %(path_status.name, path, inc_regx, file_cnt))
-                return path_status
-        path_status = PathStatus.SKIP
-        log.debug('%-7s %-120s %s' %(path_status.name, path, file_cnt))
-        return path_status
+        try:
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            return [], []
+        self.dir_mtimes[rel_dir_name] = mtime_ns
+        if self.index is not None:
+            names = self.index.lookup(rel_dir_name, mtime_ns)
+            if names is not None:
+                return names
+        dir_names = []
+        file_names = []
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        file_names.append(entry.name)
+                    elif not entry.is_symlink():
+                        dir_names.append(entry.name)
+        except OSError:
+            return [], []
+        if self.index is not None:
+            self.index.store(rel_dir_name, mtime_ns, dir_names, file_names)
+        return dir_names, file_names
+
+    def _sub_dirs(self, rel_dir_name, dir_names):
+        '''
+        Generate (dirpath, rel_dir_name) for the sub directories worth descending into
+        '''
+        for dir_name in dir_names:
+            sub_rel_dir_name = os.path.join(rel_dir_name, dir_name)
+            sub_dirpath = os.path.join(self.src_dir, sub_rel_dir_name)
+            if not self.dir_matcher.prunes(sub_dirpath):
+                yield sub_dirpath, sub_rel_dir_name
+
+    def _dirpath(self, rel_dir_name):
+        return os.path.join(self.src_dir, rel_dir_name) if rel_dir_name else self.src_dir
+
+    def _walk(self, rel_dir_name=''):
+        '''
+        Generate (dirpath, rel_dir_name, file_names) for every directory under src_dir (or the rel_dir_name directory
+        in it), one directory at a time
+        '''
+        dirs = [(self._dirpath(rel_dir_name), rel_dir_name)]
+        while dirs:
+            dirpath, rel_dir_name = dirs.pop()
+            dir_names, file_names = self._list_dir(dirpath, rel_dir_name)
+            yield dirpath, rel_dir_name, file_names
+            dirs.extend(self._sub_dirs(rel_dir_name, dir_names))
+
+    def _walk_parallel(self):
+        '''
+        Generate (dirpath, rel_dir_name, file_names) for every directory under src_dir, listing up to scan_threads
+        directories at once. Directories come back in completion order.
+        On slow media most of the scan is spent waiting on directory reads, so this keeps several in flight.
+        '''
+        with ThreadPoolExecutor(max_workers=self.scan_threads, thread_name_prefix='PicLibrary scan') as pool:
+            pending = {pool.submit(self._list_dir, self.src_dir, ''): (self.src_dir, '')}
+            while pending:
+                done, __not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dirpath, rel_dir_name = pending.pop(future)
+                    dir_names, file_names = future.result()
+                    for sub_dir in self._sub_dirs(rel_dir_name, dir_names):
+                        pending[pool.submit(self._list_dir, *sub_dir)] = sub_dir
+                    yield dirpath, rel_dir_name, file_names
+
+    def _new_pic_dir(self, dirpath, rel_dir_name, file_names):
+        '''
+        Build the PicDir for a directory. None if the directory or all of its files are excluded
+        '''
+        match_start_tm = time.perf_counter() if telemetry.enabled else None
+        path_status = self.dir_matcher.status(dirpath, len(file_names))
+        if path_status != PathStatus.INCLUDE:
+            return None
+        pic_dir = self.store.add_dir(rel_dir_name) if self.compact else PicDir(rel_dir_name)
+        for fname in sorted(file_names):
+            file_status = self.file_matcher.status(fname)
+            if file_status == PathStatus.INCLUDE:
+                self.cur_pic = pic_dir.add_file(fname)
+        if match_start_tm is not None:
+            telemetry.record('scan.match.secs', time.perf_counter() - match_start_tm)
+        if pic_dir.file_cnt == 0:
+            return None
+        if self.exif_pool is not None:
+            self._read_dir_exif(pic_dir)
+        return pic_dir
+
+    def _read_file_exif(self, pic_file):
+        '''
+        Set the dt and orientation of a file from its EXIF header, or the index. Every file is stat'd, even in a directory
+        the index says is unchanged, as a picture edited in place doesn't change its directory. The cached EXIF is used
+        if the file's mtime and size haven't changed.
+        '''
+        rel_path = os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name)
+        path = os.path.join(self.src_dir, rel_path)
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            log.debug('Cannot stat %s: %s' % (path, e))
+            return
+        entry = None
+        if self.index is not None:
+            entry = self.index.lookup_file(rel_path, st.st_mtime_ns, st.st_size)
+        if entry is None:
+            try:
+                dt, orientation = read_exif(path)
+            except OSError as e:
+                log.debug('Cannot read EXIF %s: %s' % (path, e))
+                dt, orientation = None, 1
+            if dt is None:
+                dt = st.st_mtime_ns / 1e9 # so use file last modified date
+            entry = (st.st_mtime_ns, st.st_size, dt, orientation)
+            if self.index is not None:
+                self.index.store_file(rel_path, *entry)
+        pic_file.dt = entry[2]
+        pic_file.orientation = entry[3]
+
+    def _read_dir_exif(self, pic_dir):
+        '''
+        Read the EXIF headers of all the files in a new PicDir, exif_threads at a time
+        '''
+        for __result in self.exif_pool.map(self._read_file_exif, pic_dir.pic_files):
+            pass
 
-    def get_file_list(self, shuffle):
+    def _new_file_list(self):
+        return CompactFileList(self.store) if self.compact else []
+
+    def get_file_list(self, shuffle, found_files=None):
         '''
         Generate a list of included PicDir directories and PicFile files, based on a set of include/exclude regular expressions
+        Each PicFile is also put on the found_files queue, if there is one, as soon as its directory has been listed.
+        None is put on the queue when the scan is finished.
         '''
         log.info('Directory Scan: %s' % self.src_dir)
+        # A watcher refresh waits for the scan, rather than changing the library half way through it
+        with self.scan_lock:
+            self._scan(shuffle, found_files)
+        if self.watcher is not None:
+            self.watcher.rescanned()
+
+    def _scan(self, shuffle, found_files):
+        start_tm = time.time()
+        self.store = CompactStore() if self.compact else None
         self.pic_dirs = []
-        self.pic_files = []
+        self.pic_files = self._new_file_list()
+        self.dir_mtimes = {}
         self.file_cnt = 0
         self.dir_cnt = 0
         self.cur_pos = -1
-        for dirpath, __dirnames, filenames in sorted(os.walk(self.src_dir)):
-            src_dir_prefix = self.src_dir+'/'
-            path_status = self.__status(dirpath, src_dir_prefix, self.path_regxs['inc_dirs'], self.path_regxs['exc_dirs'], len(filenames))
-            if path_status == PathStatus.INCLUDE:
-                rel_dir_path = dirpath.lstrip(src_dir_prefix)
-                cur_pic_dir = PicDir(rel_dir_path)
-                for fname in sorted(filenames):
-                    file_status = self.__status(fname, '', self.path_regxs['inc_files'], self.path_regxs['exc_files'])
-                    if file_status == PathStatus.INCLUDE:
-                        self.cur_pic = cur_pic_dir.add_file(fname)
-                        self.pic_files.append(self.cur_pic)
-                        self.file_cnt += 1
-                if cur_pic_dir.file_cnt > 0:
+        try:
+            if self.index is not None:
+                self.index.load()
+            # Before the scan, so quarantined pictures are left out of a playlist streamed from it
+            self.quarantine.load()
+            self.dir_matcher = PathMatcher(self.path_regxs['inc_dirs'], self.path_regxs['exc_dirs'], self.src_dir+'/')
+            self.file_matcher = PathMatcher(self.path_regxs['inc_files'], self.path_regxs['exc_files'])
+            walk = self._walk_parallel() if self.scan_threads > 1 else self._walk()
+            for dirpath, rel_dir_path, filenames in walk:
+                cur_pic_dir = self._new_pic_dir(dirpath, rel_dir_path, filenames)
+                if cur_pic_dir is not None:
                     self.pic_dirs.append(cur_pic_dir)
                     self.dir_cnt += 1
+                    for pic_file in cur_pic_dir.pic_files:
+                        self.pic_files.append(pic_file)
+                        self.file_cnt += 1
+                        if found_files is not None:
+                            found_files.put(pic_file)
+            # Directories are found in walk order. Put the library in path order, as the way it's listed mustn't matter
+            with self.lock:
+                self.pic_dirs.sort(key=lambda pic_dir: pic_dir.rel_dir_name)
+                pic_files = self._new_file_list()
+                for pic_dir in self.pic_dirs:
+                    pic_files.extend(pic_dir.pic_files)
+                self.pic_files = pic_files
+                self.dir_cnt = len(self.pic_dirs)
+                self.file_cnt = len(self.pic_files)
+            self.save_index()
+            scan_secs = time.time() - start_tm
+            log.info('Directory Scan complete: %s dirs %s files in %.2fs' % (self.dir_cnt, self.file_cnt, scan_secs))
+            if telemetry.enabled:
+                telemetry.record('scan.secs', scan_secs)
+                telemetry.record('scan.dirs', self.dir_cnt)
+                telemetry.record('scan.files', self.file_cnt)
+                telemetry.record('scan.dirs_per_sec', self.dir_cnt / scan_secs if scan_secs > 0 else 0.0)
+                telemetry.record('scan.files_per_sec', self.file_cnt / scan_secs if scan_secs > 0 else 0.0)
+            if self.dedup is not None:
+                self.remove_duplicates()
+            if self.similar is not None:
+                self.remove_similar()
+            self.change_cnt += 1
+            if shuffle:
+                random.shuffle(self.pic_files)
+        finally:
+            if found_files is not None:
+                found_files.put(None)
+
+    def remove_duplicates(self):
+        '''
+        Drop all but one copy of each picture with the same content from pic_files. The copies stay in their PicDirs.
+        Duplicates added while watching are only dropped at the next scan
+        '''
+        self.dup_groups = self.dedup.find_groups(self.pic_files)
+        self.duplicates = set(pic_file for group in self.dup_groups for pic_file in group[1:])
+        if self.duplicates:
+            pic_files = self._new_file_list()
+            pic_files.extend(pic_file for pic_file in self.pic_files if pic_file not in self.duplicates)
+            self.pic_files = pic_files
+            self.file_cnt = len(self.pic_files)
+
+    def remove_similar(self):
+        '''
+        Keep one picture, picked at random each scan, of each cluster of near identical pictures (a burst) in pic_files.
+        The others stay in their PicDirs
+        '''
+        self.similar_clusters = self.similar.find_clusters(self.pic_files)
+        self.similars = set()
+        for pic_files in self.similar_clusters:
+            keep_pos = random.randrange(len(pic_files))
+            self.similars.update(pic_file for pos, pic_file in enumerate(pic_files) if pos != keep_pos)
+        if self.similars:
+            pic_files = self._new_file_list()
+            pic_files.extend(pic_file for pic_file in self.pic_files if pic_file not in self.similars)
+            self.pic_files = pic_files
+            self.file_cnt = len(self.pic_files)
+
+    def excluded(self, pic_file):
+        '''
+        Whether a PicFile is left out of playlists: a duplicate, a near duplicate, or quarantined
+        '''
+        return pic_file in self.duplicates or pic_file in self.similars or self.quarantine.contains(pic_file)
+
+    def save_index(self):
+        if self.index is not None:
+            try:
+                self.index.save()
+            except Exception as e:
+                log.warning('Could not save library index %s: %s' % (self.index.index_file, e))
+
+    def update(self,shuffle=True):
+        self.found_files = queue.Queue()
+        self.update_thread = Thread(name='PicLibrary update', target=self.get_file_list, args=(shuffle, self.found_files))
+        self.update_thread.start()
+
+    def _find_dir(self, rel_dir_name):
+        rel_dir_names = [pic_dir.rel_dir_name for pic_dir in self.pic_dirs]
+        pos = bisect.bisect_left(rel_dir_names, rel_dir_name)
+        if pos < len(rel_dir_names) and rel_dir_names[pos] == rel_dir_name:
+            return pos
+        return None
+
+    def _set_dir(self, rel_dir_name, new_pic_dir):
+        '''
+        Replace whatever the library holds for a directory with new_pic_dir (None to remove it).
+        Files that weren't in the old PicDir are put on the found_files queue for a running playlist.
+        Files the last scan found to be duplicates or near duplicates stay left out.
+        '''
+        pos = self._find_dir(rel_dir_name)
+        old_file_names = set()
+        dup_names = set()
+        similar_names = set()
+        if pos is not None:
+            old_pic_dir = self.pic_dirs.pop(pos)
+            old_file_names = set(pic_file.file_name for pic_file in old_pic_dir.pic_files)
+            for pic_file in old_pic_dir.pic_files:
+                if pic_file in self.duplicates:
+                    self.duplicates.discard(pic_file)
+                    dup_names.add(pic_file.file_name)
+                if pic_file in self.similars:
+                    self.similars.discard(pic_file)
+                    similar_names.add(pic_file.file_name)
+            if self.compact:
+                self.pic_files.remove_range(old_pic_dir.first_file_idx, old_pic_dir.first_file_idx + old_pic_dir.file_cnt)
+            else:
+                self.pic_files = [pic_file for pic_file in self.pic_files if pic_file.pic_dir is not old_pic_dir]
+        if new_pic_dir is not None:
+            rel_dir_names = [pic_dir.rel_dir_name for pic_dir in self.pic_dirs]
+            self.pic_dirs.insert(bisect.bisect_left(rel_dir_names, rel_dir_name), new_pic_dir)
+            for pic_file in new_pic_dir.pic_files:
+                if pic_file.file_name in dup_names:
+                    self.duplicates.add(pic_file)
+                    continue
+                if pic_file.file_name in similar_names:
+                    self.similars.add(pic_file)
+                    continue
+                self.pic_files.append(pic_file)
+                if pic_file.file_name not in old_file_names:
+                    log.info('New file: %s' % os.path.join(rel_dir_name, pic_file.file_name))
+                    self.found_files.put(pic_file)
         self.dir_cnt = len(self.pic_dirs)
         self.file_cnt = len(self.pic_files)
+        self.change_cnt += 1
+
+    def _forget_dirs(self, rel_dir_name):
+        '''
+        Remove a directory and everything below it from the library. Returns the set of scanned directories removed
+        '''
+        sub_dir_prefix = rel_dir_name + '/' if rel_dir_name else ''
+        removed = set(d for d in self.dir_mtimes if d == rel_dir_name or d.startswith(sub_dir_prefix))
+        for d in removed:
+            del self.dir_mtimes[d]
+            if self.index is not None:
+                self.index.drop(d)
+            if self._find_dir(d) is not None:
+                self._set_dir(d, None)
+        return removed
+
+    def refresh_dirs(self, rel_dir_names):
+        '''
+        Bring the library up to date with changes to some already scanned directories, without a full scan.
+        New sub directories are scanned, vanished ones are removed. New files are put on the found_files queue.
+        Returns the (added, removed) sets of scanned directory names, so a watcher can follow them.
+        '''
+        added = set()
+        removed = set()
+        with self.scan_lock, self.lock:
+            for rel_dir_name in sorted(rel_dir_names):
+                if rel_dir_name in removed or rel_dir_name not in self.dir_mtimes:
+                    continue
+                dirpath = self._dirpath(rel_dir_name)
+                if not os.path.isdir(dirpath):
+                    removed |= self._forget_dirs(rel_dir_name)
+                    continue
+                dir_names, file_names = self._list_dir(dirpath, rel_dir_name)
+                self._set_dir(rel_dir_name, self._new_pic_dir(dirpath, rel_dir_name, file_names))
+                sub_dirs = set(sub_rel_dir_name for __dirpath, sub_rel_dir_name in self._sub_dirs(rel_dir_name, dir_names))
+                sub_dir_prefix = rel_dir_name + '/' if rel_dir_name else ''
+                for d in list(self.dir_mtimes):
+                    if d.startswith(sub_dir_prefix) and d != rel_dir_name and '/' not in d[len(sub_dir_prefix):] and d not in sub_dirs:
+                        removed |= self._forget_dirs(d)
+                for sub_rel_dir_name in sorted(sub_dirs - set(self.dir_mtimes)):
+                    for dirpath, walk_rel_dir_name, walk_file_names in self._walk(sub_rel_dir_name):
+                        added.add(walk_rel_dir_name)
+                        self._set_dir(walk_rel_dir_name, self._new_pic_dir(dirpath, walk_rel_dir_name, walk_file_names))
+            self.save_index()
+        if added or removed:
+            log.info('Library refreshed: %s dirs added %s dirs removed. %s dirs %s files' % (len(added), len(removed), self.dir_cnt, self.file_cnt))
+        return added, removed
+
+    def watch(self, check_secs=60.0):
+        '''
+        Keep the library up to date with file system changes once the running scan finishes. Uses inotify if it can,
+        otherwise checks directory mtimes every check_secs. New files are mixed into a repeating playlist.
+        '''
+        import PicWatcher
+        self.watcher = PicWatcher.new_watcher(self, check_secs)
+        self.watcher.start()
+        return self.watcher
+
+    def resumed_files(self, rel_paths):
+        '''
+        PicFiles for relative paths saved by a ShowCheckpoint. They aren't the library's own, as it may not be scanned yet
+        '''
+        pic_dirs = {}
+        pic_files = []
+        for rel_path in rel_paths:
+            rel_dir_name, fname = os.path.split(rel_path)
+            pic_dir = pic_dirs.get(rel_dir_name)
+            if pic_dir is None:
+                pic_dir = pic_dirs[rel_dir_name] = PicDir(rel_dir_name)
+            pic_files.append(PicFile(pic_dir, fname))
+        return pic_files
+
+    def playlist(self, shuffle=True, repeat=False, date_from=None, date_to=None, recent_n=0, reshuffle_num=1,
+                 dir_shuffle=None, resume=None):
+        '''
+        Generate PicFiles as the running update() scan finds them, so a slideshow can start on the first one found.
+        With shuffle, each newly found file is swapped into a random position among the files still waiting to be
+        played (an inside-out Fisher-Yates shuffle). The waiting files are always in a random order, and files found
+        late in the scan are mixed in with the rest rather than played last.
+        With repeat, the playlist never ends. Later passes play a Playlist of the whole library, reshuffled every
+        reshuffle_num passes and rebuilt when a watcher changes the library. Files a watcher finds play next.
+        date_from and date_to (seconds or (year, month, day)) limit it to files with an EXIF date in that range. That needs
+        the whole library's dates, so the first pass waits for the scan to finish, then plays the Playlist.
+        With shuffle, recent_n plays the most recent files first. The first pass still streams, and once the scan has
+        finished the most recent recent_n of the files still waiting are moved to play next.
+        dir_shuffle (a dict of DirShuffle arguments) picks a directory by weight, then a picture in it, rather than
+        shuffling the files together. recent_n doesn't apply, and it also waits for the scan. Its state is kept in the index file, if there is one,
+        so a restart carries on the rotation. Each pass is as many picks as there are files.
+        With dedup or similar, duplicates and near duplicates are left out once the scan has found them.
+        Pictures in the quarantine, that failed or were too slow to load, are always left out.
+        resume (relative paths from a ShowCheckpoint) is the rest of the pass the show was part way through when it
+        stopped. It plays first, without waiting for the scan, then the playlist carries on with a pass of the library.
+        While a pass plays, play_files is its PicFiles in play order, if the order is known, and play_cnt counts passes.
+        '''
+        found_files = self.found_files
+        date_from = to_timestamp(date_from)
+        date_to = to_timestamp(date_to, end=True)
+        stream = date_from is None and date_to is None and dir_shuffle is None
+        if resume:
+            pic_files = self.resumed_files(resume)
+            with self.lock:
+                self.play_files = pic_files
+                self.play_cnt += 1
+            for pic_file in pic_files:
+                # Gone or quarantined since the checkpoint
+                if os.path.exists(os.path.join(self.src_dir, pic_file.pic_dir.rel_dir_name, pic_file.file_name)) and \
+                        not self.quarantine.contains(pic_file):
+                    yield pic_file
+            if not repeat:
+                return
+            # Played part of the first pass already, so wait for the scan and play a whole one
+            stream = False
+        else:
+            with self.lock:
+                self.play_files = None
         if shuffle:
-            random.shuffle(self.pic_files)
+            waiting = []
+            def add(pic_file):
+                pos = random.randint(0, len(waiting))
+                waiting.append(pic_file)
+                waiting[pos], waiting[-1] = waiting[-1], waiting[pos]
+            take = waiting.pop
+        else:
+            waiting = deque()
+            add = waiting.append
+            take = waiting.popleft
+        scanning = True
+        while True:
+            # Take everything found so far. Only block while the scan is running and there is nothing to play
+            while True:
+                try:
+                    pic_file = found_files.get(block=scanning and not waiting)
+                except queue.Empty:
+                    break
+                if pic_file is None:
+                    scanning = False
+                    if stream:
+                        if shuffle and recent_n > 0:
+                            recent_first(waiting, recent_n)
+                        # The rest of the first pass is now known
+                        with self.lock:
+                            self.play_files = list(reversed(waiting)) if shuffle else list(waiting)
+                            self.play_cnt += 1
+                elif stream:
+                    add(pic_file)
+            if not waiting and not scanning:
+                break
+            pic_file = take()
+            if not self.excluded(pic_file):
+                yield pic_file
+        if stream and not repeat:
+            return
 
-    def update(self,shuffle=True):
-        self.update_thread = Thread(name='PicLibrary update', target=self.get_file_list, args=(shuffle,))
-        self.update_thread.start()
+        def in_range(pic_file):
+            dt = pic_file.dt or 0.0
+            return (date_from is None or dt >= date_from) and (date_to is None or dt <= date_to)
+
+        def skip(pic_file):
+            return self.excluded(pic_file) or not in_range(pic_file)
+
+        pic_list = None
+        while True:
+            with self.lock:
+                if pic_list is None or self.change_cnt != change_cnt:
+                    change_cnt = self.change_cnt
+                    if dir_shuffle is not None:
+                        pic_list = DirShuffle(self.pic_dirs, skip, state_file=self.index.index_file if self.index is not None else None,
+                                              **dir_shuffle)
+                    else:
+                        pic_list = Playlist(DateIndex(self.pic_files), date_from, date_to, recent_n, shuffle, reshuffle_num)
+            if not len(pic_list):
+                if not repeat:
+                    return
+                # Wait for the watcher to find something
+                found_files.get()
+                continue
+            pass_files = pic_list.next_pass()
+            with self.lock:
+                # A DirShuffle picks as it goes, and keeps its own state
+                self.play_files = pic_list if isinstance(pic_list, Playlist) else None
+                self.play_cnt += 1
+            for pic_file in pass_files:
+                while True:
+                    try:
+                        new_pic_file = found_files.get_nowait()
+                    except queue.Empty:
+                        break
+                    if new_pic_file is not None and in_range(new_pic_file) and not self.quarantine.contains(new_pic_file):
+                        yield new_pic_file
+                # Quarantined since the playlist was built
+                if not self.quarantine.contains(pic_file):
+                    yield pic_file
+            if not repeat:
+                return
 
-    def __init__(self, src_dir, path_regxs=PATH_REGXS):
+    def __init__(self, src_dir, path_regxs=PATH_REGXS, index_file=None, scan_threads=0, compact=False, exif_threads=0,
+            dedup_threads=0, similar_threads=0, slow_secs=SLOW_SECS):
         self.src_dir = src_dir
+        # Pictures that failed to load, or took over slow_secs, recorded by the slide loader. Left out of playlists
+        # until they change. Kept in the index file if there is one
+        self.quarantine = PicQuarantine(src_dir, index_file, slow_secs)
+        # > 0 finds files with the same content after each scan, hashing this many at once, and keeps one of each.
+        # The hashes are cached in the index file if there is one
+        self.dedup = PicDedup(src_dir, index_file, dedup_threads) if dedup_threads > 0 else None
+        self.dup_groups = []
+        self.duplicates = set()
+        # > 0 finds clusters of near identical pictures, such as bursts, after each scan and keeps one of each.
+        # Perceptual hashes are worked out this many at once and cached in the index file if there is one
+        self.similar = PicSimilar(src_dir, index_file, similar_threads) if similar_threads > 0 else None
+        self.similar_clusters = []
+        self.similars = set()
+        # > 0 reads the EXIF date and orientation of every file, from its header only, as it's scanned.
+        # Cached in the index if there is one
+        self.exif_pool = ThreadPoolExecutor(max_workers=exif_threads, thread_name_prefix='PicLibrary EXIF') if exif_threads > 0 else None
+        # Hold the library in CompactLibrary arrays rather than a PicDir/PicFile object per directory/file.
+        # Much smaller for very large libraries. The pic_dirs and pic_files look the same to callers.
+        self.compact = compact
+        # > 1 lists directories concurrently. Worth it on USB/NFS where directory reads block
+        self.scan_threads = scan_threads
+        # Optional persistent directory listing cache. Only changed directories are re-listed on a rescan
+        self.index = PicIndex(index_file) if index_file is not None else None
         # Take defaults and merge in whatever is past in as argument.
         # So you can pass in a partial regx config
-        self.path_regxs = PATH_REGXS
+        self.path_regxs = dict(PATH_REGXS)
+        if self.dedup is not None:
+            # Copies are found by content, so names like IMG-2.jpg no longer need excluding, unless exc_files is passed in
+            self.path_regxs['exc_files'] = []
         self.path_regxs.update(path_regxs)
+        self.dir_matcher = None
+        self.file_matcher = None
+        self.store = None
+        self.dir_mtimes = {}
+        self.lock = Lock()
+        self.scan_lock = Lock() # Held through a scan, so a watcher refresh waits for it
+        self.change_cnt = 0 # Counts scans and watcher changes, so a playlist knows when to rebuild
+        self.watcher = None
+        self.found_files = queue.Queue()
+        self.found_files.put(None)
+        self.play_files = None # PicFiles of the playlist pass playing, in play order. None if not known
+        self.play_cnt = 0 # Counts playlist passes, so a ShowCheckpoint knows when play_files is a new pass
         self.cur_pic = None
         self.pic_dirs = []
         self.pic_files = []
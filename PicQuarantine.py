@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+'''
+Pictures that couldn't be shown, because they failed to load or were too slow to, kept out of the show until
+they change.
+Run as a script to list them:
+    PicQuarantine.py [--index FILE] [--src DIR] [--clear]
+'''
+import os
+import time
+import logging
+import sqlite3
+import argparse
+from threading import Lock
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = os.path.join(os.path.abspath(os.path.dirname(os.path.realpath(__file__))), 'pic_index.db')
+SLOW_SECS = 10.0 # A load taking longer than this is slow
+SLOW_CNT = 2 # Slow loads before a picture is quarantined. One could just be the disk waking up
+ERROR = 'error'
+SLOW = 'slow'
+
+class PicQuarantine():
+    '''
+    Failed and slow loads, keyed by relative path, size and mtime, in an SQLite table that can live in the PicLibrary
+    index file. A failed picture is quarantined straight away, a slow one after slow_cnt slow loads.
+    A quarantined picture stays out of playlists until its size or mtime changes, ie it's been fixed or replaced.
+    Loads are recorded from the slide loader thread and prefetcher, so every call uses its own connection.
+    '''
+    def __init__(self, src_dir, cache_file=None, slow_secs=SLOW_SECS, slow_cnt=SLOW_CNT):
+        self.src_dir = src_dir
+        self.cache_file = cache_file
+        self.slow_secs = slow_secs
+        self.slow_cnt = slow_cnt
+        self.lock = Lock()
+        self.entries = {} # rel_path: [size, mtime_ns, reason, detail, secs, cnt, last_tm]
+
+    def connect(self):
+        con = sqlite3.connect(self.cache_file, timeout=30.0)
+        con.execute('''CREATE TABLE IF NOT EXISTS quarantine (
+            rel_path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            detail TEXT,
+            secs REAL,
+            cnt INTEGER NOT NULL,
+            last_tm REAL NOT NULL
+        )''')
+        return con
+
+    def load(self):
+        '''
+        Read the table, dropping pictures that have changed or gone since they were recorded
+        '''
+        entries = {}
+        changed = []
+        if self.cache_file is not None and os.path.exists(self.cache_file):
+            try:
+                con = self.connect()
+                try:
+                    for row in con.execute('SELECT * FROM quarantine'):
+                        entries[row[0]] = list(row[1:])
+                    changed = [rel_path for rel_path, entry in entries.items() if self.stat(rel_path) != tuple(entry[:2])]
+                    if changed:
+                        with con:
+                            con.executemany('DELETE FROM quarantine WHERE rel_path = ?', ((rel_path,) for rel_path in changed))
+                finally:
+                    con.close()
+            except sqlite3.Error as e:
+                log.warning('Ignoring unreadable quarantine %s: %s' % (self.cache_file, e))
+                entries = {}
+                changed = []
+            for rel_path in changed:
+                log.info('Released changed %s' % rel_path)
+                del entries[rel_path]
+        with self.lock:
+            self.entries = entries
+        quarantined_cnt = sum(self.quarantined(rel_path) for rel_path in entries)
+        if quarantined_cnt:
+            log.info('%s pictures quarantined' % quarantined_cnt)
+
+    def stat(self, rel_path):
+        try:
+            st = os.stat(os.path.join(self.src_dir, rel_path))
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def quarantined(self, rel_path):
+        with self.lock:
+            entry = self.entries.get(rel_path)
+        return entry is not None and (entry[2] == ERROR or entry[5] >= self.slow_cnt)
+
+    def contains(self, pic_file):
+        '''
+        Whether a PicFile is quarantined
+        '''
+        return bool(self.entries) and self.quarantined(os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name))
+
+    def record(self, rel_path, secs, error=None):
+        '''
+        Record a load of rel_path that took secs, and failed with error if it isn't None.
+        Loads that were fine and fast aren't kept. Returns True if the picture is now quarantined
+        '''
+        if error is None and secs <= self.slow_secs:
+            return False
+        size_mtime = self.stat(rel_path)
+        if size_mtime is None:
+            return False
+        with self.lock:
+            entry = self.entries.get(rel_path)
+            if entry is None or tuple(entry[:2]) != size_mtime:
+                entry = list(size_mtime) + [None, None, None, 0, None]
+            entry[2] = ERROR if error is not None else SLOW
+            entry[3] = str(error) if error is not None else None
+            entry[4] = secs
+            entry[5] += 1
+            entry[6] = time.time()
+            self.entries[rel_path] = entry
+        if self.quarantined(rel_path):
+            log.warning('Quarantined %s: %s' % (rel_path, entry[3] if error is not None else 'slow %.1fs' % secs))
+        if self.cache_file is not None:
+            try:
+                con = self.connect()
+                try:
+                    with con:
+                        con.execute('INSERT OR REPLACE INTO quarantine VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [rel_path] + entry)
+                finally:
+                    con.close()
+            except sqlite3.Error as e:
+                log.warning('Could not save quarantine %s: %s' % (self.cache_file, e))
+        return self.quarantined(rel_path)
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+        if self.cache_file is not None and os.path.exists(self.cache_file):
+            con = self.connect()
+            try:
+                with con:
+                    con.execute('DELETE FROM quarantine')
+            finally:
+                con.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='List pictures kept out of the show because they failed or were slow to load')
+    parser.add_argument('--index', default=INDEX_FILE, help='PicLibrary index file')
+    parser.add_argument('--src', default='/home/pi/Pictures', help='Picture directory. Changed pictures are released')
+    parser.add_argument('--clear', action='store_true', help='Release every picture')
+    args = parser.parse_args()
+    quarantine = PicQuarantine(args.src, args.index)
+    quarantine.load()
+    if args.clear:
+        released_cnt = len(quarantine.entries)
+        quarantine.clear()
+        print('Released %s pictures' % released_cnt)
+        return
+    print('%-10s %5s %8s %-19s %s' % ('status', 'loads', 'secs', 'last', 'picture'))
+    for rel_path, (size, mtime_ns, reason, detail, secs, cnt, last_tm) in sorted(quarantine.entries.items(),
+            key=lambda item: item[1][6], reverse=True):
+        status = reason if quarantine.quarantined(rel_path) else reason + '?'
+        print('%-10s %5s %8s %-19s %s' % (status, cnt, '%.1f' % secs if secs is not None else '-', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_tm)), rel_path))
+        if detail:
+            print('%-45s %s' % ('', detail))
+
+if __name__ == "__main__":
+    # setup logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
+        level=logging.INFO
+        )
+    prog_name = Path(__file__).stem
+    log = logging.getLogger(name=prog_name)
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+
+import os
+import time
+import logging
+import sqlite3
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+log = logging.getLogger(__name__)
+
+HASH_BITS = 64
+HASH_SIZE = (9, 8) # Grey pixels the dHash compares. Each row of 9 gives 8 left/right differences
+DRAFT_SIZE = (64, 64) # JPEGs are decoded at 1/8 scale or less, so hashing reads little more than the header
+CHUNK_BITS = 16
+CHUNK_CNT = HASH_BITS // CHUNK_BITS
+MAX_DIST = 6 # Hashes this many bits or fewer apart are the same shot
+MAX_BUCKET = 64 # A chunk value more hashes than this share, eg from flat skies or dark frames, isn't looked up
+BURST_SECS = 60.0 # Pictures dated further apart than this aren't the same shot
+
+def dhash(path):
+    '''
+    64 bit difference hash of a picture: whether each pixel of a tiny grey version is brighter than the one to its right.
+    Survives resizing, recompression and small exposure changes, so the frames of a burst hash within a few bits
+    '''
+    with Image.open(path) as im:
+        if im.format == 'JPEG':
+            im.draft('L', DRAFT_SIZE)
+        pixels = list(im.convert('L').resize(HASH_SIZE, Image.BILINEAR).getdata())
+    h = 0
+    for row in range(HASH_SIZE[1]):
+        for col in range(HASH_SIZE[0] - 1):
+            pos = row * HASH_SIZE[0] + col
+            h = (h << 1) | (pixels[pos] > pixels[pos + 1])
+    return h
+
+def hamming(h1, h2):
+    return bin(h1 ^ h2).count('1')
+
+if hasattr(int, 'bit_count'): # Python 3.10+
+    def hamming(h1, h2):
+        return (h1 ^ h2).bit_count()
+
+# XOR masks giving the chunk values within 0 or 1 bits of a chunk
+NEIGHBOUR_MASKS = ([0], [0] + [1 << bit for bit in range(CHUNK_BITS)])
+
+class HashIndex():
+    '''
+    Multi-index hashing over 64 bit hashes. Each hash is split into CHUNK_CNT chunks, with a table per chunk.
+    Two hashes within max_dist bits of each other must have some chunk within max_dist // CHUNK_CNT bits (the
+    pigeonhole principle), so a search only looks up that chunk's neighbours in each table, rather than comparing
+    with every hash.
+    max_dist must be under 2 * CHUNK_CNT.
+    A chunk value shared by more than max_bucket hashes says little about a picture, and looking it up would make
+    searches O(n), so it's dropped from its table. Hashes close only in that chunk aren't found.
+    '''
+    def __init__(self, max_dist=MAX_DIST, max_bucket=MAX_BUCKET):
+        if max_dist >= 2 * CHUNK_CNT:
+            raise ValueError('max_dist must be under %s' % (2 * CHUNK_CNT))
+        self.max_dist = max_dist
+        self.max_bucket = max_bucket
+        self.dropped_cnt = 0 # Chunk values dropped for being too common
+        self.neighbour_masks = NEIGHBOUR_MASKS[max_dist // CHUNK_CNT]
+        self.tables = [{} for __c in range(CHUNK_CNT)]
+        self.hashes = []
+
+    def chunks(self, h):
+        mask = (1 << CHUNK_BITS) - 1
+        return [(h >> (c * CHUNK_BITS)) & mask for c in range(CHUNK_CNT)]
+
+    def add(self, h):
+        '''
+        Add a hash. Returns its position
+        '''
+        pos = len(self.hashes)
+        self.hashes.append(h)
+        for table, chunk in zip(self.tables, self.chunks(h)):
+            positions = table.setdefault(chunk, [])
+            if positions is None:
+                continue
+            if len(positions) >= self.max_bucket:
+                table[chunk] = None
+                self.dropped_cnt += 1
+                continue
+            positions.append(pos)
+        return pos
+
+    def search(self, h):
+        '''
+        Positions of the hashes added so far within max_dist bits of h
+        '''
+        seen = set()
+        for table, chunk in zip(self.tables, self.chunks(h)):
+            for mask in self.neighbour_masks:
+                positions = table.get(chunk ^ mask)
+                if positions is not None:
+                    seen.update(positions)
+        hashes = self.hashes
+        max_dist = self.max_dist
+        return [pos for pos in seen if hamming(h, hashes[pos]) <= max_dist]
+
+def cluster(hashes, max_dist=MAX_DIST, groups=None, times=None, burst_secs=BURST_SECS):
+    '''
+    Group positions in hashes into clusters of near duplicates: chains of hashes each within max_dist of the last.
+    With groups (eg the directory of each picture), only hashes in the same group are linked, so a chain can't run
+    across the whole library. With times, dated hashes are only linked within burst_secs of each other. Undated hashes
+    are clustered among themselves, then each of those clusters joins the one dated cluster nearest to it, if any, so
+    an undated picture can't bridge shots taken far apart.
+    Returns the clusters of more than one, each in position order
+    '''
+    indexes = {} # group: (HashIndex, position in hashes of each hash in the index). Missing hashes aren't indexed
+    parents = list(range(len(hashes)))
+    def root(pos):
+        while parents[pos] != pos:
+            parents[pos] = parents[parents[pos]]
+            pos = parents[pos]
+        return pos
+    def undated(pos):
+        return times is not None and times[pos] is None
+    near_dated = [] # (dist, undated position, dated position) of near hashes, one dated and one not
+    for pos, h in enumerate(hashes):
+        if h is None:
+            continue
+        group = groups[pos] if groups is not None else None
+        if group not in indexes:
+            indexes[group] = (HashIndex(max_dist), [])
+        index, index_positions = indexes[group]
+        for index_pos in index.search(h):
+            other_pos = index_positions[index_pos]
+            if undated(pos) != undated(other_pos):
+                undated_pos, dated_pos = (pos, other_pos) if undated(pos) else (other_pos, pos)
+                near_dated.append((hamming(h, hashes[other_pos]), undated_pos, dated_pos))
+            elif undated(pos) or times is None or abs(times[pos] - times[other_pos]) <= burst_secs:
+                parents[root(other_pos)] = root(pos)
+        index.add(h)
+        index_positions.append(pos)
+    # Each undated cluster joins the dated cluster nearest to it
+    joins = {}
+    for dist, undated_pos, dated_pos in sorted(near_dated):
+        joins.setdefault(root(undated_pos), dated_pos)
+    for undated_root, dated_pos in joins.items():
+        parents[undated_root] = root(dated_pos)
+    dropped_cnt = sum(index.dropped_cnt for index, __positions in indexes.values())
+    if dropped_cnt:
+        log.info('Similar: %s chunk values too common to look up' % dropped_cnt)
+    clusters = {}
+    for pos in range(len(hashes)):
+        clusters.setdefault(root(pos), []).append(pos)
+    return [positions for positions in clusters.values() if len(positions) > 1]
+
+class PicSimilar():
+    '''
+    Finds bursts and other near identical pictures in a library, by the Hamming distance between their dHashes.
+    Hashes come from a reduced size decode and are cached in an SQLite table keyed by relative path, size and mtime,
+    which can live in the PicLibrary index file. Clustering uses a HashIndex, so isn't O(n^2) in the library size.
+    Only pictures in the same directory, and taken within BURST_SECS of each other if dated, are clustered.
+    '''
+    def __init__(self, src_dir, cache_file=None, threads=2, max_dist=MAX_DIST):
+        self.src_dir = src_dir
+        self.cache_file = cache_file
+        self.threads = threads
+        self.max_dist = max_dist
+        self.cache = {}
+        self.hash_cnt = 0
+
+    def connect(self):
+        con = sqlite3.connect(self.cache_file)
+        con.execute('''CREATE TABLE IF NOT EXISTS phashes (
+            rel_path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            phash INTEGER
+        )''')
+        return con
+
+    def load(self):
+        self.cache = {}
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return
+        try:
+            con = self.connect()
+            try:
+                for rel_path, size, mtime_ns, phash in con.execute('SELECT * FROM phashes'):
+                    # SQLite integers are signed
+                    self.cache[rel_path] = (size, mtime_ns, phash % (1 << HASH_BITS) if phash is not None else None)
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            log.warning('Ignoring unreadable hash cache %s: %s' % (self.cache_file, e))
+            self.cache = {}
+
+    def save(self, entries):
+        if self.cache_file is None:
+            return
+        def signed(phash):
+            return phash - (1 << HASH_BITS) if phash is not None and phash >= 1 << (HASH_BITS - 1) else phash
+        con = self.connect()
+        try:
+            with con:
+                con.execute('DELETE FROM phashes')
+                con.executemany('INSERT INTO phashes VALUES (?, ?, ?, ?)',
+                    ((rel_path, size, mtime_ns, signed(phash)) for rel_path, (size, mtime_ns, phash) in entries.items()))
+        finally:
+            con.close()
+
+    def file_hash(self, rel_path):
+        '''
+        Returns (size, mtime_ns, phash) of a file. The hash is None if the picture can't be read
+        '''
+        path = os.path.join(self.src_dir, rel_path)
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            log.warning('Skipping %s: %s' % (rel_path, e))
+            return None
+        cached = self.cache.get(rel_path)
+        if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns):
+            return cached
+        self.hash_cnt += 1
+        try:
+            phash = dhash(path)
+        except Exception as e:
+            log.warning('Could not hash %s: %s' % (rel_path, e))
+            phash = None
+        return st.st_size, st.st_mtime_ns, phash
+
+    def find_clusters(self, pic_files):
+        '''
+        Return a list of clusters of near identical PicFiles, each in path order
+        '''
+        start_tm = time.time()
+        self.load()
+        self.hash_cnt = 0
+        pic_files = list(pic_files)
+        rel_paths = [os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name) for pic_file in pic_files]
+        entries = {}
+        hashes = []
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='PicSimilar') as pool:
+            for rel_path, entry in zip(rel_paths, pool.map(self.file_hash, rel_paths)):
+                if entry is not None:
+                    entries[rel_path] = entry
+                hashes.append(entry[2] if entry is not None else None)
+        hash_tm = time.time()
+        clusters = [sorted((pic_files[pos] for pos in positions), key=lambda pic_file: (pic_file.pic_dir.rel_dir_name, pic_file.file_name))
+            for positions in cluster(hashes, self.max_dist, [pic_file.pic_dir.rel_dir_name for pic_file in pic_files],
+                                     [pic_file.dt for pic_file in pic_files])]
+        clusters.sort(key=lambda pic_files: (pic_files[0].pic_dir.rel_dir_name, pic_files[0].file_name))
+        self.save(entries)
+        log.info('Similar: %s files %s hashed in %.2fs. %s clusters of %s files in %.2fs' % (len(pic_files), self.hash_cnt,
+            hash_tm - start_tm, len(clusters), sum(len(pic_files) for pic_files in clusters), time.time() - hash_tm))
+        return clusters
+
+def main():
+    import sys
+    import PicLibrary as PLib
+    pic_lib = PLib.PicLibrary(sys.argv[1])
+    pic_lib.get_file_list(shuffle=False)
+    for pic_files in PicSimilar(sys.argv[1]).find_clusters(pic_lib.pic_files):
+        log.info('Cluster of %s:' % len(pic_files))
+        for pic_file in pic_files:
+            log.info('    %s' % os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name))
+
+if __name__ == "__main__":
+    # setup logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
+        level=logging.INFO
+        )
+    prog_name = Path(__file__).stem
+    log = logging.getLogger(name=prog_name)
+    main()
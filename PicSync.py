@@ -0,0 +1,319 @@
+#!/usr/bin/python3
+
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+from shutil import copyfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+log = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.pic_sync.db' # Kept in the destination directory, so it always describes what is there
+TMP_SUFFIX = '.sync_tmp'
+HASH_CHUNK = 1024 * 1024
+CHECKPOINT_CNT = 100 # Copies between manifest commits, so an interrupted sync picks up where it stopped
+JPEG_QUALITY = 90
+TAG_ORIENTATION = 0x0112
+TAG_EXIF_IFD = 0x8769
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def copy_atomic(src_file, dst_file, mtime_ns):
+    '''
+    Copy to a temporary name next to dst_file then rename it into place, so the frame never sees half a picture.
+    The copy keeps the source mtime
+    '''
+    tmp_file = dst_file + TMP_SUFFIX
+    try:
+        copyfile(src_file, tmp_file)
+        os.utime(tmp_file, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp_file, dst_file)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+
+def resize_copy(src_file, dst_file, mtime_ns, display_size, fit=True, quality=JPEG_QUALITY):
+    '''
+    Copy a picture turned upright and scaled down to display_size, keeping its EXIF (so its date) and mtime.
+    Pictures that are already upright and no bigger than the display are copied as they are
+    '''
+    from PIL import Image
+    import PicImage
+    with Image.open(src_file) as src_im:
+        im_format = src_im.format
+        __dt, orientation = PicImage.read_exif(src_im, src_file)
+        exif = src_im.getexif()
+        exif.get_ifd(TAG_EXIF_IFD) # Load the EXIF sub IFD, which holds the date, so it is written back out
+        scale_size = PicImage.display_scale_size(src_im.size, display_size, orientation, fit)
+    if scale_size is None and orientation == 1:
+        copy_atomic(src_file, dst_file, mtime_ns)
+        return
+    im, __dt, __orientation = PicImage.load_image(src_file, display_size, fit)
+    im = im.convert('RGB')
+    exif[TAG_ORIENTATION] = 1 # The pixels are upright now
+    tmp_file = dst_file + TMP_SUFFIX
+    try:
+        if im_format == 'JPEG':
+            im.save(tmp_file, 'JPEG', quality=quality, exif=exif.tobytes())
+        else:
+            im.save(tmp_file, im_format)
+        os.utime(tmp_file, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp_file, dst_file)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+
+class ResizeCopy():
+    '''
+    A PicSync copy_fn that ships display ready pictures: resize_copy() run in a pool of worker processes.
+    Give the PicSync at least as many worker threads as there are processes, to keep them all busy
+    '''
+    def __init__(self, display_size, fit=True, quality=JPEG_QUALITY, processes=None):
+        self.display_size = display_size
+        self.fit = fit
+        self.quality = quality
+        self.processes = processes or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=self.processes)
+        self.copy_key = 'resize %sx%s %s q%s' % (display_size[0], display_size[1], 'fit' if fit else 'fill', quality)
+
+    def __call__(self, src_file, dst_file, mtime_ns):
+        self.pool.submit(resize_copy, src_file, dst_file, mtime_ns, self.display_size, self.fit, self.quality).result()
+
+    def close(self):
+        self.pool.shutdown()
+
+class PicSync():
+    '''
+    Incrementally copies a scanned PicLibrary to a destination directory.
+    A manifest in the destination records the source size, mtime and (optionally) content hash of every file copied.
+    Only files that are new or whose size or mtime have changed since are copied, by a pool of worker threads.
+    With use_hash a file whose size or mtime changed but whose content didn't is just recorded, not copied.
+    With delete, destination files the manifest has but the library no longer does (removed from the source, or now
+    excluded) are deleted. Files the manifest doesn't know about are never deleted.
+    copy_fn(src_file, dst_file, mtime_ns) does each copy. It must write dst_file atomically. copy_key describes what
+    it does. When it differs from the last sync's, every file is copied again.
+    '''
+    def __init__(self, src_dir, dst_dir, manifest_file=None, workers=4, use_hash=False, delete=False, dry_run=False,
+            copy_fn=copy_atomic, copy_key='copy'):
+        self.src_dir = src_dir
+        self.dst_dir = dst_dir
+        self.manifest_file = manifest_file if manifest_file is not None else os.path.join(dst_dir, MANIFEST_NAME)
+        self.workers = workers
+        self.use_hash = use_hash
+        self.delete = delete
+        self.dry_run = dry_run
+        self.copy_fn = copy_fn
+        self.copy_key = copy_key
+        # Destination files from before there was a manifest can only be adopted if they are plain copies
+        self.adopt = copy_fn is copy_atomic
+        self.manifest = {}
+        self.copy_cnt = 0
+        self.copy_bytes = 0
+        self.same_cnt = 0
+        self.delete_cnt = 0
+        self.fail_cnt = 0
+
+    def connect(self):
+        con = sqlite3.connect(self.manifest_file)
+        con.execute('''CREATE TABLE IF NOT EXISTS synced (
+            rel_path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            hash TEXT
+        )''')
+        con.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        return con
+
+    def load(self, con):
+        self.manifest = {}
+        row = con.execute("SELECT value FROM meta WHERE key = 'copy_key'").fetchone()
+        mode_changed = row is not None and row[0] != self.copy_key
+        if mode_changed:
+            log.info('Copy mode changed from %s to %s. Copying everything again' % (row[0], self.copy_key))
+        if not self.dry_run and (row is None or mode_changed):
+            with con:
+                if mode_changed:
+                    # Keep the paths, so files no longer in the library can still be deleted
+                    con.execute('UPDATE synced SET size = -1, mtime_ns = -1, hash = NULL')
+                con.execute("INSERT OR REPLACE INTO meta VALUES ('copy_key', ?)", (self.copy_key,))
+        for rel_path, size, mtime_ns, hash_hex in con.execute('SELECT * FROM synced'):
+            self.manifest[rel_path] = (-1, -1, None) if mode_changed else (size, mtime_ns, hash_hex)
+        log.info('Sync manifest loaded: %s files from %s' % (len(self.manifest), self.manifest_file))
+
+    def plan(self, pic_lib, pool):
+        '''
+        Return ([(rel_path, size, mtime_ns)] to copy, [rel_path] to delete) for a scanned library
+        '''
+        rel_paths = [os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name) for pic_file in pic_lib.pic_files]
+        def src_stat(rel_path):
+            try:
+                return os.stat(os.path.join(self.src_dir, rel_path))
+            except OSError as e:
+                log.warning('Skipping %s: %s' % (rel_path, e))
+                return None
+        copies = []
+        for rel_path, st in zip(rel_paths, pool.map(src_stat, rel_paths)):
+            if st is None:
+                continue
+            entry = self.manifest.get(rel_path)
+            if entry is None or entry[:2] != (st.st_size, st.st_mtime_ns):
+                copies.append((rel_path, st.st_size, st.st_mtime_ns))
+        deletes = []
+        if self.delete:
+            deletes = sorted(set(self.manifest).difference(rel_paths))
+        return copies, deletes
+
+    def unchanged(self, rel_path, size, src_file, dst_file):
+        '''
+        Whether a file due to be copied already has the same content at the destination, and the source's content
+        hash with use_hash, else None: (same, hash).
+        Without use_hash, a destination file with the same size that the manifest doesn't know about (copied
+        before there was a manifest) counts as the same
+        '''
+        entry = self.manifest.get(rel_path)
+        if self.use_hash:
+            src_hash = file_hash(src_file)
+            if entry is not None and entry[2] == src_hash and os.path.exists(dst_file):
+                return True, src_hash
+            if entry is None and self.adopt and os.path.exists(dst_file) and file_hash(dst_file) == src_hash:
+                return True, src_hash
+            return False, src_hash
+        if entry is None and self.adopt and os.path.exists(dst_file) and os.path.getsize(dst_file) == size:
+            return True, None
+        return False, None
+
+    def sync_file(self, rel_path, size, mtime_ns):
+        '''
+        Worker side. Returns (copied, hash or None)
+        '''
+        src_file = os.path.join(self.src_dir, rel_path)
+        dst_file = os.path.join(self.dst_dir, rel_path)
+        same, hash_hex = self.unchanged(rel_path, size, src_file, dst_file)
+        if same:
+            return False, hash_hex
+        log.info('CP %-120s %-120s' % (src_file, dst_file))
+        if not self.dry_run:
+            self.copy_fn(src_file, dst_file, mtime_ns)
+        return True, hash_hex
+
+    def delete_file(self, rel_path):
+        dst_file = os.path.join(self.dst_dir, rel_path)
+        log.info('RM %s' % dst_file)
+        if self.dry_run:
+            return
+        try:
+            os.remove(dst_file)
+        except FileNotFoundError:
+            pass
+        # Remove directories left empty
+        dst_dir = os.path.dirname(dst_file)
+        while dst_dir != self.dst_dir and dst_dir.startswith(self.dst_dir):
+            try:
+                os.rmdir(dst_dir)
+            except OSError:
+                break
+            dst_dir = os.path.dirname(dst_dir)
+
+    def run(self, pic_lib):
+        '''
+        Sync a scanned PicLibrary to the destination. Returns the number of files copied
+        '''
+        start_tm = time.time()
+        os.makedirs(self.dst_dir, exist_ok=True)
+        con = self.connect()
+        try:
+            self.load(con)
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='PicSync') as pool:
+                copies, deletes = self.plan(pic_lib, pool)
+                log.info('Sync plan: %s of %s files to copy, %s to delete' % (len(copies), pic_lib.file_cnt, len(deletes)))
+                for rel_dir_name in sorted(set(os.path.dirname(rel_path) for rel_path, __size, __mtime_ns in copies)):
+                    dst_dir = os.path.join(self.dst_dir, rel_dir_name)
+                    if not os.path.isdir(dst_dir) and not self.dry_run:
+                        log.info('mkdir: %s' % dst_dir)
+                        os.makedirs(dst_dir)
+                self.copy_all(con, pool, copies)
+            for rel_path in deletes:
+                self.delete_file(rel_path)
+                self.delete_cnt += 1
+            if not self.dry_run:
+                with con:
+                    con.executemany('DELETE FROM synced WHERE rel_path = ?', ((rel_path,) for rel_path in deletes))
+        finally:
+            con.close()
+        log.info('Sync complete: %s copied (%.0f MB) %s unchanged %s deleted %s failed in %.2fs' % (self.copy_cnt,
+            self.copy_bytes / 1e6, self.same_cnt, self.delete_cnt, self.fail_cnt, time.time() - start_tm))
+        return self.copy_cnt
+
+    def copy_all(self, con, pool, copies):
+        '''
+        Copy with at most 2 * workers copies queued at once, recording each in the manifest as it completes
+        '''
+        copies = iter(copies)
+        pending = {}
+        synced = []
+        def submit():
+            for rel_path, size, mtime_ns in copies:
+                pending[pool.submit(self.sync_file, rel_path, size, mtime_ns)] = (rel_path, size, mtime_ns)
+                if len(pending) >= self.workers * 2:
+                    break
+        submit()
+        while pending:
+            done, __not_done = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_path, size, mtime_ns = pending.pop(future)
+                try:
+                    copied, hash_hex = future.result()
+                except Exception as e:
+                    # Not just OSError. A corrupt or huge picture can fail a --resize copy in PIL any number of ways
+                    log.error('Copy failed %s: %s: %s' % (rel_path, type(e).__name__, e))
+                    self.fail_cnt += 1
+                    continue
+                if copied:
+                    self.copy_cnt += 1
+                    self.copy_bytes += size
+                else:
+                    self.same_cnt += 1
+                synced.append((rel_path, size, mtime_ns, hash_hex))
+            if len(synced) >= CHECKPOINT_CNT:
+                self.record(con, synced)
+            submit()
+        self.record(con, synced)
+
+    def record(self, con, synced):
+        if not self.dry_run:
+            with con:
+                con.executemany('INSERT OR REPLACE INTO synced VALUES (?, ?, ?, ?)', synced)
+        synced.clear()
+
+def main():
+    import sys
+    import PicLibrary as PLib
+    src_dir, dst_dir = sys.argv[1:3]
+    pic_lib = PLib.PicLibrary(src_dir)
+    pic_lib.get_file_list(shuffle=False)
+    PicSync(src_dir, dst_dir).run(pic_lib)
+
+if __name__ == "__main__":
+    # setup logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
+        level=logging.INFO
+        )
+    prog_name = Path(__file__).stem
+    log = logging.getLogger(name=prog_name)
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+
+import os
+import time
+import errno
+import select
+import struct
+import logging
+import ctypes
+import ctypes.util
+from threading import Thread, Event
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+# A new file is only worth showing once it has been completely written, so file IN_CREATE events are ignored
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HDR = struct.Struct('iIII')
+STOP = b'x'
+RESCANNED = b'r'
+
+SETTLE_SECS = 1.0 # Wait for this long without events before refreshing, so a batch of copies is one refresh
+MAX_DELAY_SECS = 5.0 # But don't wait longer than this after the first event
+
+class PollWatcher():
+    '''
+    Watch a PicLibrary by checking the mtime of every scanned directory every check_secs.
+    A directory's mtime changes when a file or sub directory in it is added, removed or renamed.
+    '''
+    def __init__(self, pic_lib, check_secs=60.0):
+        self.pic_lib = pic_lib
+        self.check_secs = check_secs
+        self.stop_event = Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(name='PicLibrary poll', target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def rescanned(self):
+        '''
+        The library has been scanned again. The next check uses its directories
+        '''
+
+    def changed_dirs(self):
+        changed = []
+        for rel_dir_name, mtime_ns in list(self.pic_lib.dir_mtimes.items()):
+            try:
+                if os.stat(self.pic_lib._dirpath(rel_dir_name)).st_mtime_ns != mtime_ns:
+                    changed.append(rel_dir_name)
+            except OSError:
+                changed.append(rel_dir_name)
+        return changed
+
+    def run(self):
+        wait_for_scan(self.pic_lib)
+        log.info('Polling %s dirs every %ss' % (len(self.pic_lib.dir_mtimes), self.check_secs))
+        while not self.stop_event.wait(self.check_secs):
+            changed = self.changed_dirs()
+            if changed:
+                self.pic_lib.refresh_dirs(changed)
+
+class InotifyWatcher():
+    '''
+    Watch a PicLibrary with Linux inotify, one watch per scanned directory.
+    Events only mark their directory as changed. Once things settle the changed directories are refreshed in one go.
+    Sleeps in select() between events, so costs nothing while the library isn't changing.
+    '''
+    def __init__(self, pic_lib, libc, check_secs=60.0):
+        self.pic_lib = pic_lib
+        self.libc = libc
+        self.check_secs = check_secs # for the PollWatcher fallback
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1: %s' % os.strerror(ctypes.get_errno()))
+        self.wake_rd, self.wake_wr = os.pipe() # STOP or RESCANNED, to the watcher thread
+        self.wds = {}
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(name='PicLibrary inotify', target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.wake(STOP)
+
+    def rescanned(self):
+        '''
+        The library has been scanned again. Have the watcher thread bring its watches into step with it
+        '''
+        self.wake(RESCANNED)
+
+    def wake(self, why):
+        try:
+            os.write(self.wake_wr, why)
+        except OSError:
+            pass # already stopped
+
+    def sync_watches(self):
+        '''
+        Watch the directories a rescan found and forget those it didn't
+        '''
+        with self.pic_lib.scan_lock:
+            scanned = set(self.pic_lib.dir_mtimes)
+        watched = set(self.wds.values())
+        self.follow(scanned - watched, watched - scanned)
+        log.info('Watching %s dirs with inotify after a rescan' % len(self.wds))
+
+    def add_watch(self, rel_dir_name):
+        dirpath = self.pic_lib._dirpath(rel_dir_name)
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, 'Out of inotify watches. Raise fs.inotify.max_user_watches')
+            log.warning('Cannot watch %s: %s' % (dirpath, os.strerror(err)))
+            return
+        self.wds[wd] = rel_dir_name
+
+    def follow(self, added, removed):
+        '''
+        Keep the watches in step with the directories a refresh added and removed.
+        The kernel drops the watches of deleted directories itself. A moved directory keeps its watch descriptor,
+        which add_watch hands back again for the new name.
+        '''
+        if removed:
+            for wd in [wd for wd, rel_dir_name in self.wds.items() if rel_dir_name in removed]:
+                del self.wds[wd]
+        for rel_dir_name in sorted(added):
+            self.add_watch(rel_dir_name)
+
+    def read_events(self):
+        '''
+        Return the set of directories with events, None if the event queue overflowed
+        '''
+        changed = set()
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        pos = 0
+        while pos < len(buf):
+            wd, mask, __cookie, name_len = EVENT_HDR.unpack_from(buf, pos)
+            pos += EVENT_HDR.size + name_len
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self.wds.pop(wd, None)
+                continue
+            if mask & IN_CREATE and not mask & IN_ISDIR:
+                continue
+            rel_dir_name = self.wds.get(wd)
+            if rel_dir_name is None:
+                continue
+            if mask & IN_DELETE_SELF:
+                # Refresh the parent, which removes this directory and anything below it
+                rel_dir_name = os.path.dirname(rel_dir_name)
+            changed.add(rel_dir_name)
+        return changed
+
+    def run(self):
+        wait_for_scan(self.pic_lib)
+        try:
+            for rel_dir_name in sorted(self.pic_lib.dir_mtimes):
+                self.add_watch(rel_dir_name)
+            log.info('Watching %s dirs with inotify' % len(self.wds))
+            changed = set()
+            first_event_tm = None
+            while True:
+                timeout = None
+                if changed:
+                    timeout = max(0.0, min(SETTLE_SECS, first_event_tm + MAX_DELAY_SECS - time.monotonic()))
+                readable, __w, __x = select.select([self.fd, self.wake_rd], [], [], timeout)
+                if self.wake_rd in readable:
+                    why = os.read(self.wake_rd, 64)
+                    if STOP in why:
+                        break
+                    self.sync_watches()
+                if self.fd in readable:
+                    events = self.read_events()
+                    if events is None:
+                        log.warning('inotify queue overflow. Refreshing all dirs')
+                        events = set(self.pic_lib.dir_mtimes)
+                    if events and not changed:
+                        first_event_tm = time.monotonic()
+                    changed |= events
+                    if not changed or time.monotonic() - first_event_tm < MAX_DELAY_SECS:
+                        continue
+                if changed:
+                    self.follow(*self.pic_lib.refresh_dirs(changed))
+                    changed = set()
+        except OSError as e:
+            log.warning('inotify failed, falling back to polling: %s' % e)
+            poll_watcher = PollWatcher(self.pic_lib, self.check_secs)
+            self.pic_lib.watcher = poll_watcher
+            poll_watcher.start()
+        finally:
+            os.close(self.fd)
+            os.close(self.wake_rd)
+            os.close(self.wake_wr)
+
+def wait_for_scan(pic_lib):
+    update_thread = getattr(pic_lib, 'update_thread', None)
+    if update_thread is not None:
+        update_thread.join()
+
+def new_watcher(pic_lib, check_secs=60.0):
+    '''
+    An InotifyWatcher if this system has inotify, otherwise a PollWatcher checking every check_secs
+    '''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        return InotifyWatcher(pic_lib, libc, check_secs)
+    except (OSError, AttributeError) as e:
+        log.warning('No inotify, polling every %ss: %s' % (check_secs, e))
+        return PollWatcher(pic_lib, check_secs)
+
+def main():
+    import sys
+    import PicLibrary as PLib
+    log.info('Start')
+    pic_lib = PLib.PicLibrary(sys.argv[1])
+    pic_lib.update(shuffle=False)
+    pic_lib.watch()
+    for pic_file in pic_lib.playlist(shuffle=False, repeat=True):
+        log.info('   %-120s %s' % (pic_file.pic_dir.rel_dir_name, pic_file.file_name))
+        time.sleep(1.0)
+
+if __name__ == "__main__":
+    # setup logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
+        level=logging.INFO
+        )
+    prog_name = Path(__file__).stem
+    log = logging.getLogger(name=prog_name)
+    main()
@@ -9,7 +9,14 @@ import random
 import pi3d
 from enum import Enum
 import PicLibrary as PLib
+from Playlist import read_weights
 from Slide import Slide
+from PicImage import BlurEdges
+from PicCache import PicCache
+from FrameScheduler import FrameScheduler
+from ShowCheckpoint import ShowCheckpoint
+from ShowControl import ShowControl, ShowHistory, ControlServer, NEXT, PREV, RELOAD, QUIT
+from Telemetry import telemetry
 from threading import Thread
 
 # these are needed for getting exif data from images
@@ -22,33 +29,57 @@ FONT_FILE = os.path.join(THIS_DIR, 'fonts', 'NotoSans-Regular.ttf')
 # these variables are constants
 # ####################################################
 PIC_DIR = '/home/pi/Pictures'  # 'textures'
-FPS = 20
+INDEX_FILE = os.path.join(THIS_DIR, 'pic_index.db')  # persistent directory listing cache. None to always do a full scan
+SCAN_THREADS = 4  # directories listed at once when scanning PIC_DIR. 0 for a serial scan
+CACHE_DIR = os.path.expanduser('~/.cache/pi_picframe')  # display sized copies of pictures. None for no cache
+CACHE_MB = 1024  # cache size budget. Least recently shown pictures are evicted
+PREFETCH_DEPTH = 3  # pictures decoded ahead of the show. 0 to decode each one in the slide loader thread
+PREFETCH_WORKERS = 2  # processes decoding pictures. Leave a core for the render loop
+EXIF_THREADS = 4  # read EXIF dates and orientations while scanning, this many at once. 0 to only read them on show
+DEDUP_THREADS = 0  # > 0 shows one copy of pictures with the same content, rather than excluding copies by name. Stats and hashes the library every scan
+SIMILAR_THREADS = 0  # show one picture of each burst of near identical shots. Each picture is hashed once, then cached
+SLOW_LOAD_SECS = 10.0  # pictures taking longer than this to load, more than once, are left out like ones that fail to load
+COMPACT_LIBRARY = False  # hold the library in arrays rather than objects. For very large libraries on a small Pi
+FPS = 20  # while fading or changing text. Otherwise the picture is redrawn at IDLE_FPS
+IDLE_FPS = 2
+FRAME_STATS = False  # print render loop timings every minute
+CHECKPOINT_FILE = os.path.join(THIS_DIR, 'checkpoint.jpg')  # next picture, to show straight away on a restart, and carry on the playlist from. Needs INDEX_FILE. None to not checkpoint
+CHECKPOINT_SECS = 300.0  # between checkpoints
+TELEMETRY_FILE = os.path.join(THIS_DIR, 'telemetry.jsonl')  # scan, load and wait timings. None to not record them
+TELEMETRY_SECS = 300.0  # between summaries written to TELEMETRY_FILE
 FIT = True
 EDGE_ALPHA = 0.5  # see background colour at edge. 1.0 would show reflection of image
 BACKGROUND = (0.2, 0.2, 0.2, 1.0)
 BG_IMAGE = os.path.join(THIS_DIR, 'background.jpg')
 RESHUFFLE_NUM = 5  # times through before reshuffling
+SHUFFLE_BY_DIR = False  # pick a directory by weight, then a picture in it, so big directories don't crowd out small events
+DIR_SIZE_POWER = 0.5  # directory weight is its picture count to this power. 1.0 weighs every picture the same, 0.0 every directory
+DIR_HALF_LIFE_DAYS = None  # halve a directory's weight for every this many days old its newest picture is. Needs EXIF_THREADS
+DIR_WEIGHTS_FILE = None  # lines of "<weight> <directory relative to PIC_DIR>". Sub directories take their parent's weight
+NO_REPEAT_WINDOW = 500  # pictures before one can show again, when SHUFFLE_BY_DIR
 # limit to 49 ie 7x7 grid_size
 CODEPOINTS = '1234567890ABCDEFGHIJKLMNOPQRSTUVWXYZ., _-/'
 USE_MQTT = False
-RECENT_N = 4  # shuffle the most recent ones to play before the rest
+RECENT_N = 4  # shuffle the most recent ones to play before the rest, once the scan has found them. Needs EXIF_THREADS
 SHOW_NAMES = False
-CHECK_DIR_TM = 60.0  # seconds to wait between checking if directory has changed
+WATCH_DIRS = True  # pick up new and deleted pictures while running. Uses inotify, or polls every CHECK_DIR_TM
+CHECK_DIR_TM = 60.0  # seconds to wait between checking if directory has changed, when inotify isn't available
 FONT_COLOUR = (255, 255, 255, 255)
 # ####################################################
 BLUR_EDGES = False  # use blurred version of image to fill edges - will override FIT = False
-BLUR_AMOUNT = 12  # larger values than 12 will increase processing load quite a bit
+BLUR_AMOUNT = 12  # blur radius at 512 pixels wide. The blur is done scaled down to suit, so any amount costs about the same
 BLUR_ZOOM = 1.0  # must be >= 1.0 which expands the backgorund to just fill the space around the image
 KENBURNS = False  # will set FIT- > False and BLUR_EDGES- > False
 # set to False when running headless to avoid curses error. True for debugging
 KEYBOARD = False
+CONTROL_SOCKET = os.path.join(THIS_DIR, 'control.sock')  # takes pause, next, prev, delay etc from ShowControl.py. None to not listen
 # ####################################################
 # these variables can be altered using MQTT messaging
 # ####################################################
 time_delay = 10.0  # between slides
 fade_time = 3.0
 shuffle = True  # shuffle on reloading
-date_from = None
+date_from = None  # (year, month, day) or seconds. Only show pictures with an EXIF date from here. Needs EXIF_THREADS
 date_to = None
 quit = False
 paused = False  # NB must be set to True after the first iteration of the show!
@@ -62,27 +93,54 @@ if KENBURNS:
 if BLUR_ZOOM < 1.0:
     BLUR_ZOOM = 1.0
 delta_alpha = 1.0 / (FPS * fade_time)  # delta alpha
-last_file_change = 0.0  # holds last change time in directory structure
-# check if new file or directory every hour
-next_check_tm = time.time() + CHECK_DIR_TM
 # ####################################################
 # some functions to tidy subsequent code
 # ####################################################
 
-DISPLAY = pi3d.Display.create(x = 0, y = 0, frames_per_second = FPS, 
+# No frames_per_second, the FrameScheduler paces the render loop
+DISPLAY = pi3d.Display.create(x = 0, y = 0,
                               display_config = pi3d.DISPLAY_CONFIG_HIDE_CURSOR, background = BACKGROUND)
 print('Display W: {}   H: {}'.format(DISPLAY.width, DISPLAY.height))
 CAMERA = pi3d.Camera(is_3d = False)
 print('OpenGL ID: {}'.format(DISPLAY.opengl.gl_id))
-slide = Slide(DISPLAY, CAMERA, shader_path=os.path.join(THIS_DIR, 'shaders', 'blend_new'), edge_alpha=EDGE_ALPHA)
+if TELEMETRY_FILE is not None:
+    telemetry.enable(TELEMETRY_FILE, TELEMETRY_SECS)
+scheduler = FrameScheduler(FPS, IDLE_FPS)
+if FRAME_STATS:
+    scheduler.stats_listeners.append(lambda summary: print('Frames: {}'.format(summary)))
+# With DEDUP_THREADS, copies are found by content and the library drops the exc_files rules for names like IMG-2.jpg
+pl = PLib.PicLibrary(PIC_DIR, index_file=INDEX_FILE,
+                     scan_threads=SCAN_THREADS, compact=COMPACT_LIBRARY, exif_threads=EXIF_THREADS,
+                     dedup_threads=DEDUP_THREADS, similar_threads=SIMILAR_THREADS, slow_secs=SLOW_LOAD_SECS)
+checkpoint = None
+if CHECKPOINT_FILE is not None and INDEX_FILE is not None:
+    # A checkpoint from a show with other settings isn't resumed
+    checkpoint = ShowCheckpoint(INDEX_FILE, CHECKPOINT_FILE, repr((PIC_DIR, DISPLAY.width, DISPLAY.height, FIT,
+        (BLUR_AMOUNT, BLUR_ZOOM) if BLUR_EDGES else None, shuffle, date_from, date_to, RECENT_N, SHUFFLE_BY_DIR)),
+        CHECKPOINT_SECS)
+pic_cache = PicCache(CACHE_DIR, CACHE_MB * 1024 * 1024) if CACHE_DIR is not None else None
+slide = Slide(DISPLAY, CAMERA, shader_path=os.path.join(THIS_DIR, 'shaders', 'blend_new'), edge_alpha=EDGE_ALPHA,
+              pic_cache=pic_cache, prefetch_depth=PREFETCH_DEPTH, prefetch_workers=PREFETCH_WORKERS,
+              scheduler=scheduler, blur=BlurEdges(BLUR_AMOUNT, BLUR_ZOOM, EDGE_ALPHA) if BLUR_EDGES else None,
+              quarantine=pl.quarantine, keep_next_image=checkpoint is not None)
 
 if KEYBOARD:
     kbd = pi3d.Keyboard()
 
+# Pause, next, prev, delay and reload from the keyboard or control socket wake the process thread at once
+control = ShowControl(time_delay, paused)
+control_server = None
+if CONTROL_SOCKET is not None:
+    control_server = ControlServer(control, CONTROL_SOCKET)
+    control_server.start()
+
 # images in iFiles list
 nexttm = 0.0
-pl = PLib.PicLibrary(PIC_DIR)
 next_pic_num = 0
+dir_shuffle = None
+if SHUFFLE_BY_DIR:
+    dir_shuffle = {'size_power': DIR_SIZE_POWER, 'half_life_days': DIR_HALF_LIFE_DAYS, 'window': NO_REPEAT_WINDOW,
+                   'dir_weights': read_weights(DIR_WEIGHTS_FILE) if DIR_WEIGHTS_FILE is not None else None}
 
 class TextAttr():
     dir = ''
@@ -117,69 +175,134 @@ status_tb = pi3d.TextBlock(x = DISPLAY.width * -0.15,  y = DISPLAY.height * -0.5
                            size = 0.99, spacing = "F", space = 0.02, colour = (1.0, 0.0, 0.0, 1.0))
 status_pt.add_text_block(status_tb)
 
-def process_thread(time_delay=10, trans_secs=3):
+def load_next(history, piclist):
+    '''
+    Load the next picture: one gone back past, else the playlist's next
+    '''
+    entry = history.peek()
+    while entry is not None:
+        if slide.load_path(*entry):
+            return
+        history.drop() # Gone since it was shown
+        entry = history.peek()
+    slide.load_next_image(pl.src_dir, piclist)
+
+def process_thread(trans_secs=3):
     global slide, run_proc, display_elements
     try:
         run_proc = True
+        # Carry on where the show was before a restart. The saved next picture shows while the library is scanned
+        resume = checkpoint.load(PIC_DIR) if checkpoint is not None else None
         #for __i in range(2):
         while run_proc:
-            slide.load_image(BG_IMAGE)
-            text_attr.status = 'No Pictures!'
-            status_pt.regen()
-            display_elements = [slide, title_pt, status_pt]
-            pl.update()
-            while pl.update_thread.is_alive():
-                if pl.cur_pic is not None:
-                    text_attr.dir = pl.cur_pic.pic_dir.rel_dir_name
-                    text_attr.fname = pl.cur_pic.file_name
-                    file_pt.regen()
-                    display_elements = [slide, title_pt, file_pt]
-                time.sleep(0.05)
-            if pl.file_cnt == 0:
+            resumed = resume is not None and resume.im is not None and slide.load_decoded(
+                os.path.join(PIC_DIR, resume.rel_dir_name, resume.fname), resume.rel_dir_name, resume.fname,
+                (resume.im, resume.dt, resume.orientation))
+            if not resumed:
+                slide.load_image(BG_IMAGE)
+                text_attr.status = 'No Pictures!'
+                status_pt.regen()
+                display_elements = [slide, title_pt, status_pt]
+                scheduler.mark_dirty()
+            pl.update(shuffle)
+            if WATCH_DIRS and pl.watcher is None:
+                pl.watch(CHECK_DIR_TM)
+            # Start on the first picture the scan finds. The rest are shuffled in as they are found.
+            # A date range or SHUFFLE_BY_DIR waits for the scan, as they need the whole library. RECENT_N moves the most
+            # recent pictures to play next once the scan has finished.
+            # When watching, the playlist repeats and new pictures are mixed in as they arrive
+            piclist = pl.playlist(shuffle, repeat=WATCH_DIRS, date_from=date_from, date_to=date_to,
+                recent_n=RECENT_N, reshuffle_num=RESHUFFLE_NUM, dir_shuffle=dir_shuffle,
+                resume=resume.rel_paths if resume is not None else None)
+            resume = None
+            if not resumed:
+                slide.load_next_image(pl.src_dir, piclist) # prime first image
+            if slide.next_pic is None:
                 text_attr.status = 'No images selected!'
                 status_pt.regen()
                 display_elements = [slide, title_pt, status_pt]
-                while run_proc: # go to sleep
-                    time.sleep(10)
-                return
+                scheduler.mark_dirty()
+                # go to sleep, until told to reload, eg after adding pictures
+                action = None
+                while action not in (RELOAD, QUIT):
+                    action = control.wait_next()
+                run_proc = action != QUIT
+                continue
             display_elements = [slide, file_pt]
-            piclist = iter(pl.pic_files)
-            slide.load_next_image(pl.src_dir, piclist) # prime first image
+            history = ShowHistory()
             while run_proc and slide.next_pic is not None:
                 text_attr.dir = slide.next_pic.rel_dir_name
                 text_attr.fname = slide.next_pic.fname
                 text_attr.date = time.strftime("%a %d %b %Y", time.localtime(slide.next_pic.dt))
                 file_pt.regen()
-                slide.transition_to_next(trans_secs=trans_secs)
-                slide.start_load_next_image(pl.src_dir, piclist)
+                history.shown((slide.next_pic.path, slide.next_pic.rel_dir_name, slide.next_pic.fname))
+                # Not waiting for the fade, so a command during it isn't held up
+                slide.transition_to_next(trans_secs=trans_secs, wait=False)
+                control.shown(trans_secs)
+                load_thread = Thread(name='Slide Load', target=load_next, args=(history, piclist))
+                load_thread.start()
                 #text_attr.dir = slide.fg_pic.rel_dir_name
                 #text_attr.fname = slide.fg_pic.fname
                 #text_attr.date = time.strftime("%a %d %b %Y", time.localtime(slide.fg_pic.dt))
                 #file_pt.regen()
-                time.sleep(time_delay)
+                action = control.wait_next()
                 # Wait (if required) for next image to load
-                slide.load_thread.join()
+                wait_start = time.monotonic()
+                load_thread.join()
+                wait_secs = time.monotonic() - wait_start
+                scheduler.loader_wait(wait_secs)
+                telemetry.record('show.loader_wait.secs', wait_secs)
+                if checkpoint is not None and action in (NEXT, QUIT) and slide.next_pic is not None:
+                    checkpoint.start_save(slide.next_pic, pl.play_cnt, pl.play_files, force=action == QUIT)
+                if action == QUIT:
+                    run_proc = False
+                elif action == RELOAD:
+                    break
+                elif action == PREV:
+                    next_pic = slide.next_pic
+                    entry = history.back((next_pic.path, next_pic.rel_dir_name, next_pic.fname) if next_pic is not None else None)
+                    if entry is not None and not slide.load_path(*entry):
+                        load_next(history, piclist)
     except KeyboardInterrupt:
         print ('Bye')
         return
 
 display_elements = []
 run_proc = True
-proc_thread = Thread(target=process_thread, args=(time_delay, fade_time,))
+proc_thread = Thread(target=process_thread, args=(fade_time,))
 proc_thread.start()
 
-# Main thread
-while DISPLAY.loop_running() and proc_thread.is_alive():
+# Main thread. Only draws at full rate during fades and text changes
+while proc_thread.is_alive():
+    frame_tm = scheduler.wait_frame()
+    if not DISPLAY.loop_running():
+        break
     for e in display_elements:
         e.draw()
+    draw_secs = time.monotonic() - frame_tm
+    scheduler.frame_drawn(frame_tm, draw_secs)
+    telemetry.record('frame.draw.secs', draw_secs)
     if KEYBOARD:
         k = kbd.read()
         if k == 27 or quit:  # ESC
             run_proc = False
             break
         if k == ord(' '):
-            paused = not paused
+            control.toggle_pause()
+        elif k == ord('n'):
+            control.send(NEXT)
+        elif k == ord('p'):
+            control.send(PREV)
+        elif k == ord('r'):
+            control.send(RELOAD)
 
+# The process thread may be waiting on a picture's hold
+control.send(QUIT)
+if control_server is not None:
+    control_server.close()
 if KEYBOARD:
     kbd.close()
+# Let it finish any load before the textures and prefetched pictures go
+proc_thread.join()
+slide.close()
 DISPLAY.destroy()
\ No newline at end of file
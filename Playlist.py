@@ -0,0 +1,432 @@
+#!/usr/bin/python3
+
+import os
+import math
+import time
+import random
+import bisect
+import heapq
+import logging
+import sqlite3
+from array import array
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+WINDOW = 500 # Picks before a picture can show again
+SIZE_POWER = 0.5 # Directory weight is its file count to this power. 1.0 weighs every file the same, 0.0 every directory
+MIN_AGE_WEIGHT = 0.1 # Floor of the age weighting, so old directories still come up
+DIR_TRIES = 8 # Weighted directory picks before falling back to any directory with a picture to show
+SAVE_PICKS = 20 # DirShuffle picks saved at once, rather than writing the SD card every slide
+
+if hasattr(math, 'nextafter'): # Python 3.9+
+    nextafter = math.nextafter
+else:
+    def nextafter(x, towards):
+        return x - 1e-6
+
+def to_timestamp(date, end=False):
+    '''
+    Seconds since the epoch for a date given as seconds or a (year, month, day) tuple. None stays None.
+    With end, a tuple is the last moment of the day it names (or month or year, for a shorter tuple), so it can be
+    the inclusive end of a range
+    '''
+    if date is None or isinstance(date, (int, float)):
+        return date
+    date = tuple(date)[:6]
+    if end:
+        # The start of the next day (month or year), less the smallest step. mktime carries day 32 into the next month
+        date = date[:-1] + (date[-1] + 1,)
+    # Month and day default to 1, the time to midnight
+    start = time.mktime(date + (1,) * (3 - len(date)) + (0,) * (6 - max(3, len(date))) + (0, 0, -1))
+    return nextafter(start, 0.0) if end else start
+
+def shuffle_range(a, lo, hi):
+    '''
+    Shuffle a[lo:hi] of an array in place, through a memoryview rather than a copied slice
+    '''
+    with memoryview(a) as view:
+        random.shuffle(view[lo:hi])
+
+def recent_first(waiting, recent_n):
+    '''
+    Move the most recent recent_n PicFiles of a shuffled list, played from the end, to play first, in a random order
+    '''
+    recent_n = min(recent_n, len(waiting))
+    if recent_n == 0:
+        return
+    recent = set(map(id, heapq.nlargest(recent_n, waiting, key=lambda pic_file: pic_file.dt or 0.0)))
+    rest = [pic_file for pic_file in waiting if id(pic_file) not in recent]
+    recent_files = [pic_file for pic_file in waiting if id(pic_file) in recent]
+    random.shuffle(recent_files)
+    waiting[:] = rest + recent_files
+
+class DateIndex():
+    '''
+    A snapshot of a library's files sorted by date (PicFile.dt). Files with no date sort first.
+    Holds an array of positions into the snapshot plus a parallel array of dates, so a date range is two bisects.
+    '''
+    def __init__(self, pic_files):
+        self.pic_files = pic_files.copy()
+        file_dts = [pic_file.dt or 0.0 for pic_file in self.pic_files]
+        self.order = array('I', sorted(range(len(file_dts)), key=file_dts.__getitem__))
+        self.dts = array('d', (file_dts[pos] for pos in self.order))
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, pos):
+        '''
+        The file at pos in date order
+        '''
+        return self.pic_files[self.order[pos]]
+
+    def range(self, date_from=None, date_to=None):
+        '''
+        The (lo, hi) date order positions of the files dated from date_from up to and including date_to
+        '''
+        lo = 0 if date_from is None else bisect.bisect_left(self.dts, date_from)
+        hi = len(self.dts) if date_to is None else bisect.bisect_right(self.dts, date_to)
+        return lo, max(lo, hi)
+
+class Playlist():
+    '''
+    Plays a date range of a DateIndex. When shuffled, the most recent recent_n files are shuffled to play before the
+    rest, which are shuffled after them. The order is reshuffled every reshuffle_num passes.
+    The order is a permutation array of positions in the date range, shuffled in place, so a reshuffle doesn't copy
+    or rebuild the file list. Unshuffled, the files play oldest first.
+    '''
+    def __init__(self, date_index, date_from=None, date_to=None, recent_n=0, shuffle=True, reshuffle_num=1):
+        self.date_index = date_index
+        self.lo, self.hi = date_index.range(to_timestamp(date_from), to_timestamp(date_to, end=True))
+        self.recent_n = min(recent_n, self.hi - self.lo) if shuffle else 0
+        self.shuffle = shuffle
+        self.reshuffle_num = max(1, reshuffle_num)
+        self.pass_num = 0
+        # Positions in date order, with the recent block moved to the front
+        recent_start = self.hi - self.recent_n
+        self.order = array('I', range(recent_start, self.hi))
+        self.order.extend(range(self.lo, recent_start))
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, pos):
+        '''
+        The file at pos in the current pass
+        '''
+        return self.date_index[self.order[pos]]
+
+    def reshuffle(self):
+        '''
+        Shuffle the recent block and the rest, each in place
+        '''
+        shuffle_range(self.order, 0, self.recent_n)
+        shuffle_range(self.order, self.recent_n, len(self.order))
+
+    def next_pass(self):
+        '''
+        Generate the files for the next pass through the playlist. The pass is shuffled when this is called, so
+        the Playlist is then the pass in play order
+        '''
+        if self.shuffle and self.pass_num % self.reshuffle_num == 0:
+            self.reshuffle()
+        self.pass_num += 1
+        return (self.date_index[pos] for pos in self.order)
+
+    def passes(self, pass_cnt=None):
+        '''
+        Generate the files for pass_cnt passes through the playlist, forever if None
+        '''
+        pass_cnt_done = 0
+        while self.order and (pass_cnt is None or pass_cnt_done < pass_cnt):
+            yield from self.next_pass()
+            pass_cnt_done += 1
+
+def read_weights(path):
+    '''
+    Read a directory weights file of "<weight> <relative directory>" lines. # starts a comment.
+    Returns {rel_dir_name: weight}
+    '''
+    dir_weights = {}
+    with open(path) as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            try:
+                weight, rel_dir_name = line.split(None, 1)
+                rel_dir_name = os.path.normpath(rel_dir_name.strip()).strip(os.sep)
+                dir_weights['' if rel_dir_name == '.' else rel_dir_name] = float(weight)
+            except ValueError:
+                log.warning('Skipping bad line %s of %s: %s' % (line_num, path, line))
+    return dir_weights
+
+def dir_weight(dir_weights, rel_dir_name):
+    '''
+    The weight of a directory from read_weights(). Directories take the weight of their nearest listed parent, else 1.0
+    '''
+    while True:
+        weight = dir_weights.get(rel_dir_name)
+        if weight is not None:
+            return weight
+        if not rel_dir_name:
+            return 1.0
+        rel_dir_name = os.path.dirname(rel_dir_name)
+
+def alias_table(weights):
+    '''
+    Vose's alias method tables, for picking a position in weights in proportion to its weight in O(1)
+    '''
+    n = len(weights)
+    total = sum(weights)
+    scaled = [weight * n / total for weight in weights]
+    probs = array('d', [1.0] * n)
+    aliases = array('I', range(n))
+    small = [pos for pos, weight in enumerate(scaled) if weight < 1.0]
+    large = [pos for pos, weight in enumerate(scaled) if weight >= 1.0]
+    while small and large:
+        small_pos = small.pop()
+        large_pos = large.pop()
+        probs[small_pos] = scaled[small_pos]
+        aliases[small_pos] = large_pos
+        scaled[large_pos] += scaled[small_pos] - 1.0
+        (small if scaled[large_pos] < 1.0 else large).append(large_pos)
+    return probs, aliases
+
+class DirShuffle():
+    '''
+    Shuffles a library a directory at a time, so big directories don't crowd out small events.
+    Each pick chooses a PicDir by weight (its file count ** size_power, times its age and dir_weights weights), then a
+    random file in it that hasn't been shown since the directory last ran out. No file shows twice within window picks.
+    Every pick is O(1). The directories' files are grouped in one array of positions in their PicDir's pic_files,
+    each directory's section split into files still to show, files shown, and files in the window. A pick or a
+    file leaving the window is a swap.
+    With a state_file (the library index file), what has been shown is kept in an SQLite table, so a restart carries
+    on where it left off. Picks are saved save_picks at a time, in one transaction, and at the end of each pass, so a
+    crash can forget the last few.
+    '''
+    def __init__(self, pic_dirs, skip=None, size_power=SIZE_POWER, half_life_days=None, dir_weights=None,
+                 window=WINDOW, state_file=None, save_picks=SAVE_PICKS):
+        self.state_file = state_file
+        self.save_picks = save_picks
+        self.unsaved = [] # (rel_dir_name, file_name, pick_num, freed_to) of picks not saved yet
+        self.con = None
+        self.pic_dirs = [] # Directories with something to show
+        self.dir_files = [] # pic_files of each
+        weights = []
+        self.starts = array('I', [0]) # Section of order for each directory
+        self.bases = array('I', [0]) # Offset of each directory's files in where
+        self.order = array('I') # Positions in pic_files, by directory: to show, shown, in window
+        now = time.time()
+        for pic_dir in pic_dirs:
+            pic_files = pic_dir.pic_files
+            positions = [pos for pos, pic_file in enumerate(pic_files) if skip is None or not skip(pic_file)]
+            if not positions:
+                continue
+            weight = len(positions) ** size_power
+            if dir_weights:
+                weight *= dir_weight(dir_weights, pic_dir.rel_dir_name)
+            if half_life_days is not None:
+                newest_dt = max((pic_files[pos].dt or 0.0 for pos in positions))
+                if newest_dt > 0.0:
+                    age_days = max(0.0, now - newest_dt) / 86400
+                    weight *= max(MIN_AGE_WEIGHT, 0.5 ** (age_days / half_life_days))
+            if weight <= 0.0:
+                continue
+            self.pic_dirs.append(pic_dir)
+            self.dir_files.append(pic_files)
+            weights.append(weight)
+            self.order.extend(positions)
+            self.starts.append(len(self.order))
+            self.bases.append(self.bases[-1] + len(pic_files))
+        dir_cnt = len(self.pic_dirs)
+        self.where = array('I', [0]) * self.bases[-1] # Position in order of each directory's files
+        for d in range(dir_cnt):
+            for idx in range(self.starts[d], self.starts[d + 1]):
+                self.where[self.bases[d] + self.order[idx]] = idx
+        self.to_show = array('I', (self.starts[d + 1] - self.starts[d] for d in range(dir_cnt)))
+        self.shown = array('I', [0]) * dir_cnt
+        # Directories with a file to show, now or once they start again. Kept for when weighted picks keep missing
+        self.open_dirs = array('I', range(dir_cnt))
+        self.open_pos = array('I', range(dir_cnt))
+        self.probs, self.aliases = alias_table(weights) if weights else (array('d'), array('I'))
+        # No more than half the library, so there's always plenty to pick from
+        self.window_size = min(window, len(self.order) // 2)
+        self.window = deque() # (d, pos, pick_num) of recent picks
+        self.pick_cnt = 0
+        self.load()
+
+    def __len__(self):
+        return len(self.order)
+
+    def swap(self, idx1, idx2, d):
+        order = self.order
+        base = self.bases[d]
+        order[idx1], order[idx2] = order[idx2], order[idx1]
+        self.where[base + order[idx1]] = idx1
+        self.where[base + order[idx2]] = idx2
+
+    def set_open(self, d, is_open):
+        pos = self.open_pos[d]
+        if is_open == (pos < len(self.open_dirs) and self.open_dirs[pos] == d):
+            return
+        if is_open:
+            self.open_pos[d] = len(self.open_dirs)
+            self.open_dirs.append(d)
+        else:
+            last_d = self.open_dirs.pop()
+            if last_d != d:
+                self.open_dirs[pos] = last_d
+                self.open_pos[last_d] = pos
+
+    def to_window(self, d, idx):
+        '''
+        Move the file at idx of d's files still to show into the window
+        '''
+        start = self.starts[d]
+        self.swap(idx, start + self.to_show[d] - 1, d)
+        self.to_show[d] -= 1
+        self.swap(start + self.to_show[d], start + self.to_show[d] + self.shown[d], d)
+        if not self.to_show[d] and not self.shown[d]:
+            self.set_open(d, False)
+
+    def from_window(self, d, pos):
+        '''
+        Move a file leaving the window to d's shown files
+        '''
+        self.swap(self.where[self.bases[d] + pos], self.starts[d] + self.to_show[d] + self.shown[d], d)
+        self.shown[d] += 1
+        self.set_open(d, True)
+
+    def pick_dir(self):
+        probs = self.probs
+        for __try in range(DIR_TRIES):
+            r = random.random() * len(probs)
+            d = int(r)
+            if r - d >= probs[d]:
+                d = self.aliases[d]
+            if self.to_show[d] or self.shown[d]:
+                return d
+        return self.open_dirs[random.randrange(len(self.open_dirs))]
+
+    def pick(self):
+        '''
+        The next PicFile
+        '''
+        while len(self.window) >= max(1, self.window_size):
+            d, pos, __pick_num = self.window.popleft()
+            self.from_window(d, pos)
+        d = self.pick_dir()
+        started = False
+        if not self.to_show[d]:
+            # Shown everything in the directory. Start again
+            self.to_show[d], self.shown[d] = self.shown[d], 0
+            started = True
+        start = self.starts[d]
+        idx = start + random.randrange(self.to_show[d])
+        pos = self.order[idx]
+        self.to_window(d, idx)
+        self.window.append((d, pos, self.pick_cnt))
+        self.save_pick(d, pos, started)
+        self.pick_cnt += 1
+        return self.dir_files[d][pos]
+
+    def next_pass(self):
+        '''
+        Generate len() picks. The picks are saved when the pass ends or is given up
+        '''
+        try:
+            for __pick in range(len(self.order)):
+                yield self.pick()
+        finally:
+            self.close()
+
+    def connect(self):
+        # Picks come from whichever thread loads the next slide, one at a time
+        con = sqlite3.connect(self.state_file, timeout=30.0, check_same_thread=False)
+        con.execute('''CREATE TABLE IF NOT EXISTS dir_shuffle (
+            rel_dir_name TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            pick_num INTEGER NOT NULL,
+            PRIMARY KEY (rel_dir_name, file_name)
+        )''')
+        return con
+
+    def load(self):
+        '''
+        Mark the files shown before a restart, and put the latest back in the window
+        '''
+        if self.state_file is None or not os.path.exists(self.state_file) or not self.order:
+            return
+        try:
+            con = self.connect()
+            try:
+                picks = {}
+                for rel_dir_name, file_name, pick_num in con.execute('SELECT * FROM dir_shuffle'):
+                    picks.setdefault(rel_dir_name, {})[file_name] = pick_num
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            log.warning('Ignoring unreadable shuffle state %s: %s' % (self.state_file, e))
+            return
+        if not picks:
+            return
+        self.pick_cnt = max(max(dir_picks.values()) for dir_picks in picks.values()) + 1
+        window = []
+        for d, pic_dir in enumerate(self.pic_dirs):
+            dir_picks = picks.get(pic_dir.rel_dir_name)
+            if dir_picks is None:
+                continue
+            pic_files = self.dir_files[d]
+            for idx in range(self.starts[d], self.starts[d + 1]):
+                pos = self.order[idx]
+                pick_num = dir_picks.get(pic_files[pos].file_name)
+                if pick_num is not None:
+                    window.append((pick_num, d, pos))
+        window.sort()
+        for pick_num, d, pos in window:
+            self.to_window(d, self.where[self.bases[d] + pos])
+            self.window.append((d, pos, pick_num))
+        # Older picks are just shown
+        while self.window and self.window[0][2] < self.pick_cnt - self.window_size:
+            d, pos, __pick_num = self.window.popleft()
+            self.from_window(d, pos)
+        log.info('Shuffle state: %s shown, %s in the window, from %s' % (len(window), len(self.window), self.state_file))
+
+    def save_pick(self, d, pos, started):
+        if self.state_file is None:
+            return
+        # When the directory started again, files shown before are free to show, unless still in the window
+        self.unsaved.append((self.pic_dirs[d].rel_dir_name, self.dir_files[d][pos].file_name, self.pick_cnt,
+                             self.pick_cnt - self.window_size if started else None))
+        if len(self.unsaved) >= self.save_picks:
+            self.save()
+
+    def save(self):
+        '''
+        Write the picks not saved yet, in one transaction on a connection kept open between saves
+        '''
+        if not self.unsaved:
+            return
+        unsaved, self.unsaved = self.unsaved, []
+        try:
+            if self.con is None:
+                self.con = self.connect()
+            with self.con:
+                for rel_dir_name, file_name, pick_num, freed_to in unsaved:
+                    if freed_to is not None:
+                        self.con.execute('DELETE FROM dir_shuffle WHERE rel_dir_name = ? AND pick_num <= ?',
+                            (rel_dir_name, freed_to))
+                    self.con.execute('INSERT OR REPLACE INTO dir_shuffle VALUES (?, ?, ?)', (rel_dir_name, file_name, pick_num))
+        except sqlite3.Error as e:
+            log.warning('Could not save shuffle state %s: %s' % (self.state_file, e))
+
+    def close(self):
+        '''
+        Save any picks not saved yet, and close the connection
+        '''
+        self.save()
+        if self.con is not None:
+            self.con.close()
+            self.con = None
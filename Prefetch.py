@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+'''
+Decode pictures ahead of the slideshow in worker processes.
+Kept free of pi3d, the render side only turns the decoded pixels into textures.
+'''
+import os
+import time
+import logging
+from threading import Thread, Lock
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory, resource_tracker
+from PIL import Image
+import PicImage
+from Telemetry import telemetry
+
+log = logging.getLogger(__name__)
+
+WORKER_NICE = 5 # Decoding is less important than keeping the render loop smooth
+
+# Per worker process settings, from init_worker()
+worker_display_size = None
+worker_fit = True
+worker_pic_cache = None
+worker_blur = None
+
+def init_worker(display_size, fit, cache_dir, cache_max_bytes, blur_settings=None, telemetry_enabled=False):
+    global worker_display_size, worker_fit, worker_pic_cache, worker_blur
+    # The load phase timings are handed back with each picture, for the main process to record
+    if telemetry_enabled:
+        telemetry.collect()
+    else:
+        telemetry.disable()
+    worker_display_size = display_size
+    worker_fit = fit
+    if blur_settings is not None:
+        worker_blur = PicImage.BlurEdges(*blur_settings)
+    if cache_dir is not None:
+        from PicCache import PicCache
+        worker_pic_cache = PicCache(cache_dir, cache_max_bytes)
+    try:
+        os.nice(WORKER_NICE)
+    except OSError:
+        pass
+
+def decode(path):
+    '''
+    Worker side. Decode a picture into a new shared memory block of RGBA pixels.
+    Returns (shm_name, size, dt, orientation, secs, samples). The caller owns the block and must unlink it.
+    samples are the telemetry recorded decoding it
+    '''
+    start_tm = time.monotonic()
+    telemetry.take() # Anything left from a picture that failed
+    if worker_pic_cache is not None:
+        im, dt, orientation = worker_pic_cache.load_image(path, worker_display_size, worker_fit)
+    else:
+        im, dt, orientation = PicImage.load_image(path, worker_display_size, worker_fit)
+    if worker_blur is not None and worker_fit:
+        im = worker_blur.apply(im, worker_display_size, path)
+    if im.mode != 'RGBA':
+        im = im.convert('RGBA')
+    pixels = im.tobytes()
+    shm = shared_memory.SharedMemory(create=True, size=len(pixels))
+    try:
+        shm.buf[:len(pixels)] = pixels
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    # Hand the block over to the caller. Otherwise this process's resource tracker would count it as leaked
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm.name, im.size, dt, orientation, time.monotonic() - start_tm, telemetry.take()
+
+class Decoded():
+    '''
+    A decoded picture in shared memory. im is only valid until release()
+    '''
+    def __init__(self, path, pic_file, shm_name, size, dt, orientation, secs, samples):
+        self.path = path
+        self.rel_dir_name = pic_file.pic_dir.rel_dir_name
+        self.fname = pic_file.file_name
+        self.dt = dt
+        self.orientation = orientation
+        self.secs = secs # Decode time in the worker
+        self.samples = samples # Telemetry recorded in the worker
+        self.shm = shared_memory.SharedMemory(name=shm_name)
+        self.im = Image.frombuffer('RGBA', size, self.shm.buf, 'raw', 'RGBA', 0, 1)
+
+    def release(self):
+        self.im = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass # Something still holds the pixels. The mapping is freed when it lets go
+        self.shm.unlink()
+
+class Prefetcher():
+    '''
+    Keeps up to depth pictures from a playlist decoding, or decoded and waiting, in a pool of worker processes.
+    The decode, rotate and resize happen outside this process, so they don't hold up the render loop.
+    Pictures come back in playlist order. Unreadable ones are logged and skipped.
+    With a PicQuarantine, failed and slow decodes are recorded in it.
+    The playlist is topped up from in a background thread, so a picture already decoded isn't held up by a playlist
+    that is still waiting on the library scan.
+    A worker that dies, eg killed for running out of memory, breaks the pool. A new pool is made, the other pictures
+    are decoded again in it and the one being waited on is counted as failed.
+    '''
+    def __init__(self, root_path, piclist, display_size, fit=True, depth=3, workers=2, pic_cache=None, blur=None,
+                 quarantine=None):
+        self.root_path = root_path
+        self.quarantine = quarantine
+        self.piclist = piclist
+        self.depth = depth
+        self.workers = workers
+        self.pending = deque()
+        self.exhausted = False
+        self.closed = False
+        self.lock = Lock() # pending and pool
+        self.fill_lock = Lock() # One thread at a time takes from piclist
+        self.fill_thread = None
+        self.broken_cnt = 0
+        cache_dir = pic_cache.cache_dir if pic_cache is not None else None
+        cache_max_bytes = pic_cache.max_bytes if pic_cache is not None else None
+        self.initargs = (display_size, fit, cache_dir, cache_max_bytes, blur.settings() if blur is not None else None,
+                         telemetry.enabled)
+        self.pool = self.new_pool()
+
+    def new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=self.initargs)
+
+    def fill(self, depth=None):
+        depth = self.depth if depth is None else depth
+        with self.fill_lock:
+            while True:
+                with self.lock:
+                    if self.exhausted or self.closed or len(self.pending) >= depth:
+                        return
+                try:
+                    pic_file = next(self.piclist) # Can wait on the scan, so not holding lock
+                except StopIteration:
+                    self.exhausted = True
+                    return
+                path = os.path.join(self.root_path, pic_file.pic_dir.rel_dir_name, pic_file.file_name)
+                with self.lock:
+                    if self.closed:
+                        return
+                    self.pending.append((path, pic_file, self.pool.submit(decode, path)))
+
+    def top_up(self):
+        '''
+        Fill in the background
+        '''
+        if self.exhausted or (self.fill_thread is not None and self.fill_thread.is_alive()):
+            return
+        self.fill_thread = Thread(name='Prefetch Fill', target=self.fill, daemon=True)
+        self.fill_thread.start()
+
+    def rebuild_pool(self):
+        '''
+        After a worker died. A new pool, with the pictures that were lost with the old one submitted again
+        '''
+        with self.lock:
+            self.broken_cnt += 1
+            self.pool.shutdown(wait=False)
+            self.pool = self.new_pool()
+            pending = deque()
+            for path, pic_file, future in self.pending:
+                if not future.done() or isinstance(future.exception(), BrokenProcessPool):
+                    future = self.pool.submit(decode, path)
+                pending.append((path, pic_file, future))
+            self.pending = pending
+
+    def next_decoded(self):
+        '''
+        The next decoded picture in the playlist. None when the playlist is finished
+        '''
+        while True:
+            if not self.pending:
+                self.fill(1) # Nothing decoded ahead, so wait for the playlist
+            with self.lock:
+                if not self.pending:
+                    return None
+                path, pic_file, future = self.pending.popleft()
+            self.top_up()
+            rel_path = os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name)
+            try:
+                decoded = Decoded(path, pic_file, *future.result())
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    # Most likely killed by this picture, eg for running out of memory. Quarantined with the rest,
+                    # so it doesn't break the pool again each time round the playlist
+                    log.warning('Decode worker died on %s. Starting new workers' % path)
+                    self.rebuild_pool()
+                print('''Couldn't load file {} giving error: {}'''.format(path, e))
+                if self.quarantine is not None:
+                    self.quarantine.record(rel_path, None, e)
+                continue
+            if self.quarantine is not None:
+                self.quarantine.record(rel_path, decoded.secs)
+            telemetry.record_all(decoded.samples)
+            return decoded
+
+    def close(self, wait=False):
+        '''
+        Stop the workers and free any pictures decoded but not used. With wait, once the workers have finished,
+        eg when the frame exits
+        '''
+        with self.lock:
+            self.closed = True
+            for __path, __pic_file, future in self.pending:
+                future.add_done_callback(unlink_result)
+            self.pending.clear()
+            pool = self.pool
+        pool.shutdown(wait=wait)
+
+def unlink_result(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    shm = shared_memory.SharedMemory(name=future.result()[0])
+    shm.close()
+    shm.unlink()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+'''
+Where the slideshow is up to, saved as it runs, so after a restart the frame shows a picture straight away and carries
+on with the playlist rather than starting again once the library is scanned. Kept free of pi3d.
+Run as a script to see the saved checkpoint:
+    ShowCheckpoint.py [--index FILE] [--image FILE] [--clear]
+'''
+import os
+import time
+import logging
+import sqlite3
+import argparse
+from threading import Thread
+from pathlib import Path
+from PIL import Image
+
+log = logging.getLogger(__name__)
+
+THIS_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+INDEX_FILE = os.path.join(THIS_DIR, 'pic_index.db')
+IMAGE_FILE = os.path.join(THIS_DIR, 'checkpoint.jpg')
+CHECKPOINT_SECS = 300.0
+JPEG_QUALITY = 90
+
+class Resume():
+    '''
+    A saved checkpoint: the picture to show first, display sized and ready to texture (im is None if it can't be
+    shown), and the relative paths of the rest of its playlist pass
+    '''
+    def __init__(self, rel_dir_name, fname, dt, orientation, im, rel_paths, saved_tm):
+        self.rel_dir_name = rel_dir_name
+        self.fname = fname
+        self.dt = dt
+        self.orientation = orientation
+        self.im = im
+        self.rel_paths = rel_paths
+        self.saved_tm = saved_tm
+
+class ShowCheckpoint():
+    '''
+    Saves the show's next picture, as loaded (display sized, upright and with any blurred edges), as a JPEG, and the
+    order of the playlist pass it's in plus its position, in SQLite tables that can live in the PicLibrary index file.
+    The order is only written when the pass changes. Otherwise a checkpoint is the JPEG and one row, written no more
+    than every checkpoint_secs, in a thread of its own.
+    settings describes how the show was started (display size, fit, playlist options). A checkpoint saved with other
+    settings isn't resumed.
+    '''
+    def __init__(self, cache_file, image_file=IMAGE_FILE, settings='', checkpoint_secs=CHECKPOINT_SECS,
+                 clock=time.monotonic):
+        self.cache_file = cache_file
+        self.image_file = image_file
+        self.settings = settings
+        self.checkpoint_secs = checkpoint_secs
+        self.clock = clock
+        self.last_tm = None
+        self.save_thread = None
+        self.order_cnt = None # play_cnt of the order written
+        self.order = [] # Relative paths of the order written
+        self.pos = -1 # Position in order of the picture last saved
+        self.save_cnt = 0
+
+    def connect(self):
+        con = sqlite3.connect(self.cache_file, timeout=30.0)
+        con.execute('''CREATE TABLE IF NOT EXISTS show_order (
+            pos INTEGER PRIMARY KEY,
+            rel_path TEXT NOT NULL
+        )''')
+        con.execute('''CREATE TABLE IF NOT EXISTS show_state (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            settings TEXT NOT NULL,
+            pos INTEGER NOT NULL,
+            rel_dir_name TEXT NOT NULL,
+            fname TEXT NOT NULL,
+            dt REAL,
+            orientation INTEGER NOT NULL,
+            saved_tm REAL NOT NULL
+        )''')
+        return con
+
+    def due(self):
+        return self.last_tm is None or self.clock() - self.last_tm >= self.checkpoint_secs
+
+    def start_save(self, pic, play_cnt, play_files, force=False):
+        '''
+        Checkpoint pic, the picture to show next, in a thread, if a checkpoint is due (or force) and the last one is done.
+        pic has rel_dir_name, fname, dt, orientation and im. play_files are the PicFiles of the pass pic is from, in
+        play order, or None, and play_cnt counts passes. Returns the thread, None if not saving
+        '''
+        if pic.im is None or not (force or self.due()):
+            return None
+        if self.save_thread is not None and self.save_thread.is_alive():
+            return None
+        self.last_tm = self.clock()
+        self.save_thread = Thread(name='Show Checkpoint', target=self.save, args=(pic.rel_dir_name, pic.fname, pic.dt,
+            pic.orientation, pic.im, play_cnt, play_files))
+        self.save_thread.start()
+        return self.save_thread
+
+    def find(self, rel_path):
+        '''
+        Position of rel_path in the order, looking on from the last picture saved. None if it isn't there,
+        eg it was gone back to, or is new
+        '''
+        for pos in range(max(0, self.pos), len(self.order)):
+            if self.order[pos] == rel_path:
+                return pos
+        return None
+
+    def save(self, rel_dir_name, fname, dt, orientation, im, play_cnt=None, play_files=None):
+        start_tm = time.monotonic()
+        new_order = play_cnt != self.order_cnt
+        if new_order:
+            self.order = [os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name)
+                for pic_file in play_files] if play_files is not None else []
+            self.order_cnt = play_cnt
+            self.pos = -1
+        pos = self.find(os.path.join(rel_dir_name, fname))
+        if pos is not None:
+            self.pos = pos
+        try:
+            tmp_path = self.image_file + '.tmp'
+            im.convert('RGB').save(tmp_path, 'JPEG', quality=JPEG_QUALITY)
+            os.replace(tmp_path, self.image_file)
+            con = self.connect()
+            try:
+                with con:
+                    if new_order:
+                        con.execute('DELETE FROM show_order')
+                        con.executemany('INSERT INTO show_order VALUES (?, ?)', enumerate(self.order))
+                    con.execute('INSERT OR REPLACE INTO show_state VALUES (0, ?, ?, ?, ?, ?, ?, ?)',
+                        (self.settings, self.pos, rel_dir_name, fname, dt, orientation, time.time()))
+            finally:
+                con.close()
+        except (OSError, sqlite3.Error) as e:
+            log.warning('Could not save checkpoint %s: %s' % (self.cache_file, e))
+            self.order_cnt = None # Write the order again next time
+            return
+        self.save_cnt += 1
+        log.debug('Checkpoint %s at %s of %s in %.3fs' % (os.path.join(rel_dir_name, fname), self.pos, len(self.order),
+            time.monotonic() - start_tm))
+
+    def load(self, src_dir=None):
+        '''
+        The saved checkpoint as a Resume, None if there isn't one saved with these settings.
+        Its picture isn't shown if it's no longer in src_dir
+        '''
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return None
+        try:
+            con = self.connect()
+            try:
+                row = con.execute('SELECT settings, pos, rel_dir_name, fname, dt, orientation, saved_tm FROM show_state').fetchone()
+                if row is None:
+                    return None
+                settings, pos, rel_dir_name, fname, dt, orientation, saved_tm = row
+                if settings != self.settings:
+                    log.info('Not resuming a checkpoint saved with other settings')
+                    return None
+                rel_paths = [rel_path for (rel_path,) in con.execute('SELECT rel_path FROM show_order WHERE pos > ? ORDER BY pos', (pos,))]
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            log.warning('Ignoring unreadable checkpoint %s: %s' % (self.cache_file, e))
+            return None
+        im = None
+        if src_dir is None or os.path.exists(os.path.join(src_dir, rel_dir_name, fname)):
+            try:
+                im = Image.open(self.image_file)
+                im.load()
+                im.putalpha(255)
+            except OSError as e:
+                log.warning('Ignoring unreadable checkpoint picture %s: %s' % (self.image_file, e))
+                im = None
+        log.info('Resuming at %s with %s to go in the pass' % (os.path.join(rel_dir_name, fname), len(rel_paths)))
+        return Resume(rel_dir_name, fname, dt, orientation, im, rel_paths, saved_tm)
+
+    def clear(self):
+        if self.cache_file is not None and os.path.exists(self.cache_file):
+            con = self.connect()
+            try:
+                with con:
+                    con.execute('DELETE FROM show_order')
+                    con.execute('DELETE FROM show_state')
+            finally:
+                con.close()
+        try:
+            os.remove(self.image_file)
+        except OSError:
+            pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Show where a restarted picture frame will carry on from')
+    parser.add_argument('--index', default=INDEX_FILE, help='PicLibrary index file')
+    parser.add_argument('--image', default=IMAGE_FILE, help='Checkpoint picture')
+    parser.add_argument('--clear', action='store_true', help='Forget the checkpoint, so the show starts afresh')
+    args = parser.parse_args()
+    checkpoint = ShowCheckpoint(args.index, args.image)
+    if args.clear:
+        checkpoint.clear()
+        print('Cleared')
+        return
+    if not os.path.exists(args.index):
+        print('No checkpoint')
+        return
+    con = checkpoint.connect()
+    try:
+        row = con.execute('SELECT settings, pos, rel_dir_name, fname, saved_tm FROM show_state').fetchone()
+        order_cnt = con.execute('SELECT COUNT(*) FROM show_order').fetchone()[0]
+    finally:
+        con.close()
+    if row is None:
+        print('No checkpoint')
+        return
+    settings, pos, rel_dir_name, fname, saved_tm = row
+    print('Saved     %s' % time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(saved_tm)))
+    print('Next      %s' % os.path.join(rel_dir_name, fname))
+    print('Pass      %s of %s' % (pos + 1, order_cnt) if order_cnt else 'Pass      not saved')
+    print('Picture   %s' % (args.image if os.path.exists(args.image) else 'missing'))
+    print('Settings  %s' % settings)
+
+if __name__ == "__main__":
+    # setup logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
+        level=logging.INFO
+        )
+    prog_name = Path(__file__).stem
+    log = logging.getLogger(name=prog_name)
+    main()
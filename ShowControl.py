@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+'''
+Local control of a running slideshow: pause, resume, next, previous, delay change, reload and quit.
+Commands wake the process thread through a condition variable, so they take effect straight away rather than
+after the picture's hold. Kept free of pi3d, with the clock and wait passed in, so the show can be driven with a
+FakeClock.
+Run as a script to send a command to a running frame:
+    ShowControl.py [--socket FILE] pause|resume|toggle|next|prev|reload|quit|status|delay SECS
+'''
+import os
+import sys
+import math
+import time
+import socket
+import logging
+import argparse
+import socketserver
+from threading import Condition, RLock, Thread
+from collections import deque
+from pathlib import Path
+from Telemetry import telemetry
+
+log = logging.getLogger(__name__)
+
+SOCKET_FILE = os.path.join(os.path.abspath(os.path.dirname(os.path.realpath(__file__))), 'control.sock')
+HISTORY = 50 # Pictures that can be gone back through
+MAX_DELAY = 86400.0 # Longer delays are cut to this
+MAX_WAIT = 3600.0 # Longest single wait on the condition. Far beyond this, the platform's timeout overflows
+NEXT = 'next'
+PREV = 'prev'
+RELOAD = 'reload'
+QUIT = 'quit'
+ACTIONS = (NEXT, PREV, RELOAD, QUIT) # Commands the process thread acts on. The rest just change the timing
+
+class ShowControl():
+    '''
+    When the show moves on, and what to. The process thread calls shown() as each picture starts to fade in, then
+    waits in wait_next() for the picture's fade and delay to be up, or for a command, whichever comes first.
+    Commands come from any thread (the keyboard, a ControlServer) and notify the condition, so the process thread
+    wakes at once. While paused, the picture is held until a command.
+    wait(cond, secs) blocks on the held condition for up to secs, or until notified if secs is None. The condition's
+    lock is reentrant, so a fake wait can send commands.
+    '''
+    def __init__(self, delay, paused=False, clock=time.monotonic, wait=None):
+        self.cond = Condition(RLock())
+        self.clock = clock
+        self.wait = wait if wait is not None else lambda cond, secs: cond.wait(secs)
+        self.delay = min(delay, MAX_DELAY)
+        self.paused = paused
+        self.hold_start = clock()
+        self.fade_secs = 0.0
+        self.pause_tm = self.hold_start if paused else None
+        self.actions = deque() # (action, time sent)
+
+    def shown(self, fade_secs=0.0):
+        '''
+        A picture has started to fade in. It's held for fade_secs plus the delay
+        '''
+        with self.cond:
+            self.hold_start = self.clock()
+            self.fade_secs = fade_secs
+            if self.paused:
+                self.pause_tm = self.hold_start
+
+    def remaining(self):
+        '''
+        Seconds until the show moves on by itself. None while paused
+        '''
+        with self.cond:
+            if self.paused:
+                return None
+            return max(0.0, self.hold_start + self.fade_secs + self.delay - self.clock())
+
+    def wait_next(self):
+        '''
+        Process thread. Block until the show should move on. Returns the action: NEXT when the picture's time is up
+        '''
+        with self.cond:
+            while True:
+                if self.actions:
+                    action, sent_tm = self.actions.popleft()
+                    telemetry.record('show.command.secs', self.clock() - sent_tm)
+                    return action
+                remaining = self.remaining()
+                if remaining is not None and remaining <= 0.0:
+                    return NEXT
+                self.wait(self.cond, min(remaining, MAX_WAIT) if remaining is not None else None)
+
+    def send(self, action):
+        if action not in ACTIONS:
+            raise ValueError('Unknown action %s' % action)
+        with self.cond:
+            self.actions.append((action, self.clock()))
+            self.cond.notify_all()
+
+    def pause(self):
+        with self.cond:
+            if not self.paused:
+                self.paused = True
+                self.pause_tm = self.clock()
+                self.cond.notify_all()
+
+    def resume(self):
+        '''
+        Carry on with the time the picture had left when paused
+        '''
+        with self.cond:
+            if self.paused:
+                self.paused = False
+                self.hold_start += self.clock() - self.pause_tm
+                self.pause_tm = None
+                self.cond.notify_all()
+
+    def toggle_pause(self):
+        with self.cond:
+            if self.paused:
+                self.resume()
+            else:
+                self.pause()
+
+    def set_delay(self, secs):
+        '''
+        Change the delay between pictures, including for the one showing. Over MAX_DELAY is cut to MAX_DELAY
+        '''
+        if not math.isfinite(secs) or secs < 0.0:
+            raise ValueError('Delay must be a number of seconds, not %s' % secs)
+        with self.cond:
+            self.delay = min(secs, MAX_DELAY)
+            self.cond.notify_all()
+
+    def status(self):
+        with self.cond:
+            remaining = self.remaining()
+            return 'paused=%s delay=%s remaining=%s' % (self.paused, self.delay,
+                '-' if remaining is None else '%.1f' % remaining)
+
+    def command(self, line):
+        '''
+        Do a text command, eg "pause" or "delay 20". Returns the status. Raises ValueError for a bad command
+        '''
+        words = line.split()
+        if not words:
+            raise ValueError('No command')
+        name, args = words[0].lower(), words[1:]
+        if name == 'delay':
+            if len(args) != 1:
+                raise ValueError('delay needs the seconds')
+            try:
+                secs = float(args[0])
+            except ValueError:
+                raise ValueError('Bad delay %s' % args[0])
+            self.set_delay(secs)
+        elif args:
+            raise ValueError('%s takes no arguments' % name)
+        elif name == 'pause':
+            self.pause()
+        elif name == 'resume':
+            self.resume()
+        elif name == 'toggle':
+            self.toggle_pause()
+        elif name in ACTIONS:
+            self.send(name)
+        elif name != 'status':
+            raise ValueError('Unknown command %s' % name)
+        return self.status()
+
+class ShowHistory():
+    '''
+    Pictures shown, to go back through, and the pictures gone back past, to show again before the playlist carries on.
+    Entries are (path, rel_dir_name, fname)
+    '''
+    def __init__(self, max_len=HISTORY):
+        self.behind = deque(maxlen=max_len) # Shown, oldest first. The last is the one showing
+        self.ahead = [] # Stack of pictures to show before the playlist's next
+
+    def peek(self):
+        '''
+        The picture to show next, if it isn't the playlist's next
+        '''
+        return self.ahead[-1] if self.ahead else None
+
+    def drop(self):
+        '''
+        Forget the picture peek() gave, eg it couldn't be loaded
+        '''
+        self.ahead.pop()
+
+    def shown(self, entry):
+        if self.ahead and self.ahead[-1] == entry:
+            self.ahead.pop()
+        self.behind.append(entry)
+
+    def back(self, next_entry=None):
+        '''
+        Go back a picture. next_entry is the picture already loaded to show next, which is shown again after the one
+        showing. Returns the picture to show, or None if there's nothing further back
+        '''
+        if len(self.behind) < 2:
+            return None
+        if next_entry is not None and self.peek() != next_entry:
+            self.ahead.append(next_entry)
+        self.ahead.append(self.behind.pop())
+        return self.behind.pop()
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode('utf-8', 'replace').strip()
+            if not line:
+                continue
+            try:
+                reply = 'ok %s' % self.server.control.command(line)
+            except ValueError as e:
+                reply = 'error %s' % e
+            self.wfile.write((reply + '\n').encode('utf-8'))
+
+class ControlServer():
+    '''
+    Takes commands for a ShowControl on a Unix socket, a line each, answering each with a line: "ok <status>" or
+    "error <reason>". Only users that can write the socket file can send commands
+    '''
+    def __init__(self, control, path=SOCKET_FILE):
+        self.control = control
+        self.path = path
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path) # Left by a frame that didn't close
+        self.server = socketserver.ThreadingUnixStreamServer(self.path, ControlHandler)
+        self.server.daemon_threads = True
+        self.server.control = self.control
+        os.chmod(self.path, 0o600)
+        self.thread = Thread(name='Control Server', target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        log.info('Listening for commands on %s' % self.path)
+
+    def close(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def send_command(line, path=SOCKET_FILE, timeout=5.0):
+    '''
+    Send a command to a ControlServer. Returns the reply line
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall((line + '\n').encode('utf-8'))
+        with sock.makefile('rb') as f:
+            return f.readline().decode('utf-8').strip()
+
+def main():
+    parser = argparse.ArgumentParser(description='Send a command to a running picture frame')
+    parser.add_argument('command', nargs='+', help='pause, resume, toggle, next, prev, reload, quit, status or delay SECS')
+    parser.add_argument('--socket', default=SOCKET_FILE, help='Control socket of the frame')
+    args = parser.parse_args()
+    try:
+        reply = send_command(' '.join(args.command), args.socket)
+    except OSError as e:
+        log.error('Could not reach the frame on %s: %s' % (args.socket, e))
+        sys.exit(1)
+    print(reply)
+    if not reply.startswith('ok'):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    # setup logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
+        level=logging.INFO
+        )
+    prog_name = Path(__file__).stem
+    log = logging.getLogger(name=prog_name)
+    main()
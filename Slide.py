@@ -1,70 +1,114 @@
 #!/usr/bin/env python3
 
+import ctypes
+import time
 import logging
 import pi3d
 from threading import Thread
-import math
-import time
 import os
-from PIL import Image, ExifTags, ImageFilter # these are needed for getting exif data from images
+import PicImage
+from Prefetch import Prefetcher
+from FrameScheduler import FrameScheduler
+from Telemetry import telemetry
+from TexturePool import TexturePool
 
 log = logging.getLogger(__name__)
 
-EXIF_DATID = None  # this needs to be set before get_files() above can extract exif date info
-EXIF_ORIENTATION = None
-for k in ExifTags.TAGS:
-    if ExifTags.TAGS[k] == 'DateTimeOriginal':
-        EXIF_DATID = k
-    if ExifTags.TAGS[k] == 'Orientation':
-        EXIF_ORIENTATION = k
+class PI3DTextures():
+    '''
+    pi3d backend for a TexturePool. Staged textures are made without a GL texture. The render thread then either
+    makes one for them or uploads their pixels into a texture already in the pool
+    '''
+    def stage(self, im, automatic_resize=True):
+        return pi3d.Texture(im, blend = True, m_repeat = True, automatic_resize = automatic_resize,
+                            free_after_load = True, defer = True)
+
+    def byte_size(self, staged):
+        return staged.image.nbytes
+
+    def create(self, staged):
+        staged.shape = staged.image.shape
+        staged.load_opengl()
+        return staged
+
+    def upload(self, tex, staged):
+        # Same GL texture, new pixels. free_after_load drops the copy again
+        shape = staged.image.shape
+        if shape == tex.shape:
+            # Same size and format, so only the pixels are replaced
+            from pi3d.constants.gl import GL_TEXTURE_2D, GL_UNSIGNED_BYTE
+            iformat = tex._get_format_from_array(staged.image, tex.i_format)
+            pi3d.opengles.glBindTexture(GL_TEXTURE_2D, tex._tex)
+            pi3d.opengles.glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, staged.ix, staged.iy, iformat, GL_UNSIGNED_BYTE,
+                                          staged.image.ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)))
+            if tex.mipmap:
+                pi3d.opengles.glGenerateMipmap(GL_TEXTURE_2D)
+        else:
+            # A new size or format. update_ndarray() specifies the texture again with glTexImage2D
+            tex.image = staged.image
+            tex.ix, tex.iy = staged.ix, staged.iy
+            tex.update_ndarray()
+            tex.shape = shape
+        staged.image = None
+
+    def delete(self, tex):
+        tex.unload_opengl()
+        display = pi3d.Display.Display.INSTANCE
+        if display is not None:
+            display.textures_dict.pop(str(tex._tex), None)
+        # GL can give the name to a new texture. Stop this one's __del__ marking it for deletion
+        tex._tex = ctypes.c_uint(0)
 
 class Pic():
-    def __init__(self, path, rel_dir_name=None, fname=None):
+    def __init__(self, path, rel_dir_name=None, fname=None, display_size=None, fit=True, pic_cache=None, decoded=None,
+                 textures=None, blur=None, keep_image=False):
         self.path = path
         self.rel_dir_name = rel_dir_name
         self.fname = fname
+        self.display_size = display_size # (w, h) to decode at. None for full size
+        self.fit = fit
+        self.pic_cache = pic_cache # PicCache of display sized pictures. Needs a display_size
+        self.decoded = decoded # (im, dt, orientation) already decoded by a Prefetcher
+        self.textures = textures # TexturePool the picture is staged in as the next one. None for its own texture
+        self.blur = blur # PicImage.BlurEdges to fill the edges of a fitted picture. Needs a display_size
+        self.keep_image = keep_image # Keep the pixels as textured in im, eg for a ShowCheckpoint
+        self.im = None
         self.load_tex()
 
     def load_tex(self):
+        with telemetry.timer('load.total.secs'):
+            self._load_tex()
+
+    def _load_tex(self):
         self.tex = None
+        self.error = None
         try:
-            im = Image.open(self.path)
-            im.putalpha(255) # this will convert to RGBA and set alpha to opaque
-            self.orientation = 1
-            if EXIF_DATID is not None and EXIF_ORIENTATION is not None:
-                try:
-                    exif_data = im._getexif()
-                    #print('orientation is {}'.format(exif_data[EXIF_ORIENTATION]))
-                    self.dt = time.mktime(
-                        time.strptime(exif_data[EXIF_DATID], '%Y:%m:%d %H:%M:%S'))
-                    self.orientation = int(exif_data[EXIF_ORIENTATION])
-                except Exception as e: # NB should really check error here but it's almost certainly due to lack of exif data
-                    print('trying to read exif', e)
-                    self.dt = os.path.getmtime(self.path) # so use file last modified date
-            if self.orientation == 2:
-                im = im.transpose(Image.FLIP_LEFT_RIGHT)
-            if self.orientation == 3:
-                im = im.transpose(Image.ROTATE_180) # rotations are clockwise
-            if self.orientation == 4:
-                im = im.transpose(Image.FLIP_TOP_BOTTOM)
-            if self.orientation == 5:
-                im = im.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.ROTATE_270)
-            if self.orientation == 6:
-                im = im.transpose(Image.ROTATE_270)
-            if self.orientation == 7:
-                im = im.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.ROTATE_90)
-            if self.orientation == 8:
-                im = im.transpose(Image.ROTATE_90)
-                do_resize = False
+            # Scaled down while decoding, before the alpha channel is added and the picture turned upright
+            if self.decoded is not None:
+                im, self.dt, self.orientation = self.decoded
+                self.decoded = None
+            elif self.pic_cache is not None and self.display_size is not None:
+                im, self.dt, self.orientation = self.pic_cache.load_image(self.path, self.display_size, self.fit)
             else:
-                do_resize = True
-            self.tex = pi3d.Texture(im, blend = True, m_repeat = True, automatic_resize = do_resize, free_after_load = True)
+                im, self.dt, self.orientation = PicImage.load_image(self.path, self.display_size, self.fit)
+            if self.blur is not None and self.fit and self.display_size is not None:
+                im = self.blur.apply(im, self.display_size, self.path)
+            if self.keep_image:
+                self.im = im
+            do_resize = self.orientation != 8
+            with telemetry.timer('load.texture.secs'):
+                if self.textures is not None:
+                    self.tex = self.textures.stage(im, do_resize)
+                else:
+                    self.tex = pi3d.Texture(im, blend = True, m_repeat = True, automatic_resize = do_resize, free_after_load = True)
         except Exception as e:
+            self.error = e.with_traceback(None) # Its frames would keep the pixels, eg in shared memory, alive
             print('''Couldn't load file {} giving error: {}'''.format(self.path, e))
 
 class Slide(pi3d.Sprite):
 
-    def __init__(self, display, camera, shader_path, edge_alpha):
+    def __init__(self, display, camera, shader_path, edge_alpha, pic_cache=None, prefetch_depth=0, prefetch_workers=2,
+                 scheduler=None, textures=None, blur=None, quarantine=None, keep_next_image=False):
         super(Slide, self).__init__(camera = camera, w = display.width, h = display.height, z = 5.0)
         #self.sprite = pi3d.Sprite(camera = camera, w = display.width, h = display.height, z = 5.0)
         self.set_shader(pi3d.Shader(shader_path))
@@ -73,6 +117,22 @@ class Slide(pi3d.Sprite):
         self.fg_pic = None
         self.next_pic = None
         self.display = display
+        self.display_size = (display.width, display.height)
+        self.pic_cache = pic_cache
+        # > 0 decodes up to prefetch_depth pictures ahead in prefetch_workers processes
+        self.prefetch_depth = prefetch_depth
+        self.prefetch_workers = prefetch_workers
+        self.prefetcher = None
+        # Times the fades. Alpha is set from it each time the slide is drawn
+        self.scheduler = scheduler if scheduler is not None else FrameScheduler()
+        # bg, fg and next picture textures. Reused, so GPU memory doesn't grow
+        self.textures = textures if textures is not None else TexturePool(PI3DTextures())
+        # PicImage.BlurEdges fills the edges around pictures with a blurred copy. None for the background colour
+        self.blur = blur
+        # PicQuarantine to record failed and slow loads in, so the playlist leaves them out
+        self.quarantine = quarantine
+        # Keep the next picture's pixels until it's shown, for a ShowCheckpoint to save
+        self.keep_next_image = keep_next_image
 
     def set_fg_to_next(self, fit=True):
         # Re texture sprite
@@ -80,7 +140,8 @@ class Slide(pi3d.Sprite):
         self.fg_pic = self.next_pic
         if self.bg_pic is None: # First pic - Make bg = fg = next
             self.bg_pic = self.next_pic
-        self.set_textures([self.fg_pic.tex, self.bg_pic.tex,])
+        self.fg_pic.im = None
+        self.textures.rotate() # Textures set by draw()
         self.unif[45:47] = self.unif[42:44] # Transfer front w,h to back
         self.unif[51:53] = self.unif[48:50] # Transfer front w,h offsets to back
         wh_rat = (self.display.width * self.fg_pic.tex.iy) / (self.display.height * self.fg_pic.tex.ix)
@@ -95,35 +156,111 @@ class Slide(pi3d.Sprite):
         self.unif[os2] = 0.0
 
     def load_image(self, path, fit=True):
-        self.next_pic = Pic(path, os.path.dirname(path), os.path.basename(path))
+        self.next_pic = Pic(path, os.path.dirname(path), os.path.basename(path), self.display_size, fit,
+                            textures=self.textures, blur=self.blur)
         self.next_pic.dt = None
         self.transition_to_next(fit)
 
+    def load_prefetched_image(self, root_path, piclist, fit=True):
+        '''
+        Texture the next picture from the Prefetcher for piclist. Only the texture is made here, the picture
+        has already been decoded in a worker process. Unreadable files have already been skipped. One that fails
+        here is quarantined and skipped too
+        '''
+        if self.prefetcher is None or self.prefetcher.piclist is not piclist:
+            if self.prefetcher is not None:
+                self.prefetcher.close()
+            self.prefetcher = Prefetcher(root_path, piclist, self.display_size, fit, self.prefetch_depth,
+                                         self.prefetch_workers, self.pic_cache, self.blur, self.quarantine)
+        while True:
+            self.next_pic = None
+            with telemetry.timer('load.prefetch_wait.secs'):
+                decoded = self.prefetcher.next_decoded()
+            if decoded is None:
+                return
+            try:
+                self.next_pic = Pic(decoded.path, decoded.rel_dir_name, decoded.fname, self.display_size, fit,
+                                    decoded=(decoded.im, decoded.dt, decoded.orientation), textures=self.textures,
+                                    keep_image=self.keep_next_image)
+                if self.next_pic.im is not None:
+                    self.next_pic.im = self.next_pic.im.copy() # Off the shared memory, which is about to be freed
+            finally:
+                decoded.release()
+            if self.next_pic.tex is not None:
+                return
+            if self.quarantine is not None:
+                self.quarantine.record(os.path.join(decoded.rel_dir_name, decoded.fname), None, self.next_pic.error)
+
     def load_next_image(self, root_path, piclist, fit=True):
+        '''
+        Load the next picture in piclist that can be shown. Pictures that fail are quarantined and skipped, however
+        many there are in a row. next_pic is None only when the playlist is finished
+        '''
+        if self.prefetch_depth > 0:
+            self.load_prefetched_image(root_path, piclist, fit)
+            return
         try:
-            for __i in range(10): # max files to check
+            while True:
                 np = next(piclist)
                 np_path = os.path.join(root_path, np.pic_dir.rel_dir_name, np.file_name)
-                self.next_pic = Pic(np_path, np.pic_dir.rel_dir_name, np.file_name)
+                start_tm = time.monotonic()
+                self.next_pic = Pic(np_path, np.pic_dir.rel_dir_name, np.file_name, self.display_size, fit, self.pic_cache,
+                                    textures=self.textures, blur=self.blur, keep_image=self.keep_next_image)
+                if self.quarantine is not None:
+                    self.quarantine.record(os.path.join(np.pic_dir.rel_dir_name, np.file_name), time.monotonic() - start_tm,
+                                           self.next_pic.error)
                 if self.next_pic.tex is not None:
                     break
         except StopIteration:
             self.next_pic = None
 
+    def load_path(self, path, rel_dir_name, fname, fit=True):
+        '''
+        Load a picture out of playlist order as the next one, eg one shown before. Returns True if it loaded
+        '''
+        self.next_pic = Pic(path, rel_dir_name, fname, self.display_size, fit, self.pic_cache, textures=self.textures,
+                            blur=self.blur, keep_image=self.keep_next_image)
+        if self.next_pic.tex is None:
+            self.next_pic = None
+            return False
+        return True
+
+    def load_decoded(self, path, rel_dir_name, fname, decoded, fit=True):
+        '''
+        Load a picture already decoded (im, dt, orientation) display sized, eg saved by a ShowCheckpoint, as the next one.
+        Returns True if it loaded
+        '''
+        self.next_pic = Pic(path, rel_dir_name, fname, self.display_size, fit, decoded=decoded, textures=self.textures,
+                            keep_image=self.keep_next_image)
+        if self.next_pic.tex is None:
+            self.next_pic = None
+            return False
+        return True
+
     def start_load_next_image(self, root_path, piclist, fit=True):
         self.load_thread = Thread(name='Slide Load', target=self.load_next_image, args=(root_path, piclist, fit))
         self.load_thread.start()
 
-    def transition_to_next(self, fit=True, trans_secs=0):
+    def transition_to_next(self, fit=True, trans_secs=0, wait=True):
         self.set_fg_to_next(fit)
-        # Do the alpha transition. Fade in fg
-        alpha = 0.0
-        tick_cnt = math.ceil(trans_secs/0.2)
-        if tick_cnt > 0:
-            alpha_delta = 1.0/tick_cnt
-            for __tick in range(tick_cnt):
-                alpha += alpha_delta
-                self.unif[44] = alpha
-                time.sleep(0.2)
-        # set alpha to complete
-        self.unif[44] = 1.0
+        # Fade in fg. The render loop draws at full rate, with the alpha from the clock, until it's done
+        self.scheduler.start_fade(trans_secs)
+        if wait:
+            self.scheduler.wait_fade()
+
+    def close(self):
+        '''
+        Render thread, once the process thread has stopped. Free the textures, and any pictures decoded ahead in
+        shared memory, which would otherwise be left in /dev/shm
+        '''
+        if self.prefetcher is not None:
+            self.prefetcher.close(wait=True)
+            self.prefetcher = None
+        self.textures.close()
+
+    def draw(self, *args, **kwargs):
+        textures = self.textures.apply()
+        if textures is not None:
+            self.set_textures(textures)
+        self.unif[44] = self.scheduler.fade_alpha()
+        super(Slide, self).draw(*args, **kwargs)
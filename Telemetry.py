@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+'''
+Lightweight timers and values for finding out why the frame is slow.
+Modules record into the shared telemetry object. Nothing is kept, and a timer costs one attribute test, until
+enable() is called. Once enabled, a JSON summary of each metric (count, p50, p95, max, and a histogram) is written
+every interval_secs to a rotating file.
+Run as a script to aggregate the summaries in one or more files:
+    Telemetry.py [--since YYYY-MM-DDTHH:MM] FILE [FILE ...]
+'''
+import os
+import sys
+import math
+import json
+import time
+import atexit
+import logging
+import argparse
+import logging.handlers
+from threading import Lock
+from collections import defaultdict
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+INTERVAL_SECS = 300.0
+MAX_BYTES = 1024 * 1024
+BACKUP_CNT = 5
+HIST_STEPS = 4 # Histogram buckets per doubling. Percentiles from merged histograms are within about 10%
+
+def percentile(values, fraction):
+    '''
+    Nearest rank percentile of a sorted list
+    '''
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def hist_bucket(value):
+    return 'zero' if value <= 0 else str(round(math.log2(value) * HIST_STEPS))
+
+def hist_value(bucket):
+    return 0.0 if bucket == 'zero' else 2 ** (int(bucket) / HIST_STEPS)
+
+def hist_percentile(hist, fraction):
+    '''
+    Percentile of the values counted in a {bucket: count} histogram
+    '''
+    total = sum(hist.values())
+    rank = min(total - 1, int(total * fraction))
+    for bucket in sorted(hist, key=hist_value):
+        rank -= hist[bucket]
+        if rank < 0:
+            return hist_value(bucket)
+    return 0.0
+
+class NullTimer():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = NullTimer()
+
+class Timer():
+    __slots__ = ('telemetry', 'name', 'start_tm')
+
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+
+    def __enter__(self):
+        self.start_tm = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.telemetry.record(self.name, time.perf_counter() - self.start_tm)
+        return False
+
+class Telemetry():
+    '''
+    Named samples, summarised every interval_secs. Timers record seconds, and are named *.secs by convention
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.lock = Lock()
+        self.samples = defaultdict(list)
+        self.interval_secs = INTERVAL_SECS
+        self.period_start = time.time()
+        self.writer = None
+
+    def enable(self, log_file, interval_secs=INTERVAL_SECS, max_bytes=MAX_BYTES, backup_cnt=BACKUP_CNT):
+        handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_cnt)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.writer = logging.getLogger('telemetry.summaries')
+        self.writer.handlers = [handler]
+        self.writer.setLevel(logging.INFO)
+        self.writer.propagate = False
+        self.interval_secs = interval_secs
+        self.period_start = time.time()
+        self.enabled = True
+        atexit.register(self.emit)
+
+    def collect(self):
+        '''
+        Keep samples, but don't write summaries of them. For a worker process, whose samples the main process take()s
+        and records
+        '''
+        self.writer = None
+        self.interval_secs = math.inf
+        with self.lock:
+            self.samples = defaultdict(list)
+        self.enabled = True
+
+    def take(self):
+        '''
+        The samples since the last take(), as {name: [values]}
+        '''
+        with self.lock:
+            samples = self.samples
+            self.samples = defaultdict(list)
+        return dict(samples)
+
+    def record_all(self, samples):
+        '''
+        Record samples from take(), eg in another process
+        '''
+        for name, values in samples.items():
+            for value in values:
+                self.record(name, value)
+
+    def disable(self):
+        self.enabled = False
+        with self.lock:
+            self.samples = defaultdict(list)
+
+    def timer(self, name):
+        '''
+        Context manager that records how long its block takes
+        '''
+        return Timer(self, name) if self.enabled else NULL_TIMER
+
+    def record(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.samples[name].append(value)
+            due = time.time() - self.period_start >= self.interval_secs
+        if due:
+            self.emit()
+
+    def summary(self, samples):
+        metrics = {}
+        for name, values in samples.items():
+            values = sorted(values)
+            hist = defaultdict(int)
+            for value in values:
+                hist[hist_bucket(value)] += 1
+            metrics[name] = {
+                'count': len(values),
+                'sum': sum(values),
+                'p50': percentile(values, 0.5),
+                'p95': percentile(values, 0.95),
+                'max': values[-1],
+                'hist': hist,
+            }
+        return metrics
+
+    def emit(self):
+        '''
+        Write the summary of the samples since the last one, and start a new period
+        '''
+        with self.lock:
+            samples = self.samples
+            self.samples = defaultdict(list)
+            start_tm = self.period_start
+            self.period_start = time.time()
+        if not samples or self.writer is None:
+            return
+        self.writer.info(json.dumps({
+            'start': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start_tm)),
+            'secs': round(self.period_start - start_tm, 3),
+            'pid': os.getpid(),
+            'metrics': self.summary(samples),
+        }, sort_keys=True))
+
+telemetry = Telemetry()
+
+def aggregate(summaries):
+    '''
+    Merge summaries into {name: (count, sum, p50, p95, max)}. The percentiles come from the merged histograms,
+    capped at the max
+    '''
+    merged = {}
+    for summary in summaries:
+        for name, metric in summary['metrics'].items():
+            count, total, max_value, hist = merged.get(name, (0, 0.0, 0.0, defaultdict(int)))
+            for bucket, bucket_cnt in metric['hist'].items():
+                hist[bucket] += bucket_cnt
+            merged[name] = (count + metric['count'], total + metric['sum'], max(max_value, metric['max']), hist)
+    return dict((name, (count, total, min(hist_percentile(hist, 0.5), max_value), min(hist_percentile(hist, 0.95), max_value), max_value))
+        for name, (count, total, max_value, hist) in merged.items())
+
+def read_summaries(paths, since=None):
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    summary = json.loads(line)
+                except ValueError:
+                    log.warning('Skipping bad line in %s' % path)
+                    continue
+                if since is None or summary['start'] >= since:
+                    yield summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate telemetry summaries')
+    parser.add_argument('files', nargs='+', help='Telemetry files, including rotated ones')
+    parser.add_argument('--since', help='Only summaries from this time on, YYYY-MM-DDTHH:MM')
+    args = parser.parse_args()
+    summaries = list(read_summaries(args.files, args.since))
+    if not summaries:
+        print('No summaries')
+        sys.exit(1)
+    print('%s summaries from %s' % (len(summaries), min(summary['start'] for summary in summaries)))
+    print('%-28s %10s %12s %12s %12s %12s' % ('metric', 'count', 'sum', 'p50', 'p95', 'max'))
+    for name, (count, total, p50, p95, max_value) in sorted(aggregate(summaries).items()):
+        print('%-28s %10s %12.4g %12.4g %12.4g %12.4g' % (name, count, total, p50, p95, max_value))
+
+if __name__ == "__main__":
+    # setup logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
+        level=logging.INFO
+        )
+    prog_name = Path(__file__).stem
+    log = logging.getLogger(name=prog_name)
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+'''
+A fixed set of texture slots for the slideshow: the picture fading out (bg), the one fading in (fg), and the next one.
+New pictures are uploaded into the textures already in the slots, rather than a new texture being made for each
+picture and the old ones left to garbage collection, so GPU memory stays flat however long the show runs.
+Kept free of pi3d, the GL side is a backend, so the slot logic can be run with FakeTextures.
+'''
+import logging
+from threading import Lock
+from Telemetry import telemetry
+
+log = logging.getLogger(__name__)
+
+SLOTS = ('bg', 'fg', 'next')
+
+class TexturePool():
+    '''
+    Pictures are staged in any thread (stage()) and shown from the process thread (rotate()). Both are only queued.
+    The render thread does the GL work in apply(), in the order asked for, before drawing.
+    The backend provides:
+        stage(im, automatic_resize) - pixels ready to upload, with ix and iy. Any thread, no GL
+        byte_size(staged)           - bytes the staged pixels will take on the GPU
+        create(staged)              - a new texture of the staged pixels
+        upload(tex, staged)         - replace the pixels of an existing texture, which may be another size
+        delete(tex)                 - free a texture now
+    '''
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = Lock()
+        self.ops = [] # ('upload', staged) and ('rotate', None), for the render thread
+        self.slots = dict.fromkeys(SLOTS)
+        self.live = {} # id(tex): GPU bytes, of each texture made and not deleted
+        self.create_cnt = 0
+        self.upload_cnt = 0
+
+    @property
+    def live_cnt(self):
+        return len(self.live)
+
+    @property
+    def live_bytes(self):
+        return sum(self.live.values())
+
+    def stage(self, im, automatic_resize=True):
+        '''
+        Get a picture ready to be the next one. Returns the staged pixels, which have the texture size
+        '''
+        staged = self.backend.stage(im, automatic_resize)
+        with self.lock:
+            if self.ops and self.ops[-1][0] == 'upload':
+                # A next picture that never got shown
+                self.ops[-1] = ('upload', staged)
+            else:
+                self.ops.append(('upload', staged))
+        return staged
+
+    def rotate(self):
+        '''
+        Show the next picture. It becomes fg, and fg becomes bg
+        '''
+        with self.lock:
+            self.ops.append(('rotate', None))
+
+    def apply(self):
+        '''
+        Render thread. Do the uploads and rotations queued since the last call.
+        Returns the [fg, bg] textures to draw when they've changed, else None
+        '''
+        with self.lock:
+            ops, self.ops = self.ops, []
+        rotated = False
+        for op, staged in ops:
+            if op == 'upload':
+                self.upload(staged)
+            else:
+                rotated = self._rotate() or rotated
+        if not rotated:
+            return None
+        telemetry.record('texture.live_bytes', self.live_bytes)
+        return [self.slots['fg'], self.slots['bg']]
+
+    def upload(self, staged):
+        tex = self.slots['next']
+        byte_size = self.backend.byte_size(staged)
+        if tex is None:
+            tex = self.backend.create(staged)
+            self.create_cnt += 1
+            log.debug('Texture %s made. %s live' % (id(tex), len(self.live) + 1))
+        else:
+            self.backend.upload(tex, staged)
+            self.upload_cnt += 1
+        self.live[id(tex)] = byte_size
+        self.slots['next'] = tex
+
+    def _rotate(self):
+        slots = self.slots
+        if slots['next'] is None:
+            log.warning('No next texture to show')
+            return False
+        old_bg = slots['bg']
+        # The first picture shows as both
+        slots['bg'] = slots['fg'] if slots['fg'] is not None else slots['next']
+        slots['fg'] = slots['next']
+        # The old bg is reused for the next picture, unless it's still showing
+        slots['next'] = old_bg if old_bg is not slots['bg'] and old_bg is not slots['fg'] else None
+        return True
+
+    def close(self):
+        '''
+        Render thread. Delete every texture, and drop anything queued
+        '''
+        with self.lock:
+            self.ops = []
+        for tex in set(tex for tex in self.slots.values() if tex is not None):
+            self.backend.delete(tex)
+            del self.live[id(tex)]
+        self.slots = dict.fromkeys(SLOTS)
+
+class FakeTexture():
+    def __init__(self, size, byte_size):
+        self.ix, self.iy = size
+        self.byte_size = byte_size
+
+class FakeTextures():
+    '''
+    A backend for running a TexturePool without GL. Counts the GPU textures as if they were real
+    '''
+    def __init__(self):
+        self.gpu = {} # id(tex): bytes of the textures on the "GPU"
+        self.upload_cnt = 0
+        self.resize_cnt = 0 # Uploads that changed the texture's size, so needed it specified again
+
+    def stage(self, im, automatic_resize=True):
+        return FakeTexture(im.size, im.width * im.height * len(im.getbands()))
+
+    def byte_size(self, staged):
+        return staged.byte_size
+
+    def create(self, staged):
+        tex = FakeTexture((staged.ix, staged.iy), staged.byte_size)
+        self.gpu[id(tex)] = tex.byte_size
+        return tex
+
+    def upload(self, tex, staged):
+        if id(tex) not in self.gpu:
+            raise ValueError('Upload to a deleted texture')
+        if (tex.ix, tex.iy) != (staged.ix, staged.iy):
+            self.resize_cnt += 1
+        tex.ix, tex.iy, tex.byte_size = staged.ix, staged.iy, staged.byte_size
+        self.gpu[id(tex)] = tex.byte_size
+        self.upload_cnt += 1
+
+    def delete(self, tex):
+        del self.gpu[id(tex)]
@@ -0,0 +1,1288 @@
+#!/usr/bin/python3
+'''
+Headless benchmarks for the picture frame. Nothing here needs a display or pi3d.
+    benchmark.py scan [--dirs N] [--files N] [--depth N] [--threads N] [--src DIR]
+    benchmark.py match [--names N]
+    benchmark.py memory [--dirs N] [--files N]
+    benchmark.py watch [--dirs N] [--files N] [--depth N] [--new N] [--poll SECS] [--timeout SECS]
+    benchmark.py decode [--images N] [--width N] [--height N] [--display WxH] [--src DIR]
+    benchmark.py exif [--images N]
+    benchmark.py stream [--dirs N] [--files N] [--depth N] [--threads N] [--src DIR]
+    benchmark.py playlist [--files N] [--queries N] [--compact]
+    benchmark.py dirshuffle [--files N] [--big N] [--events N] [--event-files N] [--window N] [--picks N] [--saved N]
+    benchmark.py blur [--images N] [--width N] [--height N] [--display WxH] [--amounts 4,12,...]
+    benchmark.py resize [--images N] [--width N] [--height N] [--display WxH] [--processes N]
+    benchmark.py similar [--hashes N] [--brute N] [--images N] [--dir-files N]
+    benchmark.py frames [--slides N] [--delay SECS] [--fade SECS] [--fps N] [--draw-ms MS]
+    benchmark.py textures [--slides N]
+    benchmark.py control [--commands N] [--delay SECS] [--fade SECS] [--fps N] [--real N]
+    benchmark.py telemetry [--calls N] [--images N]
+    benchmark.py suite [--dirs N] [--files N] [--depth N] [--width N] [--height N] [--orientations 1,6,...]
+                       [--display WxH] [--loads N] [--slides N] [--hold SECS] [--json FILE]
+    benchmark.py startup [--dirs N] [--files N] [--depth N] [--width N] [--height N] [--display WxH] [--slides N]
+    benchmark.py reorg [--dirs N] [--files N] [--depth N] [--rm N]
+    benchmark.py compare OLD.json NEW.json [--threshold FRACTION]
+'''
+import os
+import sys
+import time
+import logging
+import re
+import random
+import gc
+import argparse
+import tempfile
+import tracemalloc
+from threading import Thread
+from collections import deque
+from pathlib import Path
+import PicLibrary as PLib
+import PicWatcher
+from CompactLibrary import CompactStore, CompactFileList
+from Playlist import DateIndex, Playlist
+from ShowControl import ACTIONS
+
+log = logging.getLogger(__name__)
+
+def make_tree(root, dir_cnt, file_cnt, depth):
+    '''
+    Build a synthetic picture library of empty files. dir_cnt directories per level, depth levels deep,
+    file_cnt files in each directory. A mix of included, excluded and skipped file names.
+    '''
+    def fill(dir_path, level):
+        for i in range(file_cnt):
+            if i % 10 == 0:
+                fname = 'IMG_%05d - Copy.jpg' % i
+            elif i % 10 == 1:
+                fname = 'IMG_%05d.mov' % i
+            else:
+                fname = 'IMG_%05d.jpg' % i
+            open(os.path.join(dir_path, fname), 'w').close()
+        if level < depth:
+            for d in range(dir_cnt):
+                sub_dir = os.path.join(dir_path, '%04d-%02d-01 Event %s' % (2000 + d, level + 1, d))
+                os.mkdir(sub_dir)
+                fill(sub_dir, level + 1)
+    fill(root, 0)
+
+def time_scan(src_dir, index_file, scan_threads=0):
+    pic_lib = PLib.PicLibrary(src_dir, index_file=index_file, scan_threads=scan_threads)
+    start_tm = time.perf_counter()
+    pic_lib.get_file_list(shuffle=False)
+    return time.perf_counter() - start_tm, pic_lib
+
+def lib_contents(pic_lib):
+    return [(f.pic_dir.rel_dir_name, f.file_name) for f in pic_lib.pic_files]
+
+def bench_scan(args):
+    '''
+    Cold (no index) vs warm (unchanged index) PicLibrary directory scan, and the parallel scanner
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir = args.src
+        if src_dir is None:
+            src_dir = os.path.join(tmp_dir, 'Pictures')
+            os.mkdir(src_dir)
+            make_tree(src_dir, args.dirs, args.files, args.depth)
+        index_file = os.path.join(tmp_dir, 'pic_index.db')
+        no_index_tm, pic_lib = time_scan(src_dir, None)
+        cold_tm, __pic_lib = time_scan(src_dir, index_file)
+        warm_tm, __pic_lib = time_scan(src_dir, index_file)
+        parallel_tm, parallel_lib = time_scan(src_dir, None, args.threads)
+        compact_lib = PLib.PicLibrary(src_dir, compact=True)
+        compact_lib.get_file_list(shuffle=False)
+    assert lib_contents(parallel_lib) == lib_contents(pic_lib)
+    assert lib_contents(compact_lib) == lib_contents(pic_lib)
+    print('scan dirs=%s files=%s' % (pic_lib.dir_cnt, pic_lib.file_cnt))
+    print('   no index   %8.3fs' % no_index_tm)
+    print('   cold index %8.3fs' % cold_tm)
+    print('   warm index %8.3fs   %.1fx' % (warm_tm, no_index_tm / warm_tm if warm_tm else 0.0))
+    print('   %2s threads %8.3fs   %.1fx' % (args.threads, parallel_tm, no_index_tm / parallel_tm if parallel_tm else 0.0))
+
+def bench_stream(args):
+    '''
+    Time until the first shuffled playlist file is available, vs the whole scan
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir = args.src
+        if src_dir is None:
+            src_dir = os.path.join(tmp_dir, 'Pictures')
+            os.mkdir(src_dir)
+            make_tree(src_dir, args.dirs, args.files, args.depth)
+        pic_lib = PLib.PicLibrary(src_dir, scan_threads=args.threads)
+        start_tm = time.perf_counter()
+        pic_lib.update()
+        playlist = pic_lib.playlist()
+        played = [next(playlist)]
+        first_tm = time.perf_counter() - start_tm
+        played.extend(playlist)
+        all_tm = time.perf_counter() - start_tm
+        pic_lib.update_thread.join()
+    assert sorted(map(id, played)) == sorted(map(id, pic_lib.pic_files))
+    print('stream files=%s' % len(played))
+    print('   first file %8.3fs' % first_tm)
+    print('   all files  %8.3fs' % all_tm)
+
+def build_library(compact, dir_cnt, file_cnt):
+    '''
+    The PicLibrary structures for dir_cnt directories of file_cnt files, without touching the file system
+    '''
+    if compact:
+        store = CompactStore()
+        new_pic_dir = store.add_dir
+        pic_files = CompactFileList(store)
+    else:
+        new_pic_dir = PLib.PicDir
+        pic_files = []
+    pic_dirs = []
+    for d in range(dir_cnt):
+        pic_dir = new_pic_dir('%04d-%02d-%02d Some Event Name/Camera %s' % (2000 + d % 20, d % 12 + 1, d % 28 + 1, d))
+        for i in range(file_cnt):
+            pic_files.append(pic_dir.add_file('IMG_%04d%04d.jpg' % (d, i)))
+        pic_dirs.append(pic_dir)
+    return pic_dirs, pic_files
+
+def bench_memory(args):
+    '''
+    Memory and full garbage collection time of the PicDir/PicFile object graph vs the compact arrays
+    '''
+    file_cnt = args.files // args.dirs
+    print('memory dirs=%s files=%s' % (args.dirs, args.dirs * file_cnt))
+    for compact in (False, True):
+        gc.collect()
+        tracemalloc.start()
+        library = build_library(compact, args.dirs, file_cnt)
+        size, __peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        start_tm = time.perf_counter()
+        gc.collect()
+        gc_tm = time.perf_counter() - start_tm
+        print('   %-8s %8.1f MB %6.0f bytes/file   gc %6.1f ms' %
+            ('compact' if compact else 'objects', size / 1e6, size / len(library[1]), gc_tm * 1000))
+        del library
+
+def bench_watch(args):
+    '''
+    Time from new files being written to them coming out of a repeating playlist, with a watched library.
+    Also checks the watched library ends up the same as a fresh scan after files and directories are moved and deleted.
+    '''
+    with tempfile.TemporaryDirectory() as src_dir:
+        make_tree(src_dir, args.dirs, args.files, args.depth)
+        pic_lib = PLib.PicLibrary(src_dir)
+        pic_lib.update(shuffle=False)
+        if args.poll:
+            pic_lib.watcher = PicWatcher.PollWatcher(pic_lib, args.poll)
+            pic_lib.watcher.start()
+        else:
+            pic_lib.watch()
+        playlist = pic_lib.playlist(shuffle=False, repeat=True)
+        pic_lib.update_thread.join()
+        for __i in range(pic_lib.file_cnt):
+            next(playlist)
+        time.sleep(0.5) # let the watcher start
+        new_dir = os.path.join(src_dir, '2099-01-01 New Event')
+        os.mkdir(new_dir)
+        start_tm = time.perf_counter()
+        for i in range(args.new):
+            open(os.path.join(new_dir, 'NEW_%05d.jpg' % i), 'w').close()
+        new_files = set()
+        while len(new_files) < args.new:
+            if time.perf_counter() - start_tm > args.timeout:
+                pic_lib.watcher.stop()
+                log.error('Only %s of %s new files reached the playlist in %ss' % (len(new_files), args.new, args.timeout))
+                sys.exit(1)
+            pic_file = next(playlist)
+            if pic_file.pic_dir.rel_dir_name == '2099-01-01 New Event':
+                new_files.add(pic_file.file_name)
+        new_tm = time.perf_counter() - start_tm
+        os.rename(new_dir, os.path.join(src_dir, '2099-01-02 Moved Event'))
+        os.remove(os.path.join(src_dir, pic_lib.pic_files[0].pic_dir.rel_dir_name, pic_lib.pic_files[0].file_name))
+        time.sleep(args.poll * 2 if args.poll else PicWatcher.MAX_DELAY_SECS)
+        scan_lib = PLib.PicLibrary(src_dir)
+        scan_lib.get_file_list(shuffle=False)
+        with pic_lib.lock:
+            assert sorted(lib_contents(pic_lib)) == sorted(lib_contents(scan_lib))
+        pic_lib.watcher.stop()
+    print('watch %s files=%s new=%s' % (type(pic_lib.watcher).__name__, scan_lib.file_cnt, args.new))
+    print('   new files in playlist %8.3fs' % new_tm)
+
+def make_jpegs(dir_path, count, width, height, orientations=(1, 3, 6, 8)):
+    '''
+    Write count synthetic camera style JPEGs, cycling through the EXIF orientations.
+    Smooth blobs plus a little grain, so they compress about like a photo
+    '''
+    from PIL import Image
+    paths = []
+    blobs = [Image.effect_noise((width // 64, height // 64), 60).resize((width, height), Image.BICUBIC) for __c in range(3)]
+    grain = Image.effect_noise((width, height), 8)
+    base = Image.merge('RGB', [Image.blend(blob, grain, 0.3) for blob in blobs])
+    for i in range(count):
+        orientation = orientations[i % len(orientations)]
+        exif = Image.Exif()
+        exif[0x0112] = orientation # Orientation
+        exif.get_ifd(0x8769)[0x9003] = '2020:01:%02d 12:00:00' % (i % 28 + 1) # DateTimeOriginal
+        path = os.path.join(dir_path, 'IMG_%04d.jpg' % i)
+        base.save(path, quality=90, exif=exif.tobytes())
+        paths.append(path)
+    return paths
+
+def legacy_load(path):
+    '''
+    The original Pic.load_tex decode: full resolution, alpha added and turned upright before any scaling
+    '''
+    import PicImage
+    from PIL import Image
+    im = Image.open(path)
+    im.putalpha(255)
+    __dt, orientation = PicImage.read_exif(im, path)
+    for method in PicImage.TRANSPOSES.get(orientation, ()):
+        im = im.transpose(method)
+    return im
+
+def bench_decode(args):
+    '''
+    Picture decode time and size for the texture, full resolution vs scaled to the display while decoding
+    '''
+    import PicImage
+    display_size = tuple(int(d) for d in args.display.split('x'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.src is None:
+            paths = make_jpegs(tmp_dir, args.images, args.width, args.height)
+        else:
+            paths = [os.path.join(args.src, f) for f in sorted(os.listdir(args.src))
+                if PLib.PathMatcher(PLib.PATH_REGXS['inc_files'], []).status(f) == PLib.PathStatus.INCLUDE][:args.images]
+        results = []
+        for name, load in (('full size', legacy_load), ('draft', lambda path: PicImage.load_image(path, display_size, not args.fill)[0])):
+            start_tm = time.perf_counter()
+            pixel_bytes = 0
+            for path in paths:
+                im = load(path)
+                pixel_bytes = max(pixel_bytes, im.width * im.height * len(im.getbands()))
+            results.append((name, (time.perf_counter() - start_tm) / len(paths), pixel_bytes))
+    print('decode images=%s display=%s' % (len(paths), args.display))
+    for name, per_image_tm, pixel_bytes in results:
+        print('   %-9s %8.1f ms/image %8.1f MB largest image' % (name, per_image_tm * 1000, pixel_bytes / 1e6))
+
+def bench_exif(args):
+    '''
+    EXIF date and orientation per second, header only PicExif vs PIL
+    '''
+    import PicExif
+    import PicImage
+    from PIL import Image
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = make_jpegs(tmp_dir, args.images, 1200, 800)
+        start_tm = time.perf_counter()
+        for __i in range(10):
+            pil_exifs = [PicImage.read_exif(Image.open(path), path) for path in paths]
+        pil_tm = time.perf_counter() - start_tm
+        start_tm = time.perf_counter()
+        for __i in range(10):
+            exifs = [PicExif.read_exif(path) for path in paths]
+        exif_tm = time.perf_counter() - start_tm
+    assert exifs == pil_exifs
+    print('exif images=%s' % len(paths))
+    print('   PIL      %10.0f files/s' % (len(paths) * 10 / pil_tm))
+    print('   PicExif  %10.0f files/s   %.1fx' % (len(paths) * 10 / exif_tm, pil_tm / exif_tm))
+
+def legacy_status(path, regx_prefix, inc_regx_list, exc_regx_list):
+    '''
+    The original per-regx PicLibrary include/exclude check, for comparison
+    '''
+    for inc_regx in inc_regx_list:
+        if re.match(regx_prefix+inc_regx, path, re.IGNORECASE):
+            for exc_regx in exc_regx_list:
+                if re.match(regx_prefix+exc_regx, path, re.IGNORECASE):
+                    return PLib.PathStatus.EXCLUDE
+            return PLib.PathStatus.INCLUDE
+    return PLib.PathStatus.SKIP
+
+def full_blur(im, display_size, amount, zoom, edge_alpha):
+    '''
+    A blurred edge fill done the straightforward way: the zoomed in middle of the picture scaled to the display
+    size, then to 512 wide, blurred at amount, and scaled back up
+    '''
+    from PIL import Image, ImageFilter
+    disp_w, disp_h = display_size
+    scale = max(disp_w / im.width, disp_h / im.height) * zoom
+    w, h = disp_w / scale, disp_h / scale
+    box = ((im.width - w) / 2, (im.height - h) / 2, (im.width + w) / 2, (im.height + h) / 2)
+    im_b = im.resize(display_size, Image.NEAREST, box=box).resize((512, round(512 * disp_h / disp_w)))
+    im_b = im_b.filter(ImageFilter.GaussianBlur(amount)).resize(display_size, Image.BICUBIC)
+    im_b.putalpha(round(255 * edge_alpha))
+    im_b.paste(im, ((disp_w - im.width) // 2, (disp_h - im.height) // 2))
+    return im_b
+
+def bench_blur(args):
+    '''
+    Blurred edge fill cost per picture at several BLUR_AMOUNTs: full blur vs BlurEdges scaled down blur,
+    and BlurEdges when the background is cached
+    '''
+    import PicImage
+    display_size = tuple(int(d) for d in args.display.split('x'))
+    amounts = [float(amount) for amount in args.amounts.split(',')]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Portrait, so there are edges to fill on a landscape display
+        paths = make_jpegs(tmp_dir, args.images, args.width, args.height, (6, 8))
+        images = [(path, PicImage.load_image(path, display_size)[0]) for path in paths]
+        print('blur images=%s %sx%s -> %s' % (args.images, args.width, args.height, args.display))
+        print('   %8s %14s %14s %14s' % ('amount', 'full ms', 'BlurEdges ms', 'cached ms'))
+        for amount in amounts:
+            start_tm = time.perf_counter()
+            for __path, im in images:
+                full_blur(im, display_size, amount, 1.0, 0.5)
+            full_secs = (time.perf_counter() - start_tm) / len(images)
+            blur = PicImage.BlurEdges(amount)
+            start_tm = time.perf_counter()
+            for path, im in images:
+                blur.apply(im, display_size, path)
+            blur_secs = (time.perf_counter() - start_tm) / len(images)
+            start_tm = time.perf_counter()
+            for path, im in images:
+                blur.apply(im, display_size, path)
+            cached_secs = (time.perf_counter() - start_tm) / len(images)
+            print('   %8s %14.1f %14.1f %14.1f' % (amount, full_secs * 1000, blur_secs * 1000, cached_secs * 1000))
+
+def bench_resize(args):
+    '''
+    copy_files --resize throughput: pictures turned upright, scaled to the display and re-encoded, 1 process vs N
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    import PicExif
+    import PicSync
+    display_size = tuple(int(d) for d in args.display.split('x'))
+    processes = args.processes or os.cpu_count()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir = os.path.join(tmp_dir, 'src')
+        os.mkdir(src_dir)
+        paths = make_jpegs(src_dir, args.images, args.width, args.height)
+        src_bytes = sum(os.path.getsize(path) for path in paths)
+        print('resize images=%s %sx%s -> %s' % (args.images, args.width, args.height, args.display))
+        for process_cnt in sorted(set((1, processes))):
+            dst_dir = os.path.join(tmp_dir, 'dst%s' % process_cnt)
+            os.mkdir(dst_dir)
+            with ProcessPoolExecutor(max_workers=process_cnt) as pool:
+                list(pool.map(int, range(process_cnt))) # Start the workers before timing
+                start_tm = time.perf_counter()
+                futures = [pool.submit(PicSync.resize_copy, path, os.path.join(dst_dir, os.path.basename(path)),
+                    os.stat(path).st_mtime_ns, display_size) for path in paths]
+                for future in futures:
+                    future.result()
+                elapsed = time.perf_counter() - start_tm
+            dst_paths = [os.path.join(dst_dir, os.path.basename(path)) for path in paths]
+            dst_bytes = sum(os.path.getsize(path) for path in dst_paths)
+            print('   %2s processes %6.2f images/s %6.2f images/s/core   %5.1f MB -> %5.1f MB' % (process_cnt,
+                len(paths) / elapsed, len(paths) / elapsed / process_cnt, src_bytes / 1e6, dst_bytes / 1e6))
+        # The copies keep the date, are upright and keep the source mtime
+        for path, dst_path in zip(paths, dst_paths):
+            src_dt, __orientation = PicExif.read_exif(path)
+            assert PicExif.read_exif(dst_path) == (src_dt, 1)
+            assert os.stat(dst_path).st_mtime_ns == os.stat(path).st_mtime_ns
+
+def burst_hashes(count, burst_len, rand):
+    '''
+    Synthetic 64 bit perceptual hashes in bursts of burst_len, each a few bits from the first of its burst
+    '''
+    hashes = []
+    for i in range(count):
+        if i % burst_len == 0:
+            base = rand.getrandbits(64)
+        h = base
+        for bit in rand.sample(range(64), rand.randint(0, 4)):
+            h ^= 1 << bit
+        hashes.append(h)
+    return hashes
+
+def skewed_hashes(count, burst_len, rand):
+    '''
+    burst_hashes with one 16 bit chunk the same in every hash, as flat skies or dark frames give
+    '''
+    return [h & ~0xffff for h in burst_hashes(count, burst_len, rand)]
+
+def brute_cluster(hashes, max_dist):
+    '''
+    Near duplicate clusters by comparing every pair, O(n^2)
+    '''
+    import PicSimilar
+    parents = list(range(len(hashes)))
+    def root(pos):
+        while parents[pos] != pos:
+            pos = parents[pos]
+        return pos
+    for pos, h in enumerate(hashes):
+        for other_pos in range(pos):
+            if PicSimilar.hamming(h, hashes[other_pos]) <= max_dist:
+                parents[root(other_pos)] = root(pos)
+    clusters = {}
+    for pos in range(len(hashes)):
+        clusters.setdefault(root(pos), []).append(pos)
+    return [positions for positions in clusters.values() if len(positions) > 1]
+
+def bench_similar(args):
+    '''
+    Near duplicate clustering with the HashIndex vs comparing every pair, and the perceptual hash rate
+    '''
+    import PicSimilar
+    rand = random.Random(1)
+    print('similar hashes=%s max_dist=%s' % (args.hashes, PicSimilar.MAX_DIST))
+    hashes = burst_hashes(args.brute, 5, rand)
+    start_tm = time.perf_counter()
+    brute = brute_cluster(hashes, PicSimilar.MAX_DIST)
+    brute_tm = time.perf_counter() - start_tm
+    assert sorted(PicSimilar.cluster(hashes)) == sorted(brute)
+    hashes = burst_hashes(args.hashes, 5, rand)
+    start_tm = time.perf_counter()
+    clusters = PicSimilar.cluster(hashes)
+    index_tm = time.perf_counter() - start_tm
+    print('   all pairs  %8.2fs for %s, so about %.0fs for %s' % (brute_tm, args.brute,
+        brute_tm * (args.hashes / args.brute) ** 2, args.hashes))
+    print('   HashIndex  %8.2fs for %s   %s clusters' % (index_tm, args.hashes, len(clusters)))
+    # One chunk the same in every hash. Without the bucket cap every search would compare with every hash
+    hashes = skewed_hashes(args.hashes, 5, rand)
+    start_tm = time.perf_counter()
+    skewed_clusters = PicSimilar.cluster(hashes)
+    skewed_tm = time.perf_counter() - start_tm
+    print('   skewed     %8.2fs for %s   %s clusters' % (skewed_tm, args.hashes, len(skewed_clusters)))
+    groups = [pos // args.dir_files for pos in range(len(hashes))]
+    times = [pos * 10.0 for pos in range(len(hashes))]
+    start_tm = time.perf_counter()
+    dir_clusters = PicSimilar.cluster(hashes, groups=groups, times=times)
+    dir_tm = time.perf_counter() - start_tm
+    assert all(len(set(groups[pos] for pos in positions)) == 1 for positions in dir_clusters)
+    print('   by dir     %8.2fs for %s   %s clusters, largest %s' % (dir_tm, args.hashes, len(dir_clusters),
+        max(len(positions) for positions in dir_clusters) if dir_clusters else 0))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = make_jpegs(tmp_dir, args.images, 4000, 3000)
+        start_tm = time.perf_counter()
+        for path in paths:
+            PicSimilar.dhash(path)
+        hash_tm = time.perf_counter() - start_tm
+    print('   dHash      %8.1f ms/picture (4000x3000 JPEG)' % (hash_tm * 1000 / len(paths)))
+
+def bench_frames(args):
+    '''
+    Frames drawn by the render loop over a slideshow, redrawing every frame vs the FrameScheduler, run on a fake clock.
+    Also checks the fade alpha rises smoothly
+    '''
+    from FrameScheduler import FrameScheduler, FakeClock
+    clock = FakeClock()
+    scheduler = FrameScheduler(args.fps, clock=clock, sleep=clock.sleep, stats_secs=float('inf'))
+    slide_secs = args.delay + args.fade
+    fade_starts = [slide * slide_secs for slide in range(args.slides)]
+    end_tm = args.slides * slide_secs
+    max_step = 0.0
+    last_alpha = None
+    while clock() < end_tm:
+        if fade_starts and clock() >= fade_starts[0]:
+            fade_starts.pop(0)
+            scheduler.start_fade(args.fade)
+            last_alpha = None
+        frame_tm = scheduler.wait_frame()
+        alpha = scheduler.fade_alpha()
+        if last_alpha is not None and alpha > last_alpha:
+            max_step = max(max_step, alpha - last_alpha)
+        last_alpha = alpha
+        clock.sleep(args.draw_ms / 1000)
+        scheduler.frame_drawn(frame_tm, args.draw_ms / 1000)
+    summary = scheduler.stats.summary()
+    every_frame = int(end_tm * args.fps)
+    print('frames slides=%s delay=%ss fade=%ss fps=%s' % (args.slides, args.delay, args.fade, args.fps))
+    print('   every frame     %8s frames' % every_frame)
+    print('   FrameScheduler  %8s frames  %.1fx fewer   dropped %s' % (summary['frames'],
+        every_frame / summary['frames'], summary['dropped']))
+    print('   fade alpha max step %.3f (%.3f at %s fps)   old 5 Hz steps %.3f' % (max_step,
+        1.0 / (args.fade * args.fps), args.fps, 1.0 / (args.fade / 0.2)))
+
+def bench_textures(args):
+    '''
+    GPU textures over a long slideshow with the Slide TexturePool, on a fake GL backend.
+    Pictures of mixed sizes, with some next pictures replaced before being shown, as when a load is retried
+    '''
+    from PIL import Image
+    from TexturePool import TexturePool, FakeTextures
+    rand = random.Random(1)
+    sizes = [(1920, 1080), (1440, 1080), (810, 1080), (1920, 1280), (1624, 1080)]
+    images = [Image.new('RGBA', size) for size in sizes]
+    backend = FakeTextures()
+    pool = TexturePool(backend)
+    max_cnt = 0
+    max_bytes = 0
+    apply_secs = 0.0
+    for __slide in range(args.slides):
+        for __stage in range(2 if rand.random() < 0.05 else 1):
+            pool.stage(rand.choice(images))
+            if rand.random() < 0.5: # Uploaded ahead, by a frame drawn before the transition
+                start_tm = time.perf_counter()
+                pool.apply()
+                apply_secs += time.perf_counter() - start_tm
+        pool.rotate()
+        start_tm = time.perf_counter()
+        pool.apply()
+        apply_secs += time.perf_counter() - start_tm
+        max_cnt = max(max_cnt, len(backend.gpu))
+        max_bytes = max(max_bytes, sum(backend.gpu.values()))
+    print('textures slides=%s (%.1f days at 10s)' % (args.slides, args.slides * 10 / 86400))
+    print('   texture per picture %8s textures made' % args.slides)
+    print('   TexturePool         %8s textures made %8s uploads   max %s live %.1f MB   %.1f us/slide' % (pool.create_cnt,
+        pool.upload_cnt, max_cnt, max_bytes / 1e6, apply_secs / args.slides * 1e6))
+    pool.close()
+    print('   after close         %8s live' % len(backend.gpu))
+
+class ScriptedWait():
+    '''
+    A ShowControl wait on a FakeClock. Moves the time on to the timeout, sending the scripted (time, command) commands
+    passed on the way. Records when each action was sent
+    '''
+    def __init__(self, clock, script):
+        self.clock = clock
+        self.script = deque(script)
+        self.control = None
+        self.sent = deque() # (time sent, action)
+
+    def __call__(self, cond, secs):
+        if self.script and (secs is None or self.script[0][0] <= self.clock() + secs):
+            send_tm, line = self.script.popleft()
+            self.clock.now = max(self.clock(), send_tm)
+            self.control.command(line)
+            if line in ACTIONS:
+                self.sent.append((self.clock(), line))
+        elif secs is None:
+            raise RuntimeError('Paused with nothing left to send')
+        else:
+            self.clock.sleep(secs)
+
+def control_script(rand, count, delay, fade):
+    '''
+    count random commands at random times. Pauses are resumed by a later command, and the show ends with a quit
+    '''
+    script = []
+    send_tm = 0.0
+    for __c in range(count):
+        send_tm += rand.uniform(0.0, 3.0 * (delay + fade))
+        line = rand.choice(('next', 'next', 'prev', 'reload', 'pause', 'resume', 'delay %s' % rand.choice((5, 10, 30))))
+        script.append((send_tm, line))
+    script.append((send_tm + 1.0, 'resume'))
+    script.append((send_tm + 2.0, 'quit'))
+    return script
+
+def bench_control(args):
+    '''
+    How soon show commands take effect: the old process loop, which only looks between sleeps of the delay, vs the
+    ShowControl condition variable. Driven by a script of random commands on a fake clock, then timed for real through
+    the control socket
+    '''
+    from FrameScheduler import FakeClock
+    from ShowControl import ShowControl, ControlServer, send_command, NEXT, QUIT
+    rand = random.Random(1)
+    script = control_script(rand, args.commands, args.delay, args.fade)
+    clock = FakeClock()
+    waiter = ScriptedWait(clock, script)
+    control = ShowControl(args.delay, clock=clock, wait=waiter)
+    waiter.control = control
+    latencies = []
+    held_paused = 0
+    shown_cnt = 0
+    control.shown(args.fade)
+    while True:
+        action = control.wait_next()
+        if waiter.sent and waiter.sent[0][1] == action:
+            latencies.append(clock() - waiter.sent.popleft()[0])
+        elif action == NEXT and control.paused:
+            held_paused += 1 # Moved on by itself while paused
+        if action == QUIT:
+            break
+        shown_cnt += 1
+        control.shown(args.fade)
+    # The old loop slept for the delay after each fade, and only then looked at what had changed
+    slide_secs = args.delay + args.fade
+    old_latencies = [slide_secs - (send_tm % slide_secs) for send_tm, line in script]
+    frame_secs = 1.0 / args.fps
+    print('control commands=%s delay=%ss fade=%ss (%s pictures shown, %.1f hours)' % (len(script), args.delay,
+        args.fade, shown_cnt, clock() / 3600))
+    for name, values in (('sleep loop', old_latencies), ('ShowControl', latencies)):
+        values = sorted(values)
+        print('   %-12s latency p50 %8.3fs  max %8.3fs  within a frame %5.1f%%' % (name, values[len(values) // 2],
+            values[-1], 100.0 * sum(value <= frame_secs for value in values) / len(values)))
+    print('   moved on by itself while paused %s times' % held_paused)
+    if args.real > 0:
+        tmp_dir = tempfile.mkdtemp(prefix='bench_control_')
+        control = ShowControl(3600.0)
+        server = ControlServer(control, os.path.join(tmp_dir, 'control.sock'))
+        server.start()
+        taken = []
+        def show():
+            while True:
+                action = control.wait_next()
+                taken.append(time.perf_counter())
+                if action == QUIT:
+                    return
+        show_thread = Thread(target=show)
+        show_thread.start()
+        latencies = []
+        for command in range(args.real):
+            sent_cnt = len(taken)
+            start_tm = time.perf_counter()
+            send_command('quit' if command == args.real - 1 else 'next', server.path)
+            while len(taken) == sent_cnt:
+                time.sleep(0.0001)
+            latencies.append(taken[-1] - start_tm)
+        show_thread.join()
+        server.close()
+        os.rmdir(tmp_dir)
+        latencies.sort()
+        print('   socket to process thread, real clock: p50 %.2f ms  max %.2f ms  (%.0f ms frame)' % (
+            latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000, frame_secs * 1000))
+
+def bench_telemetry(args):
+    '''
+    Cost of a telemetry timer, disabled and enabled, and of the load timers on a display sized decode
+    '''
+    import PicImage
+    from Telemetry import telemetry, read_summaries, aggregate
+    print('telemetry calls=%s' % args.calls)
+    def time_calls():
+        start_tm = time.perf_counter()
+        for __i in range(args.calls):
+            with telemetry.timer('bench.secs'):
+                pass
+        return (time.perf_counter() - start_tm) / args.calls
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = make_jpegs(tmp_dir, args.images, 4000, 3000)
+        def time_loads():
+            start_tm = time.perf_counter()
+            for path in paths:
+                PicImage.load_image(path, (1920, 1080))
+            return (time.perf_counter() - start_tm) / len(paths)
+        time_loads() # Warm the page cache
+        disabled_tm = time_calls()
+        disabled_load_tm = time_loads()
+        telemetry_file = os.path.join(tmp_dir, 'telemetry.jsonl')
+        telemetry.enable(telemetry_file, interval_secs=3600)
+        enabled_tm = time_calls()
+        enabled_load_tm = time_loads()
+        telemetry.emit()
+        telemetry.disable()
+        metrics = aggregate(read_summaries([telemetry_file]))
+    print('   timer disabled %8.3f us/call' % (disabled_tm * 1e6))
+    print('   timer enabled  %8.3f us/call' % (enabled_tm * 1e6))
+    print('   load_image     %8.1f ms disabled %8.1f ms enabled' % (disabled_load_tm * 1000, enabled_load_tm * 1000))
+    for name in sorted(metrics):
+        if name.startswith('load.'):
+            count, total, p50, p95, max_value = metrics[name]
+            print('      %-22s count %5s p50 %10.4g p95 %10.4g max %10.4g' % (name, count, p50, p95, max_value))
+
+def bench_match(args):
+    '''
+    Files classified per second by the original regx loop and by PathMatcher, over synthetic file names
+    '''
+    suffixes = ['.jpg', '.JPG', '.jpeg', '.png', '.mov', '.mp4', '.txt', ' - Copy.jpg', '(1).jpg', '-2.jpg']
+    rand = random.Random(1)
+    names = ['IMG_%07d%s' % (i, rand.choice(suffixes)) for i in range(args.names)]
+    regxs = PLib.PATH_REGXS
+    start_tm = time.perf_counter()
+    legacy = [legacy_status(name, '', regxs['inc_files'], regxs['exc_files']) for name in names]
+    legacy_tm = time.perf_counter() - start_tm
+    start_tm = time.perf_counter()
+    matcher = PLib.PathMatcher(regxs['inc_files'], regxs['exc_files'])
+    matched = [matcher.status(name) for name in names]
+    matcher_tm = time.perf_counter() - start_tm
+    assert legacy == matched
+    print('match names=%s included=%s' % (len(names), matched.count(PLib.PathStatus.INCLUDE)))
+    print('   regx loop   %8.3fs %10.0f files/s' % (legacy_tm, len(names) / legacy_tm))
+    print('   PathMatcher %8.3fs %10.0f files/s   %.1fx' % (matcher_tm, len(names) / matcher_tm, legacy_tm / matcher_tm))
+
+def bench_playlist(args):
+    '''
+    Date range plus recent first selections by linear filter and sort vs the DateIndex, and a reshuffle by
+    list copy vs in place
+    '''
+    dir_cnt = max(1, args.files // 100)
+    __pic_dirs, pic_files = build_library(args.compact, dir_cnt, args.files // dir_cnt)
+    rand = random.Random(1)
+    start_dt = time.mktime((2000, 1, 1, 0, 0, 0, 0, 0, -1))
+    end_dt = time.mktime((2020, 1, 1, 0, 0, 0, 0, 0, -1))
+    for pic_file in pic_files:
+        pic_file.dt = rand.uniform(start_dt, end_dt)
+    ranges = []
+    for __i in range(args.queries):
+        date_from = rand.uniform(start_dt, end_dt)
+        ranges.append((date_from, rand.uniform(date_from, end_dt)))
+    recent_n = 10
+    print('playlist files=%s queries=%s %s' % (len(pic_files), args.queries, 'compact' if args.compact else 'objects'))
+    start_tm = time.perf_counter()
+    linear_cnts = []
+    for date_from, date_to in ranges:
+        selected = [pic_file for pic_file in pic_files if date_from <= pic_file.dt <= date_to]
+        selected.sort(key=lambda pic_file: pic_file.dt, reverse=True)
+        recent, rest = selected[:recent_n], selected[recent_n:]
+        linear_cnts.append(len(selected))
+    linear_tm = time.perf_counter() - start_tm
+    start_tm = time.perf_counter()
+    date_index = DateIndex(pic_files)
+    index_tm = time.perf_counter() - start_tm
+    start_tm = time.perf_counter()
+    index_cnts = [len(Playlist(date_index, date_from, date_to, recent_n)) for date_from, date_to in ranges]
+    query_tm = time.perf_counter() - start_tm
+    assert linear_cnts == index_cnts
+    print('   filter+sort %8.2f ms/query' % (linear_tm * 1000 / args.queries))
+    print('   DateIndex   %8.2f ms/query   build %.0f ms once' % (query_tm * 1000 / args.queries, index_tm * 1000))
+    pic_list = Playlist(date_index, recent_n=recent_n)
+    start_tm = time.perf_counter()
+    waiting = list(pic_files)
+    random.shuffle(waiting)
+    copy_tm = time.perf_counter() - start_tm
+    start_tm = time.perf_counter()
+    pic_list.reshuffle()
+    reshuffle_tm = time.perf_counter() - start_tm
+    print('   reshuffle   copy+shuffle %6.0f ms   in place %6.0f ms' % (copy_tm * 1000, reshuffle_tm * 1000))
+
+def bench_dirshuffle(args):
+    '''
+    Share of picks going to small event directories in a library with a few huge directories, flat shuffle vs
+    DirShuffle, plus the closest repeat, the cost of a pick, and loading the saved state after a restart
+    '''
+    from Playlist import DirShuffle
+    rand = random.Random(1)
+    pic_dirs, pic_files = build_library(False, args.events, args.event_files)
+    big_dirs, __big_files = build_library(False, args.big, args.files // args.big)
+    for pic_dir in big_dirs:
+        pic_dir.rel_dir_name = 'big/' + pic_dir.rel_dir_name
+    event_files = set(id(pic_file) for pic_file in pic_files)
+    pic_dirs.extend(big_dirs)
+    file_cnt = sum(pic_dir.file_cnt for pic_dir in pic_dirs)
+    print('dirshuffle files=%s big dirs=%s events=%s of %s files window=%s' % (file_cnt, args.big, args.events,
+        args.event_files, args.window))
+    def report(name, picks, pick_secs):
+        last_pick = {}
+        min_gap = None
+        for pick_num, pic_file in enumerate(picks):
+            if id(pic_file) in last_pick:
+                gap = pick_num - last_pick[id(pic_file)]
+                min_gap = gap if min_gap is None else min(min_gap, gap)
+            last_pick[id(pic_file)] = pick_num
+        event_share = sum(id(pic_file) in event_files for pic_file in picks) / len(picks)
+        print('   %-18s events %5.1f%% of picks   closest repeat %8s   %6.2f us/pick' % (name, event_share * 100,
+            min_gap, pick_secs / len(picks) * 1e6))
+    flat = [pic_file for pic_dir in pic_dirs for pic_file in pic_dir.pic_files]
+    start_tm = time.perf_counter()
+    picks = []
+    while len(picks) < args.picks:
+        rand.shuffle(flat)
+        picks.extend(flat[:args.picks - len(picks)])
+    report('flat shuffle', picks, time.perf_counter() - start_tm)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_file = os.path.join(tmp_dir, 'state.db')
+        for size_power in (1.0, 0.5, 0.0):
+            start_tm = time.perf_counter()
+            dir_shuffle = DirShuffle(pic_dirs, size_power=size_power, window=args.window)
+            build_secs = time.perf_counter() - start_tm
+            start_tm = time.perf_counter()
+            picks = [dir_shuffle.pick() for __pick in range(args.picks)]
+            report('DirShuffle %.1f' % size_power, picks, time.perf_counter() - start_tm)
+        print('   build %.0f ms' % (build_secs * 1000))
+        dir_shuffle = DirShuffle(pic_dirs, window=args.window, state_file=state_file)
+        start_tm = time.perf_counter()
+        for __pick in range(args.saved):
+            dir_shuffle.pick()
+        dir_shuffle.close()
+        save_secs = (time.perf_counter() - start_tm) / args.saved
+        start_tm = time.perf_counter()
+        restarted = DirShuffle(pic_dirs, window=args.window, state_file=state_file)
+        print('   saved state      %6.2f ms/pick   restart with %s shown in %.0f ms' % (save_secs * 1000,
+            sum(restarted.shown) + len(restarted.window), (time.perf_counter() - start_tm) * 1000))
+
+def make_photo_tree(root, dir_cnt, file_cnt, depth, width, height, orientations=(1, 3, 6, 8)):
+    '''
+    Build a synthetic photo library like make_tree(), but of real JPEGs with EXIF orientations and dates.
+    One JPEG is encoded per orientation and copied, so a big tree is quick to make. Returns the number of files
+    '''
+    import shutil
+    templates = make_jpegs(root, len(orientations), width, height, orientations)
+    file_total = 0
+    def fill(dir_path, level):
+        nonlocal file_total
+        for i in range(file_cnt):
+            shutil.copyfile(templates[i % len(templates)], os.path.join(dir_path, 'IMG_%05d.jpg' % i))
+            file_total += 1
+        if level < depth:
+            for d in range(dir_cnt):
+                sub_dir = os.path.join(dir_path, '%04d-%02d-01 Event %s' % (2000 + d, level + 1, d))
+                os.mkdir(sub_dir)
+                fill(sub_dir, level + 1)
+    fill(root, 0)
+    for template in templates:
+        os.remove(template)
+    return file_total
+
+def stub_pi3d():
+    '''
+    Install a stand in pi3d module, so Slide can be imported and run without a display or GL.
+    Texture only makes the copy of the pixels the real one makes before the GL upload
+    '''
+    import types
+    pi3d = types.ModuleType('pi3d')
+    class Texture():
+        def __init__(self, im, **kwargs):
+            self.ix, self.iy = im.size
+            self.image = im.tobytes()
+    class Shader():
+        def __init__(self, path):
+            self.path = path
+    class Sprite():
+        def __init__(self, camera=None, w=1.0, h=1.0, z=0.0):
+            self.unif = [0.0] * 60
+        def set_shader(self, shader):
+            self.shader = shader
+        def set_textures(self, textures):
+            self.textures = textures
+        def draw(self, *args, **kwargs):
+            pass
+    pi3d.Texture = Texture
+    pi3d.Shader = Shader
+    pi3d.Sprite = Sprite
+    sys.modules['pi3d'] = pi3d
+
+class StubDisplay():
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+def suite_scan(args, src_dir, tmp_dir):
+    '''
+    Library scan time and memory, objects vs compact, cold vs warm index
+    '''
+    results = {}
+    for compact in (False, True):
+        name = 'compact' if compact else 'objects'
+        index_file = os.path.join(tmp_dir, 'index_%s.db' % name)
+        for index_state in ('cold', 'warm'):
+            gc.collect()
+            tracemalloc.start()
+            pic_lib = PLib.PicLibrary(src_dir, index_file=index_file, compact=compact, exif_threads=args.exif_threads)
+            start_tm = time.perf_counter()
+            pic_lib.get_file_list(shuffle=False)
+            scan_secs = time.perf_counter() - start_tm
+            size, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results['%s_%s_secs' % (name, index_state)] = round(scan_secs, 4)
+            results['%s_%s_files_per_sec' % (name, index_state)] = round(pic_lib.file_cnt / scan_secs, 1)
+        results['%s_mb' % name] = round(size / 1e6, 3)
+        results['%s_peak_mb' % name] = round(peak / 1e6, 3)
+        results['files'] = pic_lib.file_cnt
+        del pic_lib
+    return results
+
+def suite_load(args, src_dir, display_size):
+    '''
+    Pic.load_tex, with the GL upload stubbed out: full size vs display sized decode, and the phases of the latter
+    '''
+    from Telemetry import telemetry, read_summaries, aggregate
+    import Slide
+    pic_lib = PLib.PicLibrary(src_dir)
+    pic_lib.get_file_list(shuffle=False)
+    paths = [os.path.join(src_dir, pic_file.pic_dir.rel_dir_name, pic_file.file_name)
+        for pic_file in pic_lib.pic_files[:args.loads]]
+    results = {'loads': len(paths)}
+    for name, size in (('full', None), ('display', display_size)):
+        load_secs = []
+        for path in paths:
+            start_tm = time.perf_counter()
+            pic = Slide.Pic(path, display_size=size)
+            load_secs.append(time.perf_counter() - start_tm)
+            assert pic.tex is not None
+        load_secs.sort()
+        results['%s_ms_p50' % name] = round(load_secs[len(load_secs) // 2] * 1000, 2)
+        results['%s_ms_max' % name] = round(load_secs[-1] * 1000, 2)
+    with tempfile.TemporaryDirectory() as telemetry_dir:
+        telemetry_file = os.path.join(telemetry_dir, 'telemetry.jsonl')
+        telemetry.enable(telemetry_file, interval_secs=3600)
+        for path in paths:
+            Slide.Pic(path, display_size=display_size)
+        telemetry.emit()
+        telemetry.disable()
+        for metric_name, (__count, __total, p50, __p95, __max) in aggregate(read_summaries([telemetry_file])).items():
+            if metric_name.startswith('load.') and metric_name.endswith('.secs'):
+                results['display_%s_ms_p50' % metric_name[len('load.'):-len('.secs')]] = round(p50 * 1000, 2)
+    return results
+
+def suite_slides(args, src_dir, display_size):
+    '''
+    End to end: time from the start of a scan until the first slide is ready to show, then the wait for each
+    following slide after a hold, loading in the slide loader thread vs prefetched in worker processes
+    '''
+    import Slide
+    results = {}
+    for name, prefetch_depth in (('loader', 0), ('prefetch', 3)):
+        start_tm = time.perf_counter()
+        pic_lib = PLib.PicLibrary(src_dir)
+        pic_lib.update(shuffle=True)
+        piclist = pic_lib.playlist(True)
+        slide = Slide.Slide(StubDisplay(*display_size), None, 'shader', 0.5, prefetch_depth=prefetch_depth)
+        slide.load_next_image(src_dir, piclist)
+        results['%s_first_slide_secs' % name] = round(time.perf_counter() - start_tm, 4)
+        waits = []
+        for __slide in range(args.slides):
+            slide.start_load_next_image(src_dir, piclist)
+            time.sleep(args.hold)
+            wait_start = time.perf_counter()
+            slide.load_thread.join()
+            waits.append(time.perf_counter() - wait_start)
+            if slide.next_pic is None:
+                break
+        if slide.prefetcher is not None:
+            slide.prefetcher.close()
+        waits.sort()
+        results['%s_wait_ms_p50' % name] = round(waits[len(waits) // 2] * 1000, 2)
+        results['%s_wait_ms_max' % name] = round(waits[-1] * 1000, 2)
+    return results
+
+def suite_startup(args, src_dir, tmp_dir, display_size):
+    '''
+    Time from the frame starting until its first picture is ready to show: scanning with a cold then warm library index,
+    vs resuming a ShowCheckpoint. Also checks the resumed playlist carries on with the rest of the saved pass in order
+    '''
+    import Slide
+    from ShowCheckpoint import ShowCheckpoint
+    def rel_path(pic):
+        return os.path.join(pic.rel_dir_name, pic.fname)
+    def new_slide():
+        return Slide.Slide(StubDisplay(*display_size), None, 'shader', 0.5, keep_next_image=True)
+    results = {}
+    index_file = os.path.join(tmp_dir, 'startup_index.db')
+    image_file = os.path.join(tmp_dir, 'checkpoint.jpg')
+    for index_state in ('cold', 'warm'):
+        start_tm = time.perf_counter()
+        pic_lib = PLib.PicLibrary(src_dir, index_file=index_file)
+        slide = new_slide()
+        pic_lib.update(shuffle=True)
+        piclist = pic_lib.playlist(True, repeat=True)
+        slide.load_next_image(src_dir, piclist)
+        results['%s_index_first_slide_secs' % index_state] = round(time.perf_counter() - start_tm, 4)
+        pic_lib.update_thread.join()
+    # Carry on with the show, checkpointing every slide
+    checkpoint = ShowCheckpoint(index_file, image_file, checkpoint_secs=0.0)
+    save_secs = []
+    for __slide in range(args.slides):
+        slide.transition_to_next(wait=False)
+        slide.load_next_image(src_dir, piclist)
+        start_tm = time.perf_counter()
+        checkpoint.start_save(slide.next_pic, pic_lib.play_cnt, pic_lib.play_files).join()
+        save_secs.append(time.perf_counter() - start_tm)
+    expected = [rel_path(slide.next_pic)]
+    expected.extend(os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name) for pic_file in
+        (next(piclist) for __slide in range(args.slides)))
+    start_tm = time.perf_counter()
+    resume = ShowCheckpoint(index_file, image_file).load(src_dir)
+    pic_lib = PLib.PicLibrary(src_dir, index_file=index_file)
+    slide = new_slide()
+    slide.load_decoded(os.path.join(src_dir, resume.rel_dir_name, resume.fname), resume.rel_dir_name, resume.fname,
+        (resume.im, resume.dt, resume.orientation))
+    results['checkpoint_first_slide_secs'] = round(time.perf_counter() - start_tm, 4)
+    pic_lib.update(shuffle=True)
+    piclist = pic_lib.playlist(True, repeat=True, resume=resume.rel_paths)
+    resumed = [rel_path(slide.next_pic)]
+    resumed.extend(os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name) for pic_file in
+        (next(piclist) for __slide in range(args.slides)))
+    pic_lib.update_thread.join()
+    save_secs.sort()
+    results['checkpoint_save_ms_p50'] = round(save_secs[len(save_secs) // 2] * 1000, 2)
+    # Only the rest of the saved pass has a set order. The passes after it are shuffled afresh
+    compare_cnt = min(len(expected), 1 + len(resume.rel_paths))
+    out_of_order = sum(rel_path != expected_path for rel_path, expected_path in zip(resumed[:compare_cnt], expected))
+    assert out_of_order == 0, 'Resumed %s out of order: %s vs %s' % (out_of_order, resumed[:compare_cnt], expected[:compare_cnt])
+    results['checkpoint_resume_out_of_order'] = out_of_order
+    return results
+
+def bench_startup(args):
+    '''
+    Time to the first picture after a restart, on a synthetic photo tree: a library scan vs a ShowCheckpoint
+    '''
+    stub_pi3d()
+    display_size = tuple(int(d) for d in args.display.split('x'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir = os.path.join(tmp_dir, 'Pictures')
+        os.mkdir(src_dir)
+        file_cnt = make_photo_tree(src_dir, args.dirs, args.files, args.depth, args.width, args.height)
+        results = suite_startup(args, src_dir, tmp_dir, display_size)
+    print('startup files=%s %sx%s -> %s' % (file_cnt, args.width, args.height, args.display))
+    for key, value in results.items():
+        print('   %-32s %12s' % (key, value))
+
+def reorg_library(tmp_dir, name, args, reorg):
+    '''
+    Build, index and copy a synthetic library, reorganise it with reorg(src_dir, dst_dir, index_file), then rescan
+    and sync it again. Returns (reorg secs, rescan secs, index hits, index misses, files copied again)
+    '''
+    from PicSync import PicSync
+    src_dir = os.path.join(tmp_dir, name, 'Pictures')
+    dst_dir = os.path.join(tmp_dir, name, 'Copy')
+    index_file = os.path.join(tmp_dir, name, 'pic_index.db')
+    os.makedirs(src_dir)
+    make_tree(src_dir, args.dirs, args.files, args.depth)
+    __tm, pic_lib = time_scan(src_dir, index_file)
+    pic_lib.save_index()
+    PicSync(src_dir, dst_dir).run(pic_lib)
+    start_tm = time.perf_counter()
+    reorg(src_dir, dst_dir, index_file)
+    reorg_tm = time.perf_counter() - start_tm
+    rescan_tm, pic_lib = time_scan(src_dir, index_file)
+    recopy_cnt = PicSync(src_dir, dst_dir).run(pic_lib)
+    return reorg_tm, rescan_tm, pic_lib.index.hit_cnt, pic_lib.index.miss_cnt, recopy_cnt
+
+def bench_reorg(args):
+    '''
+    Reorganising a library with fix_dirs, vs renaming the directories alone: the rescan and copy_files sync after.
+    Every top level directory is renamed, and every --rm'th deleted
+    '''
+    import shutil
+    import fix_dirs
+    top_dirs = ['%04d-%02d-01 Event %s' % (2000 + d, 1, d) for d in range(args.dirs)]
+    moves = [(top_dir, 'Events/' + top_dir) for d, top_dir in enumerate(top_dirs) if d % args.rm]
+    removes = [top_dir for d, top_dir in enumerate(top_dirs) if not d % args.rm]
+
+    def rename_only(src_dir, dst_dir, index_file):
+        for src, dst in moves:
+            os.makedirs(os.path.dirname(os.path.join(src_dir, dst)), exist_ok=True)
+            os.rename(os.path.join(src_dir, src), os.path.join(src_dir, dst))
+        for rel_path in removes:
+            shutil.rmtree(os.path.join(src_dir, rel_path))
+
+    def fix(src_dir, dst_dir, index_file):
+        steps, problems = fix_dirs.make_plan(moves, removes)
+        problems.extend(fix_dirs.check_plan(steps, src_dir)[1])
+        problems.extend(fix_dirs.check_plan(steps, dst_dir, copy=True)[1])
+        assert not problems, problems
+        journal = fix_dirs.Journal(os.path.join(os.path.dirname(src_dir), 'journal.db'))
+        journal.start('bench', steps)
+        assert fix_dirs.apply_plan(journal, journal.load()[1], [src_dir, dst_dir],
+            [index_file, os.path.join(dst_dir, fix_dirs.MANIFEST_NAME)])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = [('rename only', reorg_library(tmp_dir, 'rename', args, rename_only)),
+                   ('fix_dirs', reorg_library(tmp_dir, 'fix', args, fix))]
+    print('reorg renames=%s deletes=%s' % (len(moves), len(removes)))
+    print('   %-12s %8s %8s %8s %8s %8s' % ('', 'reorg', 'rescan', 'hits', 'misses', 'copied'))
+    for name, (reorg_tm, rescan_tm, hit_cnt, miss_cnt, recopy_cnt) in results:
+        print('   %-12s %7.3fs %7.3fs %8s %8s %8s' % (name, reorg_tm, rescan_tm, hit_cnt, miss_cnt, recopy_cnt))
+
+def git_version():
+    import subprocess
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_suite(args):
+    '''
+    The load pipeline on a synthetic photo tree, without a display: scan time and memory, picture load time,
+    and time until the next slide is ready. Results are printed and, with --json, saved for bench_compare()
+    '''
+    import json
+    import platform
+    stub_pi3d()
+    display_size = tuple(int(d) for d in args.display.split('x'))
+    orientations = tuple(int(o) for o in args.orientations.split(','))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir = os.path.join(tmp_dir, 'Pictures')
+        os.mkdir(src_dir)
+        start_tm = time.perf_counter()
+        file_cnt = make_photo_tree(src_dir, args.dirs, args.files, args.depth, args.width, args.height, orientations)
+        log.info('Made %s JPEGs in %.1fs' % (file_cnt, time.perf_counter() - start_tm))
+        report = {
+            'version': git_version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'args': dict((key, value) for key, value in vars(args).items() if key not in ('func', 'json')),
+            'results': {
+                'scan': suite_scan(args, src_dir, tmp_dir),
+                'load': suite_load(args, src_dir, display_size),
+                'slides': suite_slides(args, src_dir, display_size),
+                'startup': suite_startup(args, src_dir, tmp_dir, display_size),
+            },
+        }
+    print('suite version=%s files=%s %sx%s -> %s' % (report['version'], file_cnt, args.width, args.height, args.display))
+    for group, results in report['results'].items():
+        for key, value in results.items():
+            print('   %-8s %-32s %12s' % (group, key, value))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+def bench_compare(args):
+    '''
+    Compare two --json suite reports. Times and sizes going up by more than --threshold, or rates going down,
+    are flagged as regressions
+    '''
+    import json
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print('compare %s (%s) -> %s (%s)' % (args.old, old['version'], args.new, new['version']))
+    regression_cnt = 0
+    for group, new_results in sorted(new['results'].items()):
+        old_results = old['results'].get(group, {})
+        for key, new_value in sorted(new_results.items()):
+            old_value = old_results.get(key)
+            if not isinstance(new_value, (int, float)) or not isinstance(old_value, (int, float)) or old_value == 0:
+                continue
+            ratio = new_value / old_value
+            higher_better = key.endswith('_per_sec')
+            worse = ratio < 1.0 - args.threshold if higher_better else ratio > 1.0 + args.threshold
+            regression_cnt += worse
+            print('   %-8s %-32s %12s %12s %6.2fx %s' % (group, key, old_value, new_value, ratio, 'REGRESSION' if worse else ''))
+    print('%s regressions' % regression_cnt)
+    if regression_cnt:
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Picture frame benchmarks')
+    sub_parsers = parser.add_subparsers(dest='bench')
+    scan_parser = sub_parsers.add_parser('scan', help='PicLibrary cold vs warm directory scan')
+    scan_parser.add_argument('--src', help='Existing picture directory to scan instead of a synthetic tree')
+    scan_parser.add_argument('--dirs', type=int, default=8, help='Sub directories per level')
+    scan_parser.add_argument('--files', type=int, default=50, help='Files per directory')
+    scan_parser.add_argument('--depth', type=int, default=3, help='Directory levels')
+    scan_parser.add_argument('--threads', type=int, default=8, help='Parallel scanner threads')
+    scan_parser.set_defaults(func=bench_scan)
+    memory_parser = sub_parsers.add_parser('memory', help='Library memory use, objects vs compact arrays')
+    memory_parser.add_argument('--dirs', type=int, default=3000, help='Directories')
+    memory_parser.add_argument('--files', type=int, default=150000, help='Total files')
+    memory_parser.set_defaults(func=bench_memory)
+    watch_parser = sub_parsers.add_parser('watch', help='Latency of new files reaching a watched playlist')
+    watch_parser.add_argument('--dirs', type=int, default=8, help='Sub directories per level')
+    watch_parser.add_argument('--files', type=int, default=50, help='Files per directory')
+    watch_parser.add_argument('--depth', type=int, default=2, help='Directory levels')
+    watch_parser.add_argument('--new', type=int, default=20, help='New files to add')
+    watch_parser.add_argument('--poll', type=float, default=0.0, help='Use a PollWatcher checking every POLL seconds')
+    watch_parser.add_argument('--timeout', type=float, default=30.0, help='Give up if the new files take longer than this')
+    watch_parser.set_defaults(func=bench_watch)
+    decode_parser = sub_parsers.add_parser('decode', help='Picture decode, full size vs scaled to the display')
+    decode_parser.add_argument('--src', help='Directory of sample pictures instead of synthetic JPEGs')
+    decode_parser.add_argument('--images', type=int, default=8, help='Pictures to decode')
+    decode_parser.add_argument('--width', type=int, default=6000, help='Synthetic JPEG width')
+    decode_parser.add_argument('--height', type=int, default=4000, help='Synthetic JPEG height')
+    decode_parser.add_argument('--display', default='1920x1080', help='Display size WxH')
+    decode_parser.add_argument('--fill', action='store_true', help='Pictures fill the display rather than fit it')
+    decode_parser.set_defaults(func=bench_decode)
+    exif_parser = sub_parsers.add_parser('exif', help='EXIF header read rate')
+    exif_parser.add_argument('--images', type=int, default=100, help='Synthetic JPEGs to read')
+    exif_parser.set_defaults(func=bench_exif)
+    stream_parser = sub_parsers.add_parser('stream', help='Time to the first playlist file while the library scans')
+    stream_parser.add_argument('--src', help='Existing picture directory to scan instead of a synthetic tree')
+    stream_parser.add_argument('--dirs', type=int, default=8, help='Sub directories per level')
+    stream_parser.add_argument('--files', type=int, default=50, help='Files per directory')
+    stream_parser.add_argument('--depth', type=int, default=3, help='Directory levels')
+    stream_parser.add_argument('--threads', type=int, default=0, help='Parallel scanner threads')
+    stream_parser.set_defaults(func=bench_stream)
+    playlist_parser = sub_parsers.add_parser('playlist', help='Date range and recent first playlist selection')
+    playlist_parser.add_argument('--files', type=int, default=150000, help='Files in the library')
+    playlist_parser.add_argument('--queries', type=int, default=50, help='Random date ranges to select')
+    playlist_parser.add_argument('--compact', action='store_true', help='Hold the library in compact arrays')
+    playlist_parser.set_defaults(func=bench_playlist)
+    blur_parser = sub_parsers.add_parser('blur', help='Blurred edge fill cost at several blur amounts')
+    blur_parser.add_argument('--images', type=int, default=6, help='Pictures to fill')
+    blur_parser.add_argument('--width', type=int, default=4000, help='JPEG width')
+    blur_parser.add_argument('--height', type=int, default=3000, help='JPEG height')
+    blur_parser.add_argument('--display', default='1920x1080', help='Display size WxH')
+    blur_parser.add_argument('--amounts', default='4,12,24,48', help='BLUR_AMOUNTs to time')
+    blur_parser.set_defaults(func=bench_blur)
+    dirshuffle_parser = sub_parsers.add_parser('dirshuffle', help='Weighted shuffle by directory vs flat shuffle')
+    dirshuffle_parser.add_argument('--files', type=int, default=100000, help='Files in the big directories')
+    dirshuffle_parser.add_argument('--big', type=int, default=5, help='Big directories')
+    dirshuffle_parser.add_argument('--events', type=int, default=500, help='Small event directories')
+    dirshuffle_parser.add_argument('--event-files', type=int, default=20, help='Files in each event directory')
+    dirshuffle_parser.add_argument('--window', type=int, default=500, help='Picks before a file can show again')
+    dirshuffle_parser.add_argument('--picks', type=int, default=100000, help='Picks to time')
+    dirshuffle_parser.add_argument('--saved', type=int, default=200, help='Picks with the state saved')
+    dirshuffle_parser.set_defaults(func=bench_dirshuffle)
+    resize_parser = sub_parsers.add_parser('resize', help='copy_files --resize throughput per core')
+    resize_parser.add_argument('--images', type=int, default=16, help='Synthetic JPEGs to resize')
+    resize_parser.add_argument('--width', type=int, default=6000, help='Synthetic JPEG width')
+    resize_parser.add_argument('--height', type=int, default=4000, help='Synthetic JPEG height')
+    resize_parser.add_argument('--display', default='1920x1080', help='Display size WxH')
+    resize_parser.add_argument('--processes', type=int, default=0, help='Resize processes. 0 for one per core')
+    resize_parser.set_defaults(func=bench_resize)
+    similar_parser = sub_parsers.add_parser('similar', help='Near duplicate clustering and perceptual hash rate')
+    similar_parser.add_argument('--hashes', type=int, default=100000, help='Synthetic hashes to cluster')
+    similar_parser.add_argument('--brute', type=int, default=3000, help='Hashes to cluster by comparing every pair')
+    similar_parser.add_argument('--images', type=int, default=8, help='Synthetic JPEGs to hash')
+    similar_parser.add_argument('--dir-files', type=int, default=500, help='Hashes per directory, clustering by directory')
+    similar_parser.set_defaults(func=bench_similar)
+    frames_parser = sub_parsers.add_parser('frames', help='Render loop frames drawn and fade smoothness, on a fake clock')
+    frames_parser.add_argument('--slides', type=int, default=10, help='Pictures shown')
+    frames_parser.add_argument('--delay', type=float, default=10.0, help='Seconds each picture is held')
+    frames_parser.add_argument('--fade', type=float, default=3.0, help='Fade seconds')
+    frames_parser.add_argument('--fps', type=int, default=20, help='Full frame rate')
+    frames_parser.add_argument('--draw-ms', type=float, default=5.0, help='Simulated draw time per frame')
+    frames_parser.set_defaults(func=bench_frames)
+    textures_parser = sub_parsers.add_parser('textures', help='GPU textures over a long slideshow, on a fake GL backend')
+    textures_parser.add_argument('--slides', type=int, default=60480, help='Pictures shown')
+    textures_parser.set_defaults(func=bench_textures)
+    control_parser = sub_parsers.add_parser('control', help='How soon pause, next, prev etc take effect, on a fake clock')
+    control_parser.add_argument('--commands', type=int, default=2000, help='Random commands sent')
+    control_parser.add_argument('--delay', type=float, default=10.0, help='Seconds each picture is held')
+    control_parser.add_argument('--fade', type=float, default=3.0, help='Fade seconds')
+    control_parser.add_argument('--fps', type=int, default=20, help='Full frame rate')
+    control_parser.add_argument('--real', type=int, default=200, help='Commands sent through a control socket for real. 0 for none')
+    control_parser.set_defaults(func=bench_control)
+    telemetry_parser = sub_parsers.add_parser('telemetry', help='Telemetry timer overhead')
+    telemetry_parser.add_argument('--calls', type=int, default=1000000, help='Timer calls')
+    telemetry_parser.add_argument('--images', type=int, default=4, help='Synthetic JPEGs to load')
+    telemetry_parser.set_defaults(func=bench_telemetry)
+    suite_parser = sub_parsers.add_parser('suite', help='Scan, load and next slide times on a synthetic photo tree')
+    suite_parser.add_argument('--dirs', type=int, default=4, help='Sub directories per level')
+    suite_parser.add_argument('--files', type=int, default=10, help='JPEGs per directory')
+    suite_parser.add_argument('--depth', type=int, default=2, help='Directory levels')
+    suite_parser.add_argument('--width', type=int, default=4000, help='JPEG width')
+    suite_parser.add_argument('--height', type=int, default=3000, help='JPEG height')
+    suite_parser.add_argument('--orientations', default='1,3,6,8', help='EXIF orientations to cycle through')
+    suite_parser.add_argument('--display', default='1920x1080', help='Display size WxH')
+    suite_parser.add_argument('--exif-threads', type=int, default=4, help='PicLibrary EXIF threads while scanning')
+    suite_parser.add_argument('--loads', type=int, default=8, help='Pictures to load')
+    suite_parser.add_argument('--slides', type=int, default=8, help='Slides to time after the first')
+    suite_parser.add_argument('--hold', type=float, default=0.5, help='Seconds each slide is held before the next is needed')
+    suite_parser.add_argument('--json', help='Save the results to this file')
+    suite_parser.set_defaults(func=bench_suite)
+    startup_parser = sub_parsers.add_parser('startup', help='Time to the first picture after a restart, scan vs checkpoint')
+    startup_parser.add_argument('--dirs', type=int, default=4, help='Sub directories per level')
+    startup_parser.add_argument('--files', type=int, default=10, help='JPEGs per directory')
+    startup_parser.add_argument('--depth', type=int, default=2, help='Directory levels')
+    startup_parser.add_argument('--width', type=int, default=4000, help='JPEG width')
+    startup_parser.add_argument('--height', type=int, default=3000, help='JPEG height')
+    startup_parser.add_argument('--display', default='1920x1080', help='Display size WxH')
+    startup_parser.add_argument('--slides', type=int, default=8, help='Slides shown and checkpointed before the restart')
+    startup_parser.set_defaults(func=bench_startup)
+    reorg_parser = sub_parsers.add_parser('reorg', help='Rescan and copy_files sync after reorganising with fix_dirs vs plain renames')
+    reorg_parser.add_argument('--dirs', type=int, default=10, help='Sub directories per level')
+    reorg_parser.add_argument('--files', type=int, default=20, help='Files per directory')
+    reorg_parser.add_argument('--depth', type=int, default=3, help='Directory levels')
+    reorg_parser.add_argument('--rm', type=int, default=5, help='Delete every Nth top level directory, rename the rest')
+    reorg_parser.set_defaults(func=bench_reorg)
+    compare_parser = sub_parsers.add_parser('compare', help='Compare two suite --json results')
+    compare_parser.add_argument('old', help='Baseline results')
+    compare_parser.add_argument('new', help='New results')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='Change counted as a regression')
+    compare_parser.set_defaults(func=bench_compare)
+    match_parser = sub_parsers.add_parser('match', help='Include/exclude file name classification rate')
+    match_parser.add_argument('--names', type=int, default=1000000, help='Synthetic file names to classify')
+    match_parser.set_defaults(func=bench_match)
+    args = parser.parse_args()
+    if args.bench is None:
+        parser.print_help()
+        sys.exit(1)
+    args.func(args)
+
+if __name__ == "__main__":
+    # setup logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
+        level=logging.WARNING
+        )
+    prog_name = Path(__file__).stem
+    log = logging.getLogger(name=prog_name)
+    main()
@@ -1,15 +1,20 @@
 #!/usr/bin/python3
 import logging
 import logging.config
-import PicLibrary as pl
 import os
-from shutil import copyfile
+import argparse
+import PicLibrary as pl
+from PicSync import PicSync, ResizeCopy
 from pathlib import Path
 
 log = logging.getLogger(__name__)
 
 SRC_DIR = '/media/links/SAMSUNG/Pictures'
 DST_DIR = '/media/links/rootfs/home/pi/Pictures'
+SCAN_THREADS = 8 # directories listed at once when scanning SRC_DIR
+SRC_INDEX_FILE = os.path.join(os.path.abspath(os.path.dirname(os.path.realpath(__file__))), 'copy_files_index.db') # listing cache for SRC_DIR, so only changed directories are re-read. Next to this script, where fix_dirs.py looks for it
+COPY_THREADS = 4
+DISPLAY_SIZE = '1920x1080' # the frame's screen, for --resize
 
 PATH_REGXS = {
     'inc_dirs': [
@@ -37,25 +42,55 @@ PATH_REGXS = {
     ],
 }
 
+def dup_report(pic_lib):
+    dup_bytes = 0
+    for group in pic_lib.dup_groups:
+        for pos, pic_file in enumerate(group):
+            rel_path = os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name)
+            log.info('%s %s' % ('KEEP' if pos == 0 else 'DUP ', rel_path))
+            if pos > 0:
+                dup_bytes += os.path.getsize(os.path.join(pic_lib.src_dir, rel_path))
+    log.info('Duplicated Files: %s   Copies: %s   %.0f MB' % (len(pic_lib.dup_groups), len(pic_lib.duplicates), dup_bytes / 1e6))
+
 def main():
+    parser = argparse.ArgumentParser(description='Copy new and changed pictures from SRC_DIR to DST_DIR')
+    parser.add_argument('--hash', action='store_true', help='Compare content hashes, not just size and mtime')
+    parser.add_argument('--delete', action='store_true', help='Delete copies of files removed from, or now excluded in, SRC_DIR')
+    parser.add_argument('--threads', type=int, default=COPY_THREADS, help='Files copied at once')
+    parser.add_argument('--resize', action='store_true', help='Copy pictures upright and scaled down to the display')
+    parser.add_argument('--display', default=DISPLAY_SIZE, help='Display size WxH to --resize to')
+    parser.add_argument('--fill', action='store_true', help='--resize so pictures fill the display, rather than fit it')
+    parser.add_argument('--processes', type=int, default=None, help='--resize processes. Default one per core')
+    parser.add_argument('--skip-dups', action='store_true', help='Only copy one of each set of files with the same content, rather than excluding copies by name')
+    parser.add_argument('--dup-report', action='store_true', help='List the files with the same content, then stop')
+    parser.add_argument('--dry-run', action='store_true', help='Log what would be copied and deleted, but do nothing')
+    args = parser.parse_args()
     prog_name = Path(__file__).stem
     logging.config.fileConfig(prog_name+'.ini', disable_existing_loggers=False)
     log.info('Start')
-    pic_lib = pl.PicLibrary(SRC_DIR, PATH_REGXS)
+    dedup_threads = COPY_THREADS if args.skip_dups or args.dup_report else 0
+    pic_lib = pl.PicLibrary(SRC_DIR, PATH_REGXS, index_file=SRC_INDEX_FILE, scan_threads=SCAN_THREADS,
+        dedup_threads=dedup_threads)
+    pic_lib.get_file_list(shuffle=False)
     log.info('Total Dirs: %s   Total Files: %s' % (pic_lib.dir_cnt, pic_lib.file_cnt))
-    for pic_dir in pic_lib.pic_dirs:
-        dst_dir = os.path.join(DST_DIR, pic_dir.rel_dir_name)
-        if not os.path.isdir(dst_dir):
-            log.info('mkdir: %s' % dst_dir)
-            os.makedirs(dst_dir)
-    for pic_file in pic_lib.pic_files:
-        src_file = os.path.join(pic_lib.src_dir, pic_file.pic_dir.rel_dir_name, pic_file.file_name)
-        dst_file = os.path.join(DST_DIR, pic_file.pic_dir.rel_dir_name, pic_file.file_name)
-        if os.path.exists(dst_file):
-            log.warning('File Exists: %s' % dst_file)
-            continue
-        log.info('CP %-120s %-120s' % (src_file, dst_file))
-        copyfile(src_file, dst_file)
+    if args.dup_report:
+        dup_report(pic_lib)
+        log.info('End')
+        return
+    if args.resize:
+        display_size = tuple(int(d) for d in args.display.split('x'))
+        copy_fn = ResizeCopy(display_size, fit=not args.fill, processes=args.processes)
+        pic_sync = PicSync(SRC_DIR, DST_DIR, workers=max(args.threads, copy_fn.processes), use_hash=args.hash,
+            delete=args.delete, dry_run=args.dry_run, copy_fn=copy_fn, copy_key=copy_fn.copy_key)
+    else:
+        copy_fn = None
+        pic_sync = PicSync(SRC_DIR, DST_DIR, workers=args.threads, use_hash=args.hash, delete=args.delete,
+            dry_run=args.dry_run)
+    try:
+        pic_sync.run(pic_lib)
+    finally:
+        if copy_fn is not None:
+            copy_fn.close()
     log.info('End')
 
 if __name__ == "__main__":
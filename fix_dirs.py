@@ -1,12 +1,51 @@
 #!/usr/bin/python3
-
+'''
+Reorganise the directories of a picture library in one go. Rename and delete rules, from a rules file or DIR_MV and
+DIR_RM, are planned and checked as a whole before anything is touched, then applied with a journal, so a run that
+stops part way is resumed by running it again.
+The same moves are made in the copy_files destination and its sync manifest, and in PicLibrary index files, so the
+reorganised library needs neither a full rescan nor copying again.
+    fix_dirs.py [--rules FILE] [--src DIR] [--dst DIR] [--index FILE] [--journal FILE] [--dry-run] [--discard]
+A rules file has a rule a line, with shell style quoting. Paths are relative to the library, as it is before the
+reorganisation:
+    mv '18-09-2011' '2011-09-18 Emmas fashion and party pics'
+    rm '2015-07-03 002'
+'''
 import os
+import sys
+import shlex
+import hashlib
 import logging
+import sqlite3
+import argparse
 from pathlib import Path
 import shutil
+from PicSync import MANIFEST_NAME
+
+log = logging.getLogger(__name__)
 
 SRC_DIR = '/media/links/SAMSUNG/Pictures'
+DST_DIR = None # copy_files destination to make the same moves in. None for none
+THIS_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+# PicLibrary index files to move the entries of, where they exist: copy_files' and the frame's, with its quarantine,
+# shuffle and show state
+INDEX_FILES = [os.path.join(THIS_DIR, 'copy_files_index.db'), os.path.join(THIS_DIR, 'pic_index.db')]
+JOURNAL_FILE = 'fix_dirs_journal.db'
+TMP_SUFFIX = '.fix_dirs_tmp' # Renames that swap names go through a temporary name
+# Tables keyed by library relative paths, in the index files and sync manifest
+PATH_TABLES = (
+    ('dirs', 'rel_dir_name'),
+    ('files', 'rel_path'),
+    ('hashes', 'rel_path'),
+    ('phashes', 'rel_path'),
+    ('quarantine', 'rel_path'),
+    ('dir_shuffle', 'rel_dir_name'),
+    ('show_order', 'rel_path'),
+    ('show_state', 'rel_dir_name'),
+    ('synced', 'rel_path'),
+)
 
+# The rules used when there is no rules file
 DIR_MV = {
     '18-09-2011': '2011-09-18 Emmas fashion and party pics',
     '18-09-2011(1)': '2011-09-18 Sports & Emmas ball gown',
@@ -31,54 +70,387 @@ DIR_RM = [
     'EMMA/New folder',
 ]
 
-def move_dirs():
-    log.info('Dir move...')
-    for src_dir_name in DIR_MV.keys():
-        src_dir = os.path.join(SRC_DIR, src_dir_name)
-        dst_dir = os.path.join(SRC_DIR, DIR_MV[src_dir_name])
-        if not os.path.isdir(src_dir):
-            log.warning('Src does not exist: %s' % src_dir)
+def under(rel_path, rel_dir):
+    '''
+    Whether rel_path is rel_dir or inside it
+    '''
+    return rel_path == rel_dir or rel_path.startswith(rel_dir + '/')
+
+def norm_path(rel_path):
+    '''
+    A rule path tidied up. Raises ValueError if it isn't inside the library
+    '''
+    norm = os.path.normpath(rel_path)
+    if os.path.isabs(norm) or norm in ('.', '') or norm == '..' or norm.startswith('../'):
+        raise ValueError('Not a path in the library: %s' % rel_path)
+    return norm
+
+def read_rules(path):
+    '''
+    Returns ([(src, dst)] renames, [path] deletes) from a rules file. Raises ValueError for a bad line
+    '''
+    moves = []
+    removes = []
+    with open(path) as f:
+        for line_num, line in enumerate(f, 1):
+            try:
+                words = shlex.split(line, comments=True)
+                if not words:
+                    continue
+                if words[0] == 'mv' and len(words) == 3:
+                    moves.append((norm_path(words[1]), norm_path(words[2])))
+                elif words[0] == 'rm' and len(words) == 2:
+                    removes.append(norm_path(words[1]))
+                else:
+                    raise ValueError('Expected mv SRC DST or rm DIR')
+            except ValueError as e:
+                raise ValueError('%s line %s: %s' % (path, line_num, e))
+    return moves, removes
+
+def order_moves(moves):
+    '''
+    Order renames so nothing is moved into a place another rename has still to free, or into a directory still to be
+    moved. Where renames go round in a circle, one is moved out of the way to a temporary name first.
+    Returns [(src, dst)], with the temporary renames added
+    '''
+    remaining = list(moves)
+    ordered = []
+    vacated = set() # Sources already moved out of the way
+    while remaining:
+        for pos, (src, dst) in enumerate(remaining):
+            # Wait for any other rename whose source is at or above the destination
+            if not any(under(dst, other_src) and other_src not in vacated
+                       for other_src, __other_dst in remaining if other_src != src):
+                break
+        else:
+            pos = 0
+            src, dst = remaining[0]
+            tmp = src + TMP_SUFFIX
+            log.info('Renames go round in a circle. Moving %s out of the way first' % src)
+            ordered.append((src, tmp))
+            vacated.add(src)
+            remaining[0] = (tmp, dst)
             continue
-        if os.path.exists(dst_dir):
-            log.error('Dst exists: %s' % dst_dir)
+        ordered.append((src, dst))
+        vacated.add(src)
+        del remaining[pos]
+    return ordered
+
+def locate(rel_path, steps):
+    '''
+    Where rel_path, a path from before the plan, is after steps
+    '''
+    for op, src, dst in steps:
+        if op == 'mv' and under(rel_path, src):
+            rel_path = dst + rel_path[len(src):]
+    return rel_path
+
+def make_plan(moves, removes):
+    '''
+    Turn rules into steps, [(op, src, dst)] with each path as it is when the step is done. Renames go first, in an order
+    that works, then deletes. Returns (steps, problems). Problems are with the rules themselves, whatever the tree
+    '''
+    problems = []
+    srcs = {}
+    dsts = {}
+    for src, dst in moves:
+        if src in srcs:
+            problems.append('%s is moved twice' % src)
+        if dst in dsts:
+            problems.append('%s and %s are both moved to %s' % (dsts[dst], src, dst))
+        if under(dst, src):
+            problems.append('%s is moved inside itself to %s' % (src, dst))
+        srcs[src] = dst
+        dsts[dst] = src
+    for rel_path in removes:
+        if rel_path in srcs:
+            problems.append('%s is both moved and deleted' % rel_path)
+        for dst in dsts:
+            if under(dst, rel_path):
+                problems.append('Deleting %s would delete %s, moved there' % (rel_path, dst))
+    steps = []
+    for src, dst in order_moves(moves):
+        steps.append(('mv', locate(src, steps), dst))
+    steps.extend(('rm', locate(rel_path, steps), None) for rel_path in removes)
+    return steps, problems
+
+class VirtualTree():
+    '''
+    A directory tree as it would be part way through a plan, without changing it. Paths are looked up in the real
+    tree, back through the steps taken so far
+    '''
+    def __init__(self, root):
+        self.root = root
+        self.steps = []
+
+    def exists(self, rel_path):
+        for op, src, dst in reversed(self.steps):
+            if op == 'mv':
+                if under(rel_path, dst):
+                    rel_path = src + rel_path[len(dst):]
+                    continue
+                if under(dst, rel_path):
+                    return True # Made as the parent of a rename
+            if under(rel_path, src):
+                return False
+        return os.path.lexists(os.path.join(self.root, rel_path))
+
+    def is_dir(self, rel_path):
+        return self.exists(rel_path) and os.path.isdir(os.path.join(self.root, locate_back(rel_path, self.steps)))
+
+    def take(self, step):
+        self.steps.append(step)
+
+def locate_back(rel_path, steps):
+    '''
+    Where rel_path, a path after steps, was before them
+    '''
+    for op, src, dst in reversed(steps):
+        if op == 'mv' and under(rel_path, dst):
+            rel_path = src + rel_path[len(dst):]
+    return rel_path
+
+def check_plan(steps, root, copy=False):
+    '''
+    Try the steps on a VirtualTree of root. Returns (steps to do in root, problems).
+    A step whose source has gone is left out, as done already. With copy (a copy_files destination, that may not have
+    every directory), missing sources are just left out
+    '''
+    tree = VirtualTree(root)
+    todo = []
+    problems = []
+    for step in steps:
+        op, src, dst = step
+        if not tree.is_dir(src):
+            if not copy:
+                if op == 'mv' and tree.exists(dst):
+                    log.info('Moved already: %s' % src)
+                elif op == 'rm':
+                    log.warning('Gone already: %s' % src)
+                else:
+                    problems.append('Missing source: %s' % os.path.join(root, src))
+            continue
+        if op == 'mv' and tree.exists(dst):
+            problems.append('Destination exists: %s' % os.path.join(root, dst))
             continue
-        log.info('MV %-130s %-130s' % (src_dir, dst_dir))
+        tree.take(step)
+        todo.append(step)
+    return todo, problems
+
+def plan_key(steps, roots):
+    h = hashlib.sha1()
+    for item in [roots] + steps:
+        h.update(repr(item).encode('utf-8', 'surrogateescape'))
+    return h.hexdigest()
+
+class Journal():
+    '''
+    The steps of a plan, and how far through them a run got, in an SQLite file. A step is marked started before it's
+    done and done after. Every step can safely be done again, so a resumed run just does a started step again
+    '''
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+
+    def connect(self):
+        con = sqlite3.connect(self.journal_file)
+        con.execute('''CREATE TABLE IF NOT EXISTS steps (
+            seq INTEGER PRIMARY KEY,
+            op TEXT NOT NULL,
+            src TEXT NOT NULL,
+            dst TEXT,
+            state TEXT NOT NULL
+        )''')
+        con.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        return con
+
+    def load(self):
+        '''
+        Returns (plan key, [(seq, op, src, dst, state)]) of an unfinished plan, None if there isn't one
+        '''
+        if not os.path.exists(self.journal_file):
+            return None
+        con = self.connect()
+        try:
+            row = con.execute("SELECT value FROM meta WHERE key = 'plan'").fetchone()
+            if row is None:
+                return None
+            return row[0], con.execute('SELECT * FROM steps ORDER BY seq').fetchall()
+        finally:
+            con.close()
+
+    def start(self, key, steps):
+        con = self.connect()
+        try:
+            with con:
+                con.execute('DELETE FROM steps')
+                con.executemany('INSERT INTO steps VALUES (?, ?, ?, ?, ?)',
+                    ((seq, op, src, dst, 'todo') for seq, (op, src, dst) in enumerate(steps)))
+                con.execute("INSERT OR REPLACE INTO meta VALUES ('plan', ?)", (key,))
+        finally:
+            con.close()
+
+    def mark(self, seq, state):
+        con = self.connect()
         try:
-            os.rename(src_dir, dst_dir)
-            pass
-        except:
-            log.critical('MV Failed: %s' % src_dir)
-            exit(1)
-
-def del_dirs():
-    log.info('Dir delete...')
-    for src_dir_name in DIR_RM:
-        src_dir = os.path.join(SRC_DIR, src_dir_name)
-        if not os.path.isdir(src_dir):
-            log.warning('Src does not exist: %s' % src_dir)
+            with con:
+                con.execute('UPDATE steps SET state = ? WHERE seq = ?', (state, seq))
+        finally:
+            con.close()
+
+    def finish(self):
+        con = self.connect()
+        try:
+            with con:
+                con.execute('DELETE FROM steps')
+                con.execute("DELETE FROM meta WHERE key = 'plan'")
+        finally:
+            con.close()
+
+def path_range(rel_path):
+    '''
+    SQL condition, and its arguments, for a column being rel_path or under it. Uses the column's index
+    '''
+    return '(%s = ? OR (%s >= ? AND %s < ?))', (rel_path, rel_path + '/', rel_path + chr(ord('/') + 1))
+
+def update_rows(db_file, op, src, dst):
+    '''
+    Move (or with rm, delete) the rows for src and everything under it in the path keyed tables of an SQLite file.
+    Done again, it changes nothing
+    '''
+    con = sqlite3.connect(db_file, timeout=30.0)
+    try:
+        tables = set(name for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+        with con:
+            for table, col in PATH_TABLES:
+                if table not in tables:
+                    continue
+                cond, args = path_range(src)
+                cond = cond % (col, col, col)
+                if op == 'rm':
+                    con.execute('DELETE FROM %s WHERE %s' % (table, cond), args)
+                    continue
+                if con.execute('SELECT 1 FROM %s WHERE %s LIMIT 1' % (table, cond), args).fetchone() is None:
+                    continue
+                # Rows left for the destination are stale. It didn't exist when the plan was checked
+                dst_cond, dst_args = path_range(dst)
+                con.execute('DELETE FROM %s WHERE %s' % (table, dst_cond % (col, col, col)), dst_args)
+                con.execute('UPDATE %s SET %s = ? || substr(%s, ?) WHERE %s' % (table, col, col, cond),
+                    (dst, len(src) + 1) + args)
+    finally:
+        con.close()
+
+def move_dir(root, src, dst):
+    src_dir = os.path.join(root, src)
+    dst_dir = os.path.join(root, dst)
+    if not os.path.isdir(src_dir):
+        return # Done already, or never copied
+    log.info('MV %-130s %-130s' % (src_dir, dst_dir))
+    os.makedirs(os.path.dirname(dst_dir), exist_ok=True)
+    if os.path.lexists(dst_dir):
+        raise OSError('Destination exists: %s' % dst_dir)
+    os.rename(src_dir, dst_dir)
+
+def del_dir(root, src):
+    src_dir = os.path.join(root, src)
+    if not os.path.isdir(src_dir):
+        return
+    log.info('RM %-130s   %s' % (src_dir, len(os.listdir(src_dir))))
+    shutil.rmtree(src_dir)
+
+def apply_plan(journal, steps, roots, db_files):
+    '''
+    Do the journalled steps not done yet in each root and db file. Stops at the first failure, leaving the journal
+    to resume from. Returns True if every step is done
+    '''
+    for seq, op, src, dst, state in steps:
+        if state == 'done':
             continue
-        path_cnt = len(os.listdir(src_dir))
-        log.info('RM %-130s   %s' % (src_dir, path_cnt))
+        if state == 'started':
+            log.info('Resuming at %s %s' % (op, src))
+        journal.mark(seq, 'started')
         try:
-            shutil.rmtree(src_dir)
-            pass
-        except:
-            log.critical('RM Failed: %s' % src_dir)
-            exit(1)
+            for root in roots:
+                if op == 'mv':
+                    move_dir(root, src, dst)
+                else:
+                    del_dir(root, src)
+            for db_file in db_files:
+                update_rows(db_file, op, src, dst)
+        except (OSError, sqlite3.Error) as e:
+            log.critical('%s failed: %s: %s' % (op.upper(), src, e))
+            return False
+        journal.mark(seq, 'done')
+    journal.finish()
+    return True
 
 def main():
+    parser = argparse.ArgumentParser(description='Rename and delete picture directories, keeping indexes and copies in step')
+    parser.add_argument('--rules', help='Rules file. Default DIR_MV and DIR_RM')
+    parser.add_argument('--src', default=SRC_DIR, help='Picture library')
+    parser.add_argument('--dst', default=DST_DIR, help='copy_files destination to make the same moves in')
+    parser.add_argument('--index', action='append', help='PicLibrary index file to update. Can be given more than once. '
+                        'Default %s' % ' and '.join(INDEX_FILES))
+    parser.add_argument('--journal', default=JOURNAL_FILE, help='Journal, to resume an interrupted run from')
+    parser.add_argument('--dry-run', action='store_true', help='Check and list the plan, but change nothing')
+    parser.add_argument('--discard', action='store_true', help='Forget an unfinished run, rather than resume it')
+    args = parser.parse_args()
     log.info('Start')
-    #move_dirs()
-    del_dirs()
+    try:
+        moves, removes = read_rules(args.rules) if args.rules is not None else (list(DIR_MV.items()), list(DIR_RM))
+    except (OSError, ValueError) as e:
+        log.critical('Bad rules: %s' % e)
+        sys.exit(1)
+    index_files = args.index if args.index is not None else [index_file for index_file in INDEX_FILES if os.path.exists(index_file)]
+    roots = [args.src]
+    db_files = list(index_files)
+    if args.dst is not None:
+        roots.append(args.dst)
+        if os.path.exists(os.path.join(args.dst, MANIFEST_NAME)):
+            db_files.append(os.path.join(args.dst, MANIFEST_NAME))
+    journal = Journal(args.journal)
+    steps, problems = make_plan(moves, removes)
+    key = plan_key(steps, roots)
+    unfinished = journal.load()
+    if unfinished is not None and not args.discard:
+        if unfinished[0] != key:
+            log.critical('%s has an unfinished run of other rules. Run those again to finish it, or --discard it' % args.journal)
+            sys.exit(1)
+        if not args.dry_run:
+            log.info('Resuming the unfinished run in %s' % args.journal)
+            ok = apply_plan(journal, unfinished[1], roots, db_files)
+            log.info('End')
+            sys.exit(0 if ok else 1)
+    todo, src_problems = check_plan(steps, args.src)
+    problems.extend(src_problems)
+    if args.dst is not None:
+        problems.extend(check_plan(steps, args.dst, copy=True)[1])
+    for problem in problems:
+        log.error(problem)
+    log.info('Plan: %s renames and %s deletes of %s rules. %s problems' % (sum(op == 'mv' for op, __src, __dst in todo),
+        sum(op == 'rm' for op, __src, __dst in todo), len(moves) + len(removes), len(problems)))
+    if problems:
+        log.critical('Nothing changed')
+        sys.exit(1)
+    if args.dry_run:
+        for op, src, dst in todo:
+            log.info('%s %s  %s' % (op.upper(), src, dst or ''))
+        log.info('End')
+        return
+    # Every step, not just those left in the library, so a copy that's behind is still brought into step
+    journal.start(key, steps)
+    ok = apply_plan(journal, journal.load()[1], roots, db_files)
+    log.info('Index files updated: %s' % ', '.join(db_files) if db_files else 'No index files to update')
     log.info('End')
+    if not ok:
+        sys.exit(1)
 
 if __name__ == "__main__":
     # setup logging
     logging.basicConfig(
-        format='%(asctime)s %(levelname)-8s %(message)s', 
-        datefmt='%Y-%m-%d_%H:%M:%S', 
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d_%H:%M:%S',
         level=logging.DEBUG
         )
     prog_name = Path(__file__).stem
     log = logging.getLogger(name=prog_name)
-    main()
\ No newline at end of file
+    main()
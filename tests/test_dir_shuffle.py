@@ -0,0 +1,61 @@
+import sqlite3
+import PicLibrary as PLib
+from Playlist import DirShuffle
+
+def library(dir_cnt=4, file_cnt=10):
+    pic_dirs = []
+    for d in range(dir_cnt):
+        pic_dir = PLib.PicDir('dir%s' % d)
+        for f in range(file_cnt):
+            pic_dir.add_file('%s.jpg' % f)
+        pic_dirs.append(pic_dir)
+    return pic_dirs
+
+def saved_cnt(state_file):
+    con = sqlite3.connect(state_file)
+    try:
+        return con.execute('SELECT COUNT(*) FROM dir_shuffle').fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        con.close()
+
+def test_picks_are_saved_in_batches(tmp_path):
+    state_file = str(tmp_path / 'index.db')
+    pic_dirs = library()
+    dir_shuffle = DirShuffle(pic_dirs, window=10, state_file=state_file, save_picks=5)
+    for __pick in range(4):
+        dir_shuffle.pick()
+    assert saved_cnt(state_file) == 0
+    dir_shuffle.pick()
+    assert saved_cnt(state_file) == 5
+    con = dir_shuffle.con
+    for __pick in range(5):
+        dir_shuffle.pick()
+    assert dir_shuffle.con is con # One connection, not one a pick
+    assert saved_cnt(state_file) == 10
+    dir_shuffle.pick()
+    dir_shuffle.close()
+    assert saved_cnt(state_file) == 11
+    assert dir_shuffle.con is None
+
+def test_pass_end_saves_and_restart_carries_on(tmp_path):
+    state_file = str(tmp_path / 'index.db')
+    pic_dirs = library()
+    dir_shuffle = DirShuffle(pic_dirs, window=10, state_file=state_file, save_picks=1000)
+    picks = list(dir_shuffle.next_pass())
+    assert len(picks) == 40
+    assert dir_shuffle.con is None
+    restarted = DirShuffle(pic_dirs, window=10, state_file=state_file)
+    assert restarted.pick_cnt == 40
+    recent = set((pic_file.pic_dir.rel_dir_name, pic_file.file_name) for pic_file in picks[-10:])
+    assert set((pic_dirs[d].rel_dir_name, pic_dirs[d].pic_files[pos].file_name) for d, pos, __n in restarted.window) == recent
+
+def test_given_up_pass_saves(tmp_path):
+    state_file = str(tmp_path / 'index.db')
+    dir_shuffle = DirShuffle(library(), window=10, state_file=state_file, save_picks=1000)
+    pass_files = dir_shuffle.next_pass()
+    for __pick in range(3):
+        next(pass_files)
+    pass_files.close()
+    assert saved_cnt(state_file) == 3
@@ -0,0 +1,97 @@
+import pytest
+from FrameScheduler import FrameScheduler, FakeClock, DIRTY_FRAMES
+
+def new_scheduler(**kwargs):
+    clock = FakeClock(100.0)
+    return clock, FrameScheduler(fps=20, idle_fps=2, clock=clock, sleep=clock.sleep, **kwargs)
+
+def run_frames(scheduler, clock, until_tm):
+    '''
+    Draw frames, taking no time, until the clock reaches until_tm. Returns the frame times
+    '''
+    frame_tms = []
+    while clock() < until_tm:
+        frame_tm = scheduler.wait_frame()
+        if frame_tm >= until_tm:
+            break
+        scheduler.frame_drawn(frame_tm, 0.0)
+        frame_tms.append(frame_tm)
+    return frame_tms
+
+def test_fade_alpha_follows_the_clock():
+    clock, scheduler = new_scheduler()
+    assert scheduler.fade_alpha() == 1.0 # No fade running
+    scheduler.start_fade(2.0)
+    assert scheduler.fade_alpha() == 0.0
+    clock.sleep(0.5)
+    assert scheduler.fade_alpha() == pytest.approx(0.25)
+    clock.sleep(1.0)
+    assert scheduler.fade_alpha() == pytest.approx(0.75)
+    clock.sleep(5.0)
+    assert scheduler.fade_alpha() == 1.0
+
+def test_wait_fade_finishes_at_the_end_of_the_fade():
+    clock, scheduler = new_scheduler()
+    scheduler.wait_fade() # Nothing running, no wait
+    assert clock() == 100.0
+    scheduler.start_fade(3.0)
+    clock.sleep(1.0)
+    scheduler.wait_fade()
+    assert clock() == pytest.approx(103.0)
+    assert scheduler.fade_alpha() == 1.0
+    assert not scheduler.fading()
+
+def test_zero_length_fade():
+    clock, scheduler = new_scheduler()
+    scheduler.start_fade(0.0)
+    assert scheduler.fade_alpha() == 1.0
+    scheduler.wait_fade()
+    assert clock() == 100.0
+    assert not scheduler.fading()
+    # The new picture still gets drawn
+    assert scheduler.busy()
+
+def test_fading_frames_at_full_rate_then_idle():
+    clock, scheduler = new_scheduler()
+    scheduler.frame_drawn(scheduler.wait_frame(), 0.0)
+    scheduler.start_fade(1.0)
+    fade_frames = run_frames(scheduler, clock, 101.0)
+    assert len(fade_frames) == pytest.approx(20, abs=1)
+    assert max(b - a for a, b in zip(fade_frames, fade_frames[1:])) == pytest.approx(0.05)
+    # The last of the fade reaches the screen, then the held picture is redrawn at idle rate
+    held_frames = run_frames(scheduler, clock, 111.0)
+    gaps = [b - a for a, b in zip(held_frames, held_frames[1:])]
+    assert gaps[:DIRTY_FRAMES - 1] == pytest.approx([0.05] * (DIRTY_FRAMES - 1))
+    assert gaps[-5:] == pytest.approx([0.5] * 5)
+    assert scheduler.stats.dropped_cnt == 0
+
+def test_change_cuts_an_idle_wait_short():
+    clock, scheduler = new_scheduler()
+    run_frames(scheduler, clock, 105.0)
+    scheduler.frame_drawn(scheduler.wait_frame(), 0.0)
+    last_tm = scheduler.last_frame_tm
+    def sleep(secs):
+        clock.sleep(secs)
+        scheduler.mark_dirty() # Eg a new status message, part way through the idle period
+    scheduler.sleep = sleep
+    frame_tm = scheduler.wait_frame()
+    assert frame_tm - last_tm == pytest.approx(0.05)
+
+def test_late_frames_count_as_dropped():
+    clock, scheduler = new_scheduler()
+    scheduler.start_fade(10.0)
+    scheduler.frame_drawn(scheduler.wait_frame(), 0.0)
+    scheduler.frame_drawn(scheduler.wait_frame(), 0.0)
+    clock.sleep(0.2) # A slow draw. The next frame comes four periods after the last
+    scheduler.frame_drawn(scheduler.wait_frame(), 0.2)
+    assert scheduler.stats.dropped_cnt == 3
+
+def test_report_every_stats_secs():
+    clock, scheduler = new_scheduler(stats_secs=10.0)
+    summaries = []
+    scheduler.stats_listeners.append(summaries.append)
+    scheduler.start_fade(1.0)
+    run_frames(scheduler, clock, 110.5)
+    assert len(summaries) == 1
+    assert summaries[0]['frames'] > 20
+    assert summaries[0]['dropped'] == 0
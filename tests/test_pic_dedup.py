@@ -0,0 +1,36 @@
+import os
+import pytest
+import PicLibrary as PLib
+import copy_files
+
+@pytest.fixture
+def src_dir(tmp_path):
+    src_dir = str(tmp_path / 'Pictures')
+    pic_dir = os.path.join(src_dir, '2020-01-01 Beach')
+    os.makedirs(pic_dir)
+    for name, content in (('IMG.jpg', b'one'), ('IMG-2.jpg', b'two'), ('IMG - Copy.jpg', b'one')):
+        with open(os.path.join(pic_dir, name), 'wb') as f:
+            f.write(content)
+    return src_dir
+
+def file_names(pic_lib):
+    return sorted(pic_file.file_name for pic_file in pic_lib.pic_files if pic_file not in pic_lib.duplicates)
+
+@pytest.mark.parametrize('path_regxs', [{}, copy_files.PATH_REGXS], ids=['PictureFrame', 'copy_files'])
+def test_dedup_drops_the_name_rules(src_dir, path_regxs):
+    pic_lib = PLib.PicLibrary(src_dir, path_regxs, dedup_threads=2)
+    pic_lib.get_file_list(shuffle=False)
+    # IMG-2.jpg isn't a copy, so is kept. IMG - Copy.jpg is, by content
+    assert len(file_names(pic_lib)) == 2
+    assert 'IMG-2.jpg' in file_names(pic_lib)
+
+@pytest.mark.parametrize('path_regxs', [{}, copy_files.PATH_REGXS], ids=['PictureFrame', 'copy_files'])
+def test_without_dedup_copies_are_excluded_by_name(src_dir, path_regxs):
+    pic_lib = PLib.PicLibrary(src_dir, path_regxs)
+    pic_lib.get_file_list(shuffle=False)
+    assert file_names(pic_lib) == ['IMG.jpg']
+
+def test_exc_files_passed_in_still_apply(src_dir):
+    pic_lib = PLib.PicLibrary(src_dir, {'exc_files': [r'.*-\d+\.']}, dedup_threads=2)
+    pic_lib.get_file_list(shuffle=False)
+    assert file_names(pic_lib) in (['IMG - Copy.jpg'], ['IMG.jpg'])
@@ -0,0 +1,37 @@
+import pytest
+from PIL import Image
+import PicImage
+
+@pytest.mark.parametrize('mode', ['P', '1', 'I;16', 'L', 'RGB'])
+def test_load_image_scales_any_png_mode(tmp_path, mode):
+    path = str(tmp_path / ('pic_%s.png' % mode.replace(';', '_')))
+    im = Image.new('RGB', (400, 400), (200, 100, 50))
+    if mode == 'I;16':
+        im = Image.new('I;16', (400, 400), 40000)
+    elif mode != 'RGB':
+        im = im.convert(mode)
+    im.save(path)
+    assert Image.open(path).mode == mode
+    loaded, __dt, orientation = PicImage.load_image(path, (100, 100))
+    assert loaded.mode == ('LA' if mode in ('L', 'I;16') else 'RGBA')
+    assert loaded.size == (100, 100)
+    assert orientation == 1
+    if mode == 'I;16':
+        assert loaded.getpixel((50, 50))[0] == 40000 // 256
+
+def test_load_image_keeps_palette_transparency(tmp_path):
+    path = str(tmp_path / 'clear.png')
+    im = Image.new('P', (400, 400), 0)
+    im.putpalette([0, 0, 0, 255, 0, 0] + [0] * 762)
+    im.paste(1, (0, 0, 200, 400))
+    im.save(path, transparency=0)
+    loaded, __dt, __orientation = PicImage.load_image(path, (100, 100))
+    assert loaded.size == (100, 100)
+    assert loaded.getpixel((10, 50))[:3] == (255, 0, 0)
+
+def test_load_image_small_16_bit_png(tmp_path):
+    path = str(tmp_path / 'small.png')
+    Image.new('I;16', (20, 20)).save(path)
+    loaded, __dt, __orientation = PicImage.load_image(path, (100, 100))
+    assert loaded.mode == 'LA'
+    assert loaded.size == (20, 20)
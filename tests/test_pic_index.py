@@ -0,0 +1,120 @@
+import os
+import time
+import sqlite3
+from PIL import Image
+import PicLibrary as PLib
+from PicIndex import PicIndex
+
+def make_tree(src_dir, dir_cnt=5, file_cnt=4):
+    for d in range(dir_cnt):
+        os.makedirs(os.path.join(src_dir, 'd%s' % d))
+        for f in range(file_cnt):
+            open(os.path.join(src_dir, 'd%s' % d, '%s.jpg' % f), 'wb').close()
+
+def traced(pic_index):
+    '''
+    The statements each save of pic_index runs
+    '''
+    statements = []
+    connect = pic_index.connect
+    def traced_connect():
+        con = connect()
+        con.set_trace_callback(statements.append)
+        return con
+    pic_index.connect = traced_connect
+    return statements
+
+def rows(index_file, table):
+    con = sqlite3.connect(index_file)
+    try:
+        return sorted(row[0] for row in con.execute('SELECT * FROM %s' % table))
+    finally:
+        con.close()
+
+def test_refresh_only_writes_the_changed_directory(tmp_path):
+    src_dir = str(tmp_path / 'Pictures')
+    index_file = str(tmp_path / 'index.db')
+    make_tree(src_dir)
+    pic_lib = PLib.PicLibrary(src_dir, index_file=index_file, exif_threads=2)
+    pic_lib.get_file_list(shuffle=False)
+    assert len(rows(index_file, 'dirs')) == 6
+    assert len(rows(index_file, 'files')) == 20
+    statements = traced(pic_lib.index)
+    open(os.path.join(src_dir, 'd2', 'new.jpg'), 'wb').close()
+    pic_lib.refresh_dirs(['d2'])
+    writes = [s for s in statements if s.startswith(('INSERT', 'DELETE'))]
+    assert len(writes) == 2
+    assert writes[0].startswith("INSERT OR REPLACE INTO dirs VALUES ('d2', ")
+    assert writes[1].startswith("INSERT OR REPLACE INTO files VALUES ('d2/new.jpg', ")
+    assert 'd2/new.jpg' in rows(index_file, 'files')
+
+def test_gone_directory_is_deleted(tmp_path):
+    src_dir = str(tmp_path / 'Pictures')
+    index_file = str(tmp_path / 'index.db')
+    make_tree(src_dir)
+    pic_lib = PLib.PicLibrary(src_dir, index_file=index_file, exif_threads=2)
+    pic_lib.get_file_list(shuffle=False)
+    for f in range(4):
+        os.remove(os.path.join(src_dir, 'd4', '%s.jpg' % f))
+    os.rmdir(os.path.join(src_dir, 'd4'))
+    pic_lib.refresh_dirs([''])
+    assert 'd4' not in rows(index_file, 'dirs')
+    assert not [rel_path for rel_path in rows(index_file, 'files') if rel_path.startswith('d4/')]
+    # A scan with nothing changed writes nothing
+    pic_lib.get_file_list(shuffle=False)
+    statements = traced(pic_lib.index)
+    pic_lib.get_file_list(shuffle=False)
+    assert [s for s in statements if s.startswith(('INSERT', 'DELETE'))] == []
+
+def test_save_matches_a_fresh_load(tmp_path):
+    index_file = str(tmp_path / 'index.db')
+    pic_index = PicIndex(index_file)
+    pic_index.store('a', 1, [], ['x.jpg'])
+    pic_index.store_file('a/x.jpg', 1, 100, 10.0, 1)
+    pic_index.save()
+    pic_index.store('a', 2, [], ['x.jpg', 'y.jpg'])
+    pic_index.store_file('a/y.jpg', 2, 200, 20.0, 6)
+    pic_index.save()
+    loaded = PicIndex(index_file)
+    loaded.load()
+    assert loaded.dirs == {'a': (2, '', 'x.jpg/y.jpg')}
+    assert loaded.files == {'a/x.jpg': (1, 100, 10.0, 1), 'a/y.jpg': (2, 200, 20.0, 6)}
+
+def save_jpeg(path, orientation, date):
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    exif.get_ifd(0x8769)[0x9003] = date
+    Image.new('RGB', (16, 8)).save(path, exif=exif.tobytes())
+
+def test_file_edited_in_place_is_read_again(tmp_path):
+    src_dir = str(tmp_path / 'Pictures')
+    index_file = str(tmp_path / 'index.db')
+    os.makedirs(os.path.join(src_dir, 'a'))
+    path = os.path.join(src_dir, 'a', 'x.jpg')
+    save_jpeg(path, 1, '2020:01:01 12:00:00')
+    pic_lib = PLib.PicLibrary(src_dir, index_file=index_file, exif_threads=2)
+    pic_lib.get_file_list(shuffle=False)
+    assert pic_lib.pic_files[0].orientation == 1
+    # Rotated and redated in place. The directory doesn't change
+    dir_st = os.stat(os.path.join(src_dir, 'a'))
+    save_jpeg(path, 6, '2021:06:01 12:00:00')
+    os.utime(os.path.join(src_dir, 'a'), ns=(dir_st.st_atime_ns, dir_st.st_mtime_ns))
+    pic_lib = PLib.PicLibrary(src_dir, index_file=index_file, exif_threads=2)
+    pic_lib.get_file_list(shuffle=False)
+    assert pic_lib.index.hit_cnt == 2 # The directories came from the index
+    assert pic_lib.pic_files[0].orientation == 6
+    assert time.localtime(pic_lib.pic_files[0].dt)[:3] == (2021, 6, 1)
+
+def test_index_from_before_sizes_is_started_again(tmp_path):
+    index_file = str(tmp_path / 'index.db')
+    con = sqlite3.connect(index_file)
+    with con:
+        con.execute('CREATE TABLE files (rel_path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, dt REAL, orientation INTEGER NOT NULL)')
+        con.execute("INSERT INTO files VALUES ('a/x.jpg', 1, 10.0, 1)")
+    con.close()
+    pic_index = PicIndex(index_file)
+    pic_index.load()
+    assert pic_index.files == {}
+    pic_index.store_file('a/x.jpg', 1, 100, 10.0, 1)
+    pic_index.save()
+    assert rows(index_file, 'files') == ['a/x.jpg']
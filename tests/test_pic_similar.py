@@ -0,0 +1,54 @@
+import time
+import random
+import PicSimilar
+from PicSimilar import HashIndex, cluster
+
+def bursts(count, burst_len, rand, mask=~0):
+    hashes = []
+    for i in range(count):
+        if i % burst_len == 0:
+            base = rand.getrandbits(64) & mask
+        h = base
+        for bit in rand.sample(range(16, 64), rand.randint(0, 3)):
+            h ^= 1 << bit
+        hashes.append(h)
+    return hashes
+
+def test_bursts_are_clustered():
+    hashes = bursts(1000, 5, random.Random(1))
+    clusters = cluster(hashes)
+    assert sorted(len(positions) for positions in clusters) == [5] * 200
+
+def test_common_chunk_is_dropped_and_stays_fast():
+    hashes = bursts(10000, 5, random.Random(2), ~0xffff)
+    start_tm = time.perf_counter()
+    clusters = cluster(hashes)
+    assert time.perf_counter() - start_tm < 5.0
+    assert len(clusters) >= 1900
+    index = HashIndex()
+    for h in hashes:
+        index.add(h)
+    assert index.tables[0][0] is None
+    assert index.dropped_cnt >= 1
+
+def test_groups_keep_clusters_in_one_directory():
+    h = random.Random(3).getrandbits(64)
+    assert cluster([h, h, h, h], groups=['a', 'b', 'a', 'b']) == [[0, 2], [1, 3]]
+
+def test_times_split_shots_far_apart():
+    h = random.Random(4).getrandbits(64)
+    secs = PicSimilar.BURST_SECS
+    assert cluster([h, h], times=[0.0, secs * 10]) == []
+    assert cluster([h, h], times=[0.0, secs / 2]) == [[0, 1]]
+    assert cluster([h, h, h], times=[None, 0.0, None]) == [[0, 1, 2]]
+
+def test_undated_joins_the_nearest_group_only():
+    h = random.Random(4).getrandbits(64)
+    secs = PicSimilar.BURST_SECS
+    second = h ^ 0b1111
+    near_second = h ^ 0b1110 # 3 bits from the first shot, 1 from the second
+    assert cluster([h, second, near_second], times=[0.0, secs * 10, None]) == [[1, 2]]
+    # Undated near duplicates of each other, one near each shot, still only join one
+    clusters = cluster([h, second, h ^ 0b1, near_second], times=[0.0, secs * 10, None, None])
+    assert len(clusters) == 1
+    assert 0 not in clusters[0] or 1 not in clusters[0]
@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import pytest
+from PIL import Image
+import PicLibrary as PLib
+import PicSync
+from PicSync import PicSync as Sync, copy_atomic
+
+@pytest.fixture
+def src_dir(tmp_path):
+    src_dir = tmp_path / 'Pictures'
+    (src_dir / 'a').mkdir(parents=True)
+    for name in ('1.jpg', '2.jpg', 'bad.jpg', '3.jpg'):
+        (src_dir / 'a' / name).write_bytes(name.encode())
+    return str(src_dir)
+
+def scanned(src_dir):
+    pic_lib = PLib.PicLibrary(src_dir)
+    pic_lib.get_file_list(shuffle=False)
+    return pic_lib
+
+def test_any_copy_error_fails_just_that_file(src_dir, tmp_path):
+    def copy_fn(src_file, dst_file, mtime_ns):
+        if src_file.endswith('bad.jpg'):
+            raise Image.DecompressionBombError('Too big')
+        if src_file.endswith('2.jpg'):
+            raise SyntaxError('Corrupt')
+        copy_atomic(src_file, dst_file, mtime_ns)
+    dst_dir = str(tmp_path / 'Copy')
+    pic_sync = Sync(src_dir, dst_dir, copy_fn=copy_fn, workers=2)
+    assert pic_sync.run(scanned(src_dir)) == 2
+    assert pic_sync.fail_cnt == 2
+    assert sorted(os.listdir(os.path.join(dst_dir, 'a'))) == ['1.jpg', '3.jpg']
+    # The failures aren't recorded, so they're tried again
+    pic_sync = Sync(src_dir, dst_dir, workers=2)
+    assert pic_sync.run(scanned(src_dir)) == 2
+
+def test_use_hash_hashes_each_source_once(src_dir, tmp_path, monkeypatch):
+    hashed = []
+    real_file_hash = PicSync.file_hash
+    def file_hash(path):
+        hashed.append(path)
+        return real_file_hash(path)
+    monkeypatch.setattr(PicSync, 'file_hash', file_hash)
+    dst_dir = str(tmp_path / 'Copy')
+    pic_sync = Sync(src_dir, dst_dir, use_hash=True)
+    assert pic_sync.run(scanned(src_dir)) == 4
+    assert len(hashed) == 4 and len(set(hashed)) == 4
+    con = sqlite3.connect(pic_sync.manifest_file)
+    assert con.execute('SELECT COUNT(*) FROM synced WHERE hash IS NOT NULL').fetchone()[0] == 4
+    con.close()
+    # Touched but unchanged: recorded, not copied
+    hashed.clear()
+    for name in os.listdir(os.path.join(src_dir, 'a')):
+        os.utime(os.path.join(src_dir, 'a', name), ns=(1, 1))
+    pic_sync = Sync(src_dir, dst_dir, use_hash=True)
+    assert pic_sync.run(scanned(src_dir)) == 0
+    assert pic_sync.same_cnt == 4
+    assert len(hashed) == 4
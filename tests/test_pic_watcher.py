@@ -0,0 +1,104 @@
+import os
+import time
+import pytest
+from threading import Thread
+import PicLibrary as PLib
+import PicWatcher
+
+TIMEOUT = 10.0
+
+def wait_until(test, timeout=TIMEOUT):
+    end_tm = time.monotonic() + timeout
+    while not test():
+        if time.monotonic() > end_tm:
+            return False
+        time.sleep(0.02)
+    return True
+
+def write(path, data=b'x'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def lib_paths(pic_lib):
+    with pic_lib.lock:
+        return sorted(os.path.join(pic_file.pic_dir.rel_dir_name, pic_file.file_name) for pic_file in pic_lib.pic_files)
+
+@pytest.fixture
+def src_dir(tmp_path):
+    src_dir = str(tmp_path / 'Pictures')
+    write(os.path.join(src_dir, 'a', '1.jpg'))
+    return src_dir
+
+@pytest.fixture
+def watched(src_dir):
+    pic_lib = PLib.PicLibrary(src_dir)
+    pic_lib.get_file_list(shuffle=False)
+    yield pic_lib
+    if pic_lib.watcher is not None:
+        pic_lib.watcher.stop()
+        if pic_lib.watcher.thread is not None:
+            pic_lib.watcher.thread.join(TIMEOUT)
+
+def test_watcher_follows_new_files(src_dir, watched):
+    watcher = watched.watch(0.1)
+    if isinstance(watcher, PicWatcher.InotifyWatcher):
+        assert wait_until(lambda: set(watcher.wds.values()) == {'', 'a'})
+    write(os.path.join(src_dir, 'a', '2.jpg'))
+    write(os.path.join(src_dir, 'b', '3.jpg'))
+    assert wait_until(lambda: lib_paths(watched) == ['a/1.jpg', 'a/2.jpg', 'b/3.jpg'])
+
+def test_dirs_found_by_a_rescan_are_watched(src_dir, watched):
+    # Made before the watcher starts, so only a rescan finds it
+    write(os.path.join(src_dir, 'b', '1.jpg'))
+    watcher = watched.watch(0.1)
+    if not isinstance(watcher, PicWatcher.InotifyWatcher):
+        pytest.skip('No inotify')
+    assert wait_until(lambda: set(watcher.wds.values()) == {'', 'a'})
+    watched.update(shuffle=False)
+    watched.update_thread.join(TIMEOUT)
+    assert wait_until(lambda: set(watcher.wds.values()) == {'', 'a', 'b'})
+    write(os.path.join(src_dir, 'b', '2.jpg'))
+    assert wait_until(lambda: lib_paths(watched) == ['a/1.jpg', 'b/1.jpg', 'b/2.jpg'])
+
+def test_rescans_and_refreshes_together_keep_the_library_whole(src_dir, watched):
+    watched.watch(0.05)
+    for i in range(20):
+        write(os.path.join(src_dir, 'd%02d' % (i % 5), '%s.jpg' % i))
+        watched.update(shuffle=False)
+        watched.update_thread.join(TIMEOUT)
+        assert not watched.update_thread.is_alive()
+    expected = ['a/1.jpg'] + sorted('d%02d/%s.jpg' % (i % 5, i) for i in range(20))
+    assert wait_until(lambda: lib_paths(watched) == expected)
+    with watched.lock:
+        rel_dir_names = [pic_dir.rel_dir_name for pic_dir in watched.pic_dirs]
+        assert rel_dir_names == sorted(set(rel_dir_names))
+        assert sum(pic_dir.file_cnt for pic_dir in watched.pic_dirs) == len(watched.pic_files)
+
+def test_refresh_waits_for_a_scan(src_dir, watched):
+    write(os.path.join(src_dir, 'a', '2.jpg'))
+    refresh = Thread(target=watched.refresh_dirs, args=(['a'],))
+    with watched.scan_lock:
+        refresh.start()
+        refresh.join(0.2)
+        assert refresh.is_alive()
+        assert lib_paths(watched) == ['a/1.jpg']
+    refresh.join(TIMEOUT)
+    assert lib_paths(watched) == ['a/1.jpg', 'a/2.jpg']
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_refresh_keeps_duplicates_out(src_dir, compact):
+    write(os.path.join(src_dir, 'a', '2.jpg'))
+    write(os.path.join(src_dir, 'a', '3.jpg'), b'other')
+    pic_lib = PLib.PicLibrary(src_dir, compact=compact, dedup_threads=1)
+    pic_lib.get_file_list(shuffle=False)
+    assert len(lib_paths(pic_lib)) == 2
+    assert len(pic_lib.duplicates) == 1
+    write(os.path.join(src_dir, 'a', '4.jpg'), b'new')
+    pic_lib.refresh_dirs(['a'])
+    paths = lib_paths(pic_lib)
+    assert len(paths) == 3 and 'a/4.jpg' in paths and 'a/3.jpg' in paths
+    assert len(pic_lib.duplicates) == 1
+    dup = next(iter(pic_lib.duplicates))
+    assert pic_lib.excluded(dup)
+    assert os.path.join(dup.pic_dir.rel_dir_name, dup.file_name) not in paths
@@ -0,0 +1,76 @@
+import os
+import time
+import threading
+import PicLibrary as PLib
+from Playlist import DateIndex, Playlist, to_timestamp
+
+def dated_files(dts):
+    pic_dir = PLib.PicDir('a')
+    for pos, dt in enumerate(dts):
+        pic_dir.add_file('%s.jpg' % pos).dt = dt
+    return pic_dir.pic_files
+
+def local(*date):
+    return time.mktime(date + (0,) * (6 - len(date)) + (0, 0, -1))
+
+def test_date_to_day_includes_the_whole_day():
+    pic_files = dated_files([local(2020, 5, 1, 23, 59, 59), local(2020, 5, 1, 12), local(2020, 5, 2), local(2020, 4, 30, 23, 59, 59)])
+    playlist = Playlist(DateIndex(pic_files), (2020, 5, 1), (2020, 5, 1), shuffle=False)
+    assert sorted(pic_file.file_name for pic_file in playlist.next_pass()) == ['0.jpg', '1.jpg']
+
+def test_date_to_month_and_year():
+    assert to_timestamp((2020, 12), end=True) < local(2021, 1, 1) <= to_timestamp((2021,))
+    assert to_timestamp((2020, 12), end=True) > local(2020, 12, 31, 23, 59, 59)
+    assert to_timestamp((2020,), end=True) < local(2021, 1, 1)
+    assert to_timestamp((2020, 2)) == local(2020, 2, 1)
+    assert to_timestamp((2020, 2, 29), end=True) < local(2020, 3, 1)
+
+def test_seconds_pass_through():
+    assert to_timestamp(12.5, end=True) == 12.5
+    assert to_timestamp(None, end=True) is None
+
+def test_library_playlist_date_to_includes_the_day(tmp_path):
+    src_dir = tmp_path / 'Pictures'
+    (src_dir / 'a').mkdir(parents=True)
+    for name in ('late.jpg', 'next.jpg'):
+        (src_dir / 'a' / name).write_bytes(b'x')
+    pic_lib = PLib.PicLibrary(str(src_dir))
+    pic_lib.get_file_list(shuffle=False)
+    dts = {'late.jpg': local(2020, 5, 1, 22), 'next.jpg': local(2020, 5, 2, 0, 0, 1)}
+    for pic_file in pic_lib.pic_files:
+        pic_file.dt = dts[pic_file.file_name]
+    played = [pic_file.file_name for pic_file in pic_lib.playlist(False, date_from=(2020, 5, 1), date_to=(2020, 5, 1))]
+    assert played == ['late.jpg']
+
+def test_recent_first_streams_during_the_scan(tmp_path, monkeypatch):
+    src_dir = str(tmp_path)
+    for d in ('a', 'b'):
+        os.makedirs(os.path.join(src_dir, d))
+    for i in range(10):
+        path = os.path.join(src_dir, 'a' if i < 3 else 'b', '%s.jpg' % i)
+        open(path, 'wb').close()
+        os.utime(path, (1e9 + i * 1000, 1e9 + i * 1000))
+    scan_held = threading.Event()
+    new_pic_dir = PLib.PicLibrary._new_pic_dir
+    def held_new_pic_dir(self, dirpath, rel_dir_name, file_names):
+        if rel_dir_name == 'b':
+            scan_held.wait(10)
+        return new_pic_dir(self, dirpath, rel_dir_name, file_names)
+    monkeypatch.setattr(PLib.PicLibrary, '_new_pic_dir', held_new_pic_dir)
+    pic_lib = PLib.PicLibrary(src_dir, exif_threads=2)
+    pic_lib.update(shuffle=True)
+    try:
+        # PictureFrame's defaults: shuffled, repeating and RECENT_N = 4
+        piclist = pic_lib.playlist(shuffle=True, repeat=True, recent_n=4)
+        first = []
+        get = threading.Thread(target=lambda: first.append(next(piclist)))
+        get.start()
+        get.join(5)
+        assert first and first[0].pic_dir.rel_dir_name == 'a'
+        assert pic_lib.update_thread.is_alive()
+    finally:
+        scan_held.set()
+    pic_lib.update_thread.join(10)
+    # The scan has finished, so the most recent of the rest play next
+    recent = set('%s.jpg' % i for i in range(6, 10))
+    assert set(next(piclist).file_name for __i in range(4)) == recent
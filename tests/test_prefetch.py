@@ -0,0 +1,85 @@
+import os
+import threading
+import multiprocessing
+from types import SimpleNamespace
+import pytest
+from PIL import Image
+import PicImage
+from Prefetch import Prefetcher
+from PicQuarantine import PicQuarantine
+from Telemetry import telemetry
+
+def pic_files(names):
+    pic_dir = SimpleNamespace(rel_dir_name='a')
+    return [SimpleNamespace(pic_dir=pic_dir, file_name=name) for name in names]
+
+@pytest.fixture
+def src_dir(tmp_path):
+    os.makedirs(str(tmp_path / 'a'))
+    for name in ('ok_1.jpg', 'crash.jpg', 'ok_2.jpg', 'ok_3.jpg'):
+        Image.new('RGB', (64, 48), 'red').save(str(tmp_path / 'a' / name))
+    return str(tmp_path)
+
+def shown(prefetcher):
+    names = []
+    while True:
+        decoded = prefetcher.next_decoded()
+        if decoded is None:
+            return names
+        names.append(decoded.fname)
+        decoded.release()
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='Workers need the patched load_image')
+def test_dead_worker_is_replaced(src_dir, monkeypatch):
+    load_image = PicImage.load_image
+    def crashing_load_image(path, *args):
+        if os.path.basename(path) == 'crash.jpg':
+            os._exit(1)
+        return load_image(path, *args)
+    monkeypatch.setattr(PicImage, 'load_image', crashing_load_image)
+    quarantine = PicQuarantine(src_dir)
+    # One worker, so the picture that kills it is the one being waited on
+    prefetcher = Prefetcher(src_dir, iter(pic_files(['ok_1.jpg', 'crash.jpg', 'ok_2.jpg', 'ok_3.jpg'])), (32, 24),
+                            depth=3, workers=1, quarantine=quarantine)
+    try:
+        assert shown(prefetcher) == ['ok_1.jpg', 'ok_2.jpg', 'ok_3.jpg']
+        assert prefetcher.broken_cnt == 1
+        assert quarantine.quarantined('a/crash.jpg')
+        assert not quarantine.quarantined('a/ok_2.jpg')
+    finally:
+        prefetcher.close(wait=True)
+
+def test_decoded_picture_not_held_up_by_playlist(src_dir):
+    scan_done = threading.Event()
+    def piclist():
+        yield from pic_files(['ok_1.jpg'])
+        scan_done.wait(10) # A scan still going
+        yield from pic_files(['ok_2.jpg'])
+    prefetcher = Prefetcher(src_dir, piclist(), (32, 24), depth=3, workers=1)
+    try:
+        result = []
+        get = threading.Thread(target=lambda: result.append(prefetcher.next_decoded()))
+        get.start()
+        get.join(5)
+        assert not scan_done.is_set()
+        assert result and result[0].fname == 'ok_1.jpg'
+        result[0].release()
+        scan_done.set()
+        assert shown(prefetcher) == ['ok_2.jpg']
+    finally:
+        scan_done.set()
+        prefetcher.close(wait=True)
+
+def test_worker_load_phases_reach_telemetry(src_dir, tmp_path):
+    telemetry.enable(str(tmp_path / 'telemetry.jsonl'), interval_secs=3600)
+    try:
+        prefetcher = Prefetcher(src_dir, iter(pic_files(['ok_1.jpg', 'ok_2.jpg'])), (32, 24), depth=2, workers=1)
+        try:
+            assert shown(prefetcher) == ['ok_1.jpg', 'ok_2.jpg']
+        finally:
+            prefetcher.close(wait=True)
+        samples = telemetry.take()
+    finally:
+        telemetry.disable()
+    for name in ('load.open.secs', 'load.exif.secs', 'load.decode.secs', 'load.transpose.secs', 'load.bytes'):
+        assert len(samples[name]) == 2, name
@@ -0,0 +1,126 @@
+import pytest
+from threading import Timer
+from FrameScheduler import FakeClock
+from ShowControl import ShowControl, ShowHistory, NEXT, PREV, RELOAD, QUIT, MAX_DELAY, MAX_WAIT
+
+class FakeWait():
+    '''
+    Moves a FakeClock on by each wait. Commands to send part way through can be queued with at()
+    '''
+    def __init__(self, clock):
+        self.clock = clock
+        self.waits = []
+        self.todo = [] # (time, fn)
+
+    def at(self, tm, fn):
+        self.todo.append((tm, fn))
+        self.todo.sort(key=lambda item: item[0])
+
+    def __call__(self, cond, secs):
+        self.waits.append(secs)
+        if self.todo and (secs is None or self.clock.now + secs >= self.todo[0][0]):
+            tm, fn = self.todo.pop(0)
+            self.clock.now = max(self.clock.now, tm)
+            fn()
+            return
+        assert secs is not None, 'Would wait forever'
+        self.clock.sleep(secs)
+
+def make_control(delay=10.0, paused=False):
+    clock = FakeClock()
+    wait = FakeWait(clock)
+    return ShowControl(delay, paused, clock=clock, wait=wait), clock, wait
+
+def test_next_after_fade_and_delay():
+    control, clock, __wait = make_control(10.0)
+    control.shown(2.0)
+    assert control.wait_next() == NEXT
+    assert clock.now == 12.0
+
+def test_next_command_wakes_at_once():
+    control, clock, wait = make_control(10.0)
+    control.shown()
+    wait.at(3.0, lambda: control.command('next'))
+    assert control.wait_next() == NEXT
+    assert clock.now == 3.0
+
+def test_prev_reload_and_quit_are_returned_in_order():
+    control, __clock, __wait = make_control()
+    control.shown()
+    for line in ('prev', 'reload', 'quit'):
+        control.command(line)
+    assert [control.wait_next() for __i in range(3)] == [PREV, RELOAD, QUIT]
+
+def test_pause_holds_and_resume_keeps_time_left():
+    control, clock, wait = make_control(10.0)
+    control.shown()
+    wait.at(4.0, control.pause)
+    wait.at(100.0, control.resume)
+    assert control.wait_next() == NEXT
+    assert clock.now == 106.0
+    assert None in wait.waits
+
+def test_paused_command_still_acts():
+    control, clock, wait = make_control(10.0, paused=True)
+    control.shown()
+    assert control.remaining() is None
+    wait.at(50.0, lambda: control.send(NEXT))
+    assert control.wait_next() == NEXT
+    assert clock.now == 50.0
+
+def test_toggle():
+    control, __clock, __wait = make_control()
+    assert 'paused=True' in control.command('toggle')
+    assert 'paused=False' in control.command('toggle')
+
+def test_delay_applies_to_the_picture_showing():
+    control, clock, wait = make_control(10.0)
+    control.shown()
+    wait.at(2.0, lambda: control.command('delay 5'))
+    assert control.wait_next() == NEXT
+    assert clock.now == 5.0
+
+def test_long_delay_is_cut_and_waits_are_capped():
+    control, clock, wait = make_control(10.0)
+    control.command('delay 1e12')
+    assert control.delay == MAX_DELAY
+    control.shown()
+    assert control.wait_next() == NEXT
+    assert clock.now == MAX_DELAY
+    assert max(wait.waits) <= MAX_WAIT
+    assert ShowControl(1e12).delay == MAX_DELAY
+
+@pytest.mark.parametrize('line', ['delay nan', 'delay inf', 'delay -inf', 'delay -1', 'delay x', 'delay', 'delay 1 2',
+    'next 1', 'bogus', ''])
+def test_bad_commands_are_rejected(line):
+    control, __clock, __wait = make_control(10.0)
+    with pytest.raises(ValueError):
+        control.command(line)
+    assert control.delay == 10.0
+    assert not control.actions
+
+def test_real_wait_with_huge_delay_does_not_overflow():
+    control = ShowControl(10.0)
+    control.command('delay 1e12')
+    control.shown()
+    timer = Timer(0.05, control.send, (QUIT,))
+    timer.start()
+    assert control.wait_next() == QUIT
+    timer.join()
+
+def test_history_back_and_forward():
+    history = ShowHistory()
+    for name in 'abc':
+        history.shown(name)
+    assert history.back('d') == 'b'
+    history.shown('b')
+    assert history.peek() == 'c'
+    history.shown('c')
+    assert history.peek() == 'd'
+    history.shown('d')
+    assert history.peek() is None
+
+def test_history_nothing_to_go_back_to():
+    history = ShowHistory()
+    history.shown('a')
+    assert history.back('b') is None
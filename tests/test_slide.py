@@ -0,0 +1,84 @@
+import os
+import pytest
+from PIL import Image
+import benchmark
+benchmark.stub_pi3d()
+import Slide
+import PicLibrary as PLib
+from PicQuarantine import PicQuarantine
+from TexturePool import TexturePool, FakeTextures
+
+@pytest.fixture
+def src_dir(tmp_path):
+    src_dir = str(tmp_path / 'Pictures')
+    os.makedirs(os.path.join(src_dir, 'a'))
+    for i in range(15):
+        with open(os.path.join(src_dir, 'a', 'bad_%02d.jpg' % i), 'wb') as f:
+            f.write(b'not a jpeg')
+    Image.new('RGB', (64, 48), 'red').save(os.path.join(src_dir, 'a', 'good.jpg'))
+    return src_dir
+
+def new_slide(**kwargs):
+    return Slide.Slide(benchmark.StubDisplay(32, 24), None, 'shader', 0.5, **kwargs)
+
+@pytest.mark.parametrize('prefetch_depth', [0, 2])
+def test_skips_more_than_ten_bad_files(src_dir, prefetch_depth):
+    quarantine = PicQuarantine(src_dir)
+    pic_lib = PLib.PicLibrary(src_dir)
+    pic_lib.get_file_list(shuffle=False)
+    piclist = iter(pic_lib.pic_files)
+    slide = new_slide(quarantine=quarantine, prefetch_depth=prefetch_depth)
+    try:
+        slide.load_next_image(src_dir, piclist)
+        assert slide.next_pic is not None
+        assert slide.next_pic.fname == 'good.jpg'
+        assert sum(quarantine.quarantined('a/bad_%02d.jpg' % i) for i in range(15)) == 15
+        slide.load_next_image(src_dir, piclist)
+        assert slide.next_pic is None # The playlist is finished
+    finally:
+        if slide.prefetcher is not None:
+            slide.prefetcher.close()
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason='No /dev/shm')
+def test_close_frees_prefetched_pictures(src_dir):
+    for i in range(6):
+        Image.new('RGB', (64, 48), 'blue').save(os.path.join(src_dir, 'a', 'more_%s.jpg' % i))
+    before = set(os.listdir('/dev/shm'))
+    pic_lib = PLib.PicLibrary(src_dir)
+    pic_lib.get_file_list(shuffle=False)
+    slide = new_slide(prefetch_depth=4)
+    slide.load_next_image(src_dir, iter(pic_lib.pic_files))
+    assert slide.next_pic is not None
+    slide.close()
+    assert slide.prefetcher is None
+    assert set(os.listdir('/dev/shm')) - before == set()
+
+class FailingTextures(FakeTextures):
+    def __init__(self, fail_cnt):
+        super().__init__()
+        self.fail_cnt = fail_cnt
+
+    def stage(self, im, automatic_resize=True):
+        if self.fail_cnt > 0:
+            self.fail_cnt -= 1
+            raise MemoryError('No room to stage')
+        return super().stage(im, automatic_resize)
+
+def test_prefetched_picture_that_fails_to_stage_is_skipped(tmp_path):
+    src_dir = str(tmp_path)
+    os.makedirs(os.path.join(src_dir, 'a'))
+    for name in ('1.jpg', '2.jpg', '3.jpg'):
+        Image.new('RGB', (64, 48), 'red').save(os.path.join(src_dir, 'a', name))
+    quarantine = PicQuarantine(src_dir)
+    pic_lib = PLib.PicLibrary(src_dir)
+    pic_lib.get_file_list(shuffle=False)
+    piclist = iter(pic_lib.pic_files)
+    slide = new_slide(quarantine=quarantine, prefetch_depth=2, textures=TexturePool(FailingTextures(2)))
+    try:
+        slide.load_next_image(src_dir, piclist)
+        assert slide.next_pic.fname == '3.jpg'
+        assert slide.next_pic.tex is not None
+        assert quarantine.quarantined('a/1.jpg') and quarantine.quarantined('a/2.jpg')
+        slide.set_fg_to_next()
+    finally:
+        slide.close()
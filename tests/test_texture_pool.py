@@ -0,0 +1,148 @@
+import sys
+import types
+import numpy as np
+import pytest
+from PIL import Image
+import benchmark
+benchmark.stub_pi3d()
+import Slide
+from TexturePool import TexturePool, FakeTextures
+
+LANDSCAPE = Image.new('RGBA', (64, 48))
+PORTRAIT = Image.new('RGBA', (36, 48))
+
+def show(pool, im):
+    pool.stage(im)
+    pool.rotate()
+    return pool.apply()
+
+def test_first_picture_is_fg_and_bg():
+    backend = FakeTextures()
+    pool = TexturePool(backend)
+    fg, bg = show(pool, LANDSCAPE)
+    assert fg is bg
+    assert pool.create_cnt == 1
+    assert pool.slots['next'] is None
+
+def test_rotation_reuses_three_textures():
+    backend = FakeTextures()
+    pool = TexturePool(backend)
+    shown = []
+    for __slide in range(20):
+        fg, bg = show(pool, LANDSCAPE)
+        shown.append(fg)
+        if len(shown) > 1:
+            assert bg is shown[-2] # The one before fades out
+        assert len(backend.gpu) <= 3
+    assert pool.create_cnt == 3
+    assert pool.upload_cnt == 17
+    assert len(set(map(id, shown))) == 3
+    # Each texture comes round again every third picture
+    assert all(shown[i] is shown[i - 3] for i in range(4, 20))
+
+def test_next_staged_twice_uploads_the_last():
+    backend = FakeTextures()
+    pool = TexturePool(backend)
+    show(pool, LANDSCAPE)
+    pool.stage(LANDSCAPE)
+    staged = pool.stage(PORTRAIT)
+    assert len(pool.ops) == 1
+    pool.rotate()
+    fg, __bg = pool.apply()
+    assert (fg.ix, fg.iy) == (staged.ix, staged.iy)
+    assert pool.create_cnt == 2
+
+def test_upload_ahead_then_rotate():
+    backend = FakeTextures()
+    pool = TexturePool(backend)
+    show(pool, LANDSCAPE)
+    pool.stage(PORTRAIT)
+    assert pool.apply() is None # Uploaded, not shown yet
+    assert pool.slots['next'] is not None
+    pool.rotate()
+    fg, bg = pool.apply()
+    assert (fg.ix, fg.iy) == PORTRAIT.size
+    assert (bg.ix, bg.iy) == LANDSCAPE.size
+
+def test_byte_accounting_follows_size_changes():
+    backend = FakeTextures()
+    pool = TexturePool(backend)
+    for im in [LANDSCAPE, PORTRAIT, LANDSCAPE, PORTRAIT, PORTRAIT, LANDSCAPE]:
+        show(pool, im)
+        assert pool.live_cnt == len(backend.gpu)
+        assert pool.live_bytes == sum(backend.gpu.values())
+    # The fourth picture reuses the first's texture, another shape, so it had to be specified again
+    assert backend.resize_cnt == 1
+    assert backend.upload_cnt == pool.upload_cnt == 3
+
+def test_close_deletes_everything():
+    backend = FakeTextures()
+    pool = TexturePool(backend)
+    for __slide in range(5):
+        show(pool, LANDSCAPE)
+    pool.stage(PORTRAIT) # Queued, never applied
+    pool.close()
+    assert backend.gpu == {}
+    assert pool.live_cnt == 0
+    assert pool.live_bytes == 0
+    assert all(tex is None for tex in pool.slots.values())
+    assert pool.apply() is None
+
+class FakeGL():
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append(name)
+
+class FakePI3DTexture():
+    def __init__(self, shape):
+        self.image = np.zeros(shape, dtype=np.uint8)
+        self.iy, self.ix = shape[:2]
+        self.i_format = None
+        self.mipmap = True
+        self._tex = 1
+        self.update_cnt = 0
+
+    def _get_format_from_array(self, arr, req_format):
+        return arr.shape[2]
+
+    def load_opengl(self):
+        self.update_ndarray()
+
+    def update_ndarray(self):
+        self.update_cnt += 1
+        self.image = None
+
+@pytest.fixture
+def fake_gl(monkeypatch):
+    gl = FakeGL()
+    constants = types.ModuleType('pi3d.constants')
+    constants.gl = types.ModuleType('pi3d.constants.gl')
+    constants.gl.GL_TEXTURE_2D = 0x0DE1
+    constants.gl.GL_UNSIGNED_BYTE = 0x1401
+    monkeypatch.setitem(sys.modules, 'pi3d.constants', constants)
+    monkeypatch.setitem(sys.modules, 'pi3d.constants.gl', constants.gl)
+    monkeypatch.setattr(Slide.pi3d, 'opengles', gl, raising=False)
+    return gl
+
+def test_pi3d_upload_same_shape_replaces_pixels(fake_gl):
+    backend = Slide.PI3DTextures()
+    tex = backend.create(FakePI3DTexture((48, 64, 4)))
+    backend.upload(tex, FakePI3DTexture((48, 64, 4)))
+    assert tex.update_cnt == 1
+    assert fake_gl.calls == ['glBindTexture', 'glTexSubImage2D', 'glGenerateMipmap']
+
+@pytest.mark.parametrize('shape', [(64, 48, 4), (48, 64, 2)])
+def test_pi3d_upload_new_shape_specifies_again(fake_gl, shape):
+    backend = Slide.PI3DTextures()
+    tex = backend.create(FakePI3DTexture((48, 64, 4)))
+    staged = FakePI3DTexture(shape)
+    backend.upload(tex, staged)
+    assert tex.update_cnt == 2
+    assert (tex.iy, tex.ix) == shape[:2]
+    assert 'glTexSubImage2D' not in fake_gl.calls
+    # The next one the same shape only replaces the pixels
+    backend.upload(tex, FakePI3DTexture(shape))
+    assert tex.update_cnt == 2
+    assert fake_gl.calls[-2] == 'glTexSubImage2D'